@@ -0,0 +1,171 @@
+"""
+asyncio runtime for the bot, built on telebot's AsyncTeleBot.
+
+Runs the handlers registered in bot.py, so both runtimes share all of their
+logic. Start it with `python async_bot.py` instead of `python bot.py`.
+
+Telegram I/O happens on the event loop:
+- outbound messages (reminders, backups, lists) are tasks on a
+  delivery.TAsyncOutboundQueue, so any number of sends can be in flight
+  without a thread each;
+- the backup ping, reminder and cleanup loops are tasks instead of threads.
+
+The handlers are bot.py's synchronous functions. They run on a bounded
+executor together with every other database access, one at a time per chat,
+and the Telegram calls they make are forwarded to the AsyncTeleBot.
+
+Known limit: a handler's Telegram call still blocks its executor thread until
+the event loop has finished it (TSyncBotBridge waits on the result), so slow
+Bot API responses can tie up all EXECUTOR_WORKERS threads. Only the messages
+sent through `outbound` are fully asynchronous.
+"""
+
+import asyncio
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from telebot.async_telebot import AsyncTeleBot
+
+import bot as handlers
+import db
+import delivery
+import utils
+
+# Threads running handlers and database work, the only threads the runtime uses
+EXECUTOR_WORKERS = int(os.getenv("EXECUTOR_WORKERS", 8))
+# Handler lists copied from bot.py's TeleBot
+HANDLER_KINDS = ("message", "edited_message", "callback_query", "pre_checkout_query")
+
+
+class TSyncBotBridge:
+    """
+    Stands in for bot.py's TeleBot: a Bot API call made from a handler thread
+    is run by the AsyncTeleBot on the event loop and its result returned.
+    """
+
+    def __init__(self, async_bot: AsyncTeleBot, loop: asyncio.AbstractEventLoop):
+        self.async_bot = async_bot
+        self.loop = loop
+
+    def __getattr__(self, name: str):
+        method = getattr(self.async_bot, name)
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(
+                method(*args, **kwargs), self.loop
+            ).result()
+
+        return call
+
+
+def get_chat_id(update: Any) -> int:
+    """Chat of the message, callback query or pre-checkout query passed to a handler."""
+    chat = getattr(update, "chat", None)
+    if chat is not None:
+        return chat.id
+    message = getattr(update, "message", None)
+    if message is not None:
+        return message.chat.id
+    return update.from_user.id
+
+
+class TAsyncRuntime:
+    def __init__(self, token: str, workers: int = EXECUTOR_WORKERS):
+        self.async_bot = AsyncTeleBot(token)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        # chat_id -> (lock keeping the chat's updates in order, updates in flight)
+        self._chats: dict[int, list] = {}
+        self._tasks: list[asyncio.Task] = []
+
+    async def run_sync(self, func: Callable, *args) -> Any:
+        """Run a blocking function, e.g. a database call, on the executor."""
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def register_handlers(self, sync_bot) -> None:
+        """Register every handler of a TeleBot on the AsyncTeleBot, with the same filters."""
+        for kind in HANDLER_KINDS:
+            register = getattr(self.async_bot, f"register_{kind}_handler")
+            for handler in getattr(sync_bot, f"{kind}_handlers", []):
+                register(self._wrap(handler["function"]), **handler["filters"])
+
+    def _wrap(self, func: Callable[[Any], None]):
+        async def handle(update):
+            chat_id = get_chat_id(update)
+            chat = self._chats.setdefault(chat_id, [asyncio.Lock(), 0])
+            chat[1] += 1
+            try:
+                async with chat[0]:
+                    await self.run_sync(func, update)
+            finally:
+                chat[1] -= 1
+                if chat[1] == 0:
+                    del self._chats[chat_id]
+
+        return handle
+
+    async def backup_pings(self) -> None:
+        while True:
+            await asyncio.sleep(handlers.BACKUP_PING_CHECK_SECONDS)
+            try:
+                await self.run_sync(handlers.send_due_backups)
+            except Exception as e:
+                logging.error(f"Error during backup ping processing: {e}")
+
+    async def birthday_pings(self) -> None:
+        await self.run_sync(handlers.build_reminder_schedule)
+        await handlers.reminder_scheduler.run_async(self.executor)
+
+    async def cleaner(self) -> None:
+        while True:
+            try:
+                await self.run_sync(handlers.clean_up)
+            except Exception as e:
+                logging.error(f"Error in cleanup task: {e}")
+                utils.log_exception(e)
+            await asyncio.sleep(handlers.CLEANUP_INTERVAL_SECONDS)
+
+    async def run(self) -> None:
+        await self.run_sync(db.init_db)
+
+        # Point bot.py at the async runtime once its handlers are copied over
+        self.register_handlers(handlers.bot)
+        handlers.bot = TSyncBotBridge(self.async_bot, asyncio.get_running_loop())
+        handlers.outbound = delivery.TAsyncOutboundQueue(self.async_bot.send_message)
+        handlers.outbound.start()
+
+        logging.info("Starting backup ping, birthday ping and cleanup tasks...")
+        self._tasks = [
+            asyncio.create_task(self.backup_pings()),
+            asyncio.create_task(self.birthday_pings()),
+            asyncio.create_task(self.cleaner()),
+        ]
+
+        logging.info("Bot is running on asyncio...")
+        try:
+            await self.async_bot.infinity_polling(timeout=60)
+        finally:
+            logging.info("Shutting down bot gracefully...")
+            for task in self._tasks:
+                task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            await handlers.outbound.join()
+            await self.async_bot.close_session()
+            self.executor.shutdown(wait=True)
+            db.close_connections()
+
+
+if __name__ == "__main__":
+    if handlers.WEBHOOK_MODE:
+        logging.critical("WEBHOOK_MODE is not supported by the asyncio runtime, run bot.py")
+        sys.exit(1)
+
+    try:
+        asyncio.run(TAsyncRuntime(handlers.TOKEN).run())
+    except KeyboardInterrupt:
+        pass
+    except Exception as e:
+        logging.critical(f"Bot polling encountered an error: {e}")
+        utils.log_exception(e)
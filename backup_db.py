@@ -1,82 +1,509 @@
 #!/usr/bin/env python3
 """
 Database backup utility for Birthday Reminder Bot
-Creates multiple types of backups for maximum safety
+
+Backups are taken in-process with SQLite's online backup API, a batch of
+pages per step, so a running bot keeps working while a backup is made, and
+are stored compressed (zstd if the zstandard package is installed, gzip
+otherwise). A full backup is followed by incremental ones that only hold the
+pages changed since the previous backup, found by comparing page hashes that
+only the latest backup keeps, in a .hashes file next to its manifest. Each
+backup has a JSON manifest with checksums, which verify and restore check
+before using it. Only the latest KEEP_FULL_BACKUPS full backups and their
+incremental backups, and the latest KEEP_DUMPS SQL dumps, are kept.
+
+Usage:
+    python backup_db.py                   # incremental backup, or full when due
+    python backup_db.py full              # full backup
+    python backup_db.py dump              # compressed SQL dump
+    python backup_db.py list
+    python backup_db.py verify [backup]   # the latest backup by default
+    python backup_db.py restore <backup>  # a backup name or a plain .db file
 """
 
+import gzip
+import hashlib
+import json
 import os
-import subprocess
+import shutil
+import sqlite3
+import struct
+import tempfile
 from datetime import datetime
+from typing import BinaryIO, Callable
 
+try:
+    import zstandard
+except ImportError:  # Optional, backups fall back to gzip
+    zstandard = None
 
-def create_backup():
-    """Creates backup of the main database"""
+DB_FILE = os.getenv("DB_FILE", "data.db")
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_COMPRESSION = os.getenv("BACKUP_COMPRESSION", "zstd" if zstandard else "gzip")
+
+# Pages copied per step of the online backup, the database is only locked for a step
+BACKUP_PAGES_PER_STEP = 1024
+# Incremental backups taken after a full backup before the next full one
+INCREMENTALS_PER_FULL = 6
+# Full backups kept, together with their incremental backups
+KEEP_FULL_BACKUPS = 4
+# SQL dumps kept
+KEEP_DUMPS = 4
+
+COMPRESSION_EXTENSIONS = {"gzip": ".gz", "zstd": ".zst"}
+# Incremental backup: magic, page size and page count, then a
+# (page number, page) record per changed page
+PAGES_MAGIC = b"BRBPAGES"
+PAGES_HEADER = struct.Struct(">II")
+PAGE_NUMBER = struct.Struct(">I")
+# Size of a page hash in a .hashes file
+PAGE_HASH_SIZE = 16
+DUMP_PREFIX = "data_dump_"
+CHUNK_SIZE = 1024 * 1024
+
+
+class BackupError(Exception):
+    """A backup is missing, corrupted or doesn't match its manifest."""
+
+
+def open_compressed(path: str, mode: str) -> BinaryIO:
+    """Open a .gz or .zst file for streaming reads ("rb") or writes ("wb")."""
+    if path.endswith(COMPRESSION_EXTENSIONS["zstd"]):
+        if zstandard is None:
+            raise BackupError(f"{path} is zstd compressed, install zstandard to use it")
+        raw = open(path, mode)
+        if mode == "wb":
+            return zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+    return gzip.open(path, mode)
+
+
+def read_exact(source: BinaryIO, size: int) -> bytes:
+    """Read exactly size bytes, or fewer only at the end of the stream."""
+    chunks = []
+    while size > 0:
+        chunk = source.read(size)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b"".join(chunks)
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_page_size(path: str) -> int:
+    """Page size from the database header, where 1 stands for 65536."""
+    with open(path, "rb") as f:
+        f.seek(16)
+        (page_size,) = struct.unpack(">H", f.read(2))
+    return 65536 if page_size == 1 else page_size
+
+
+def snapshot(
+    db_file: str,
+    target: str,
+    pages: int = BACKUP_PAGES_PER_STEP,
+    progress: Callable[[int, int, int], None] | None = None,
+) -> None:
+    """
+    Copy a consistent image of a live database, including what is still in
+    its WAL, to target with the online backup API.
+
+    Args:
+        db_file: Database to copy
+        target: Path of the copy
+        pages: Pages copied per step; locks are released between steps
+        progress: Called after each step with (status, remaining, total) pages
+    """
+    source = sqlite3.connect(db_file)
+    try:
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination, pages=pages, progress=progress)
+        finally:
+            destination.close()
+    finally:
+        source.close()
+
+
+def list_backups(backup_dir: str = BACKUP_DIR) -> list[dict]:
+    """Manifests of all finished backups, oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    manifests = []
+    for filename in os.listdir(backup_dir):
+        if filename.endswith(".json"):
+            with open(os.path.join(backup_dir, filename)) as f:
+                manifests.append(json.load(f))
+    manifests.sort(key=lambda manifest: manifest["name"])
+    return manifests
+
+
+def get_chain(manifests: list[dict], manifest: dict) -> list[dict]:
+    """The full backup a backup builds on and every backup up to it, in order."""
+    by_name = {m["name"]: m for m in manifests}
+    chain = [manifest]
+    while chain[-1]["parent"] is not None:
+        parent = by_name.get(chain[-1]["parent"])
+        if parent is None:
+            raise BackupError(f"Backup {chain[-1]['parent']} of {manifest['name']} is missing")
+        chain.append(parent)
+    chain.reverse()
+    return chain
+
+
+def _chain_length(manifests: list[dict], manifest: dict) -> int:
+    """Length of a backup's chain, or a length that makes the next backup full if it is broken."""
+    try:
+        return len(get_chain(manifests, manifest))
+    except BackupError:
+        return INCREMENTALS_PER_FULL + 1
+
+
+def _write_manifest(backup_dir: str, manifest: dict) -> None:
+    # Written last and renamed into place, so interrupted backups are never listed
+    path = os.path.join(backup_dir, f"{manifest['name']}.json")
+    with open(f"{path}.tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _hashes_path(backup_dir: str, name: str) -> str:
+    return os.path.join(backup_dir, f"{name}.hashes")
+
+
+def _read_page_hashes(backup_dir: str, name: str) -> list[bytes] | None:
+    """Page hashes of a backup, or None if it isn't the latest one and has none anymore."""
+    try:
+        with open(_hashes_path(backup_dir, name), "rb") as f:
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    return [data[i:i + PAGE_HASH_SIZE] for i in range(0, len(data), PAGE_HASH_SIZE)]
+
+
+def _write_page_hashes(backup_dir: str, name: str, page_hashes: list[bytes]) -> None:
+    path = _hashes_path(backup_dir, name)
+    with open(f"{path}.tmp", "wb") as f:
+        f.write(b"".join(page_hashes))
+    os.replace(f"{path}.tmp", path)
+
+
+def _remove_if_exists(path: str) -> None:
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def take_backup(
+    db_file: str = DB_FILE,
+    backup_dir: str = BACKUP_DIR,
+    full: bool = False,
+    compression: str = BACKUP_COMPRESSION,
+    progress: Callable[[int, int, int], None] | None = None,
+) -> dict:
+    """
+    Back up a database, incrementally unless a full backup is asked for or due.
+
+    A full backup is the compressed database image. An incremental one holds
+    the pages whose hash differs from the previous backup, and is taken when
+    there is a previous backup with the same page size and page hashes, and
+    fewer than INCREMENTALS_PER_FULL incremental backups follow its full
+    backup. The new backup's page hashes replace the previous backup's.
+
+    Returns:
+        The manifest of the new backup
+    """
+    os.makedirs(backup_dir, exist_ok=True)
+    manifests = list_backups(backup_dir)
+    name = f"data_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    extension = COMPRESSION_EXTENSIONS[compression]
+
+    with tempfile.TemporaryDirectory(dir=backup_dir) as tmp_dir:
+        image = os.path.join(tmp_dir, "snapshot.db")
+        snapshot(db_file, image, progress=progress)
+        page_size = read_page_size(image)
+
+        parent = manifests[-1] if manifests else None
+        parent_hashes = (
+            _read_page_hashes(backup_dir, parent["name"])
+            if not full and parent is not None and parent["page_size"] == page_size
+            else None
+        )
+        incremental = (
+            parent_hashes is not None
+            and _chain_length(manifests, parent) <= INCREMENTALS_PER_FULL
+        )
+        if not incremental:
+            parent_hashes = []
+        artifact = f"{name}.pages{extension}" if incremental else f"{name}.db{extension}"
+
+        page_hashes = []
+        database_digest = hashlib.sha256()
+        with open(image, "rb") as source, open_compressed(
+            os.path.join(backup_dir, artifact), "wb"
+        ) as out:
+            if incremental:
+                page_count = os.path.getsize(image) // page_size
+                out.write(PAGES_MAGIC + PAGES_HEADER.pack(page_size, page_count))
+            while page := source.read(page_size):
+                page_number = len(page_hashes)
+                page_hash = hashlib.blake2b(page, digest_size=PAGE_HASH_SIZE).digest()
+                page_hashes.append(page_hash)
+                database_digest.update(page)
+                if not incremental:
+                    out.write(page)
+                elif page_number >= len(parent_hashes) or parent_hashes[page_number] != page_hash:
+                    out.write(PAGE_NUMBER.pack(page_number) + page)
+
+    changed_pages = sum(
+        1
+        for page_number, page_hash in enumerate(page_hashes)
+        if page_number >= len(parent_hashes) or parent_hashes[page_number] != page_hash
+    )
+    manifest = {
+        "name": name,
+        "kind": "incremental" if incremental else "full",
+        "parent": parent["name"] if incremental else None,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "artifact": artifact,
+        "artifact_sha256": file_sha256(os.path.join(backup_dir, artifact)),
+        "database_sha256": database_digest.hexdigest(),
+        "page_size": page_size,
+        "page_count": len(page_hashes),
+        "changed_pages": changed_pages,
+    }
+    _write_page_hashes(backup_dir, name, page_hashes)
+    _write_manifest(backup_dir, manifest)
+    if parent is not None:
+        _remove_if_exists(_hashes_path(backup_dir, parent["name"]))
+    return manifest
+
+
+def list_dumps(backup_dir: str = BACKUP_DIR) -> list[str]:
+    """File names of all SQL dumps, oldest first."""
+    if not os.path.isdir(backup_dir):
+        return []
+    return sorted(
+        filename
+        for filename in os.listdir(backup_dir)
+        if filename.startswith(DUMP_PREFIX) and ".sql" in filename
+    )
+
+
+def rotate_backups(
+    backup_dir: str = BACKUP_DIR,
+    keep_full: int = KEEP_FULL_BACKUPS,
+    keep_dumps: int = KEEP_DUMPS,
+) -> list[str]:
+    """
+    Delete everything older than the keep_full latest full backups, whole
+    chains at a time since an incremental backup always follows its parent,
+    and all but the keep_dumps latest SQL dumps.
+
+    Returns:
+        Names of the deleted backups and file names of the deleted dumps
+    """
+    removed = []
+    manifests = list_backups(backup_dir)
+    fulls = [manifest for manifest in manifests if manifest["kind"] == "full"]
+    if len(fulls) > keep_full:
+        oldest_kept = fulls[-keep_full]["name"]
+        for manifest in manifests:
+            if manifest["name"] >= oldest_kept:
+                break
+            # The manifest goes first, a backup without one is not listed anymore
+            os.remove(os.path.join(backup_dir, f"{manifest['name']}.json"))
+            _remove_if_exists(os.path.join(backup_dir, manifest["artifact"]))
+            _remove_if_exists(_hashes_path(backup_dir, manifest["name"]))
+            removed.append(manifest["name"])
+
+    dumps = list_dumps(backup_dir)
+    for dump in dumps[: max(len(dumps) - keep_dumps, 0)]:
+        os.remove(os.path.join(backup_dir, dump))
+        removed.append(dump)
+    return removed
+
+
+def find_backup(backup: str, backup_dir: str = BACKUP_DIR) -> dict | None:
+    """Manifest of a backup given by name, or by the path of its manifest or file."""
+    name = os.path.basename(backup).split(".")[0]
+    return next((m for m in list_backups(backup_dir) if m["name"] == name), None)
+
+
+def reconstruct(manifest: dict, target: str, backup_dir: str = BACKUP_DIR) -> None:
+    """
+    Rebuild the database a backup was taken of at target, checking the
+    checksum of every file used and of the result.
+    """
+    chain = get_chain(list_backups(backup_dir), manifest)
+    for link in chain:
+        path = os.path.join(backup_dir, link["artifact"])
+        if not os.path.exists(path):
+            raise BackupError(f"{link['artifact']} is missing")
+        if file_sha256(path) != link["artifact_sha256"]:
+            raise BackupError(f"{link['artifact']} doesn't match its checksum")
+
+    with open_compressed(os.path.join(backup_dir, chain[0]["artifact"]), "rb") as source:
+        with open(target, "wb") as out:
+            shutil.copyfileobj(source, out, CHUNK_SIZE)
+
+    with open(target, "r+b") as out:
+        for link in chain[1:]:
+            with open_compressed(os.path.join(backup_dir, link["artifact"]), "rb") as source:
+                header = read_exact(source, len(PAGES_MAGIC) + PAGES_HEADER.size)
+                if not header.startswith(PAGES_MAGIC):
+                    raise BackupError(f"{link['artifact']} is not an incremental backup")
+                page_size, page_count = PAGES_HEADER.unpack(header[len(PAGES_MAGIC):])
+                while record := read_exact(source, PAGE_NUMBER.size + page_size):
+                    (page_number,) = PAGE_NUMBER.unpack(record[: PAGE_NUMBER.size])
+                    out.seek(page_number * page_size)
+                    out.write(record[PAGE_NUMBER.size:])
+            out.truncate(page_count * page_size)
+
+    if file_sha256(target) != manifest["database_sha256"]:
+        raise BackupError(f"Restored {manifest['name']} doesn't match its checksum")
+
+
+def check_integrity(db_file: str) -> None:
+    conn = sqlite3.connect(db_file)
+    try:
+        (result,) = conn.execute("PRAGMA integrity_check").fetchone()
+    finally:
+        conn.close()
+    if result != "ok":
+        raise BackupError(f"Integrity check failed: {result}")
+
+
+def dump_database(
+    db_file: str = DB_FILE,
+    backup_dir: str = BACKUP_DIR,
+    compression: str = BACKUP_COMPRESSION,
+) -> str:
+    """Write a compressed SQL dump, statement by statement; returns its path."""
+    os.makedirs(backup_dir, exist_ok=True)
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(
+        backup_dir, f"{DUMP_PREFIX}{timestamp}.sql{COMPRESSION_EXTENSIONS[compression]}"
+    )
+    conn = sqlite3.connect(db_file)
+    try:
+        with open_compressed(path, "wb") as out:
+            for statement in conn.iterdump():
+                out.write(f"{statement}\n".encode("utf-8"))
+    finally:
+        conn.close()
+    return path
+
+
+def print_progress(status: int, remaining: int, total: int) -> None:
+    if total:
+        print(f"   {100 * (total - remaining) // total}% of {total} pages copied")
 
-    # Ensure backup directory exists
-    os.makedirs("backups", exist_ok=True)
 
+def create_backup(full: bool = False):
+    """Creates backup of the main database"""
     # Only backup if main database exists
-    if not os.path.exists("data.db"):
-        print("❌ Main database data.db not found!")
+    if not os.path.exists(DB_FILE):
+        print(f"❌ Main database {DB_FILE} not found!")
         return False
 
     try:
-        # 1. Simple file copy
-        subprocess.run(
-            ["cp", "data.db", f"backups/data_backup_{timestamp}.db"], check=True
-        )
+        manifest = take_backup(DB_FILE, BACKUP_DIR, full=full, progress=print_progress)
+        removed = rotate_backups(BACKUP_DIR)
+    except (sqlite3.Error, OSError, BackupError) as e:
+        print(f"❌ Backup failed: {e}")
+        return False
 
-        # 2. SQLite .backup command
-        subprocess.run(
-            [
-                "sqlite3",
-                "data.db",
-                f".backup backups/data_sqlite_backup_{timestamp}.db",
-            ],
-            check=True,
-        )
+    print(
+        f"✅ {manifest['kind'].capitalize()} backup created successfully: {manifest['name']} "
+        f"({manifest['changed_pages']} of {manifest['page_count']} pages)"
+    )
+    if removed:
+        print(f"🗑 Removed {len(removed)} old backups")
+    return True
 
-        # 3. SQL dump
-        with open(f"backups/data_dump_{timestamp}.sql", "w") as f:
-            subprocess.run(["sqlite3", "data.db", ".dump"], stdout=f, check=True)
 
-        print(f"✅ Backup created successfully: {timestamp}")
-        return True
+def verify_backup(backup: str | None = None):
+    """Check a backup's checksums and the integrity of the database it restores"""
+    if backup is not None:
+        manifest = find_backup(backup, BACKUP_DIR)
+    else:
+        manifests = list_backups(BACKUP_DIR)
+        manifest = manifests[-1] if manifests else None
+    if manifest is None:
+        print(f"❌ Backup {backup or 'to verify'} not found!")
+        return False
 
-    except subprocess.CalledProcessError as e:
-        print(f"❌ Backup failed: {e}")
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            restored = os.path.join(tmp_dir, "restored.db")
+            reconstruct(manifest, restored, BACKUP_DIR)
+            check_integrity(restored)
+    except (sqlite3.Error, OSError, BackupError) as e:
+        print(f"❌ Backup {manifest['name']} is broken: {e}")
         return False
 
+    print(f"✅ Backup {manifest['name']} verified")
+    return True
+
 
 def restore_from_backup(backup_file):
     """Restore database from backup file"""
-    if not os.path.exists(backup_file):
+    manifest = find_backup(backup_file, BACKUP_DIR)
+    if manifest is None and not os.path.exists(backup_file):
         print(f"❌ Backup file {backup_file} not found!")
         return False
 
     try:
-        # Create restore point first
-        if os.path.exists("data.db"):
-            create_backup()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            if manifest is not None:
+                restored = os.path.join(tmp_dir, "restored.db")
+                reconstruct(manifest, restored, BACKUP_DIR)
+            else:
+                # A plain database file, e.g. from the old backup script
+                restored = backup_file
+            check_integrity(restored)
 
-        # Restore from backup
-        subprocess.run(["cp", backup_file, "data.db"], check=True)
-        print(f"✅ Database restored from {backup_file}")
-        return True
+            # Create restore point first
+            if os.path.exists(DB_FILE):
+                create_backup()
 
-    except subprocess.CalledProcessError as e:
+            # Copied with the backup API too, so a running bot sees the change
+            snapshot(restored, DB_FILE)
+    except (sqlite3.Error, OSError, BackupError) as e:
         print(f"❌ Restore failed: {e}")
         return False
 
+    print(f"✅ Database restored from {backup_file}")
+    return True
+
 
 if __name__ == "__main__":
     import sys
 
-    if len(sys.argv) > 1 and sys.argv[1] == "restore":
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command == "restore":
         if len(sys.argv) < 3:
             print("Usage: python backup_db.py restore <backup_file>")
             sys.exit(1)
-        restore_from_backup(sys.argv[2])
+        sys.exit(0 if restore_from_backup(sys.argv[2]) else 1)
+    elif command == "verify":
+        sys.exit(0 if verify_backup(sys.argv[2] if len(sys.argv) > 2 else None) else 1)
+    elif command == "list":
+        for manifest in list_backups(BACKUP_DIR):
+            print(
+                f"{manifest['name']}  {manifest['kind']:<11}  "
+                f"{manifest['changed_pages']}/{manifest['page_count']} pages"
+            )
+    elif command == "dump":
+        print(f"✅ Dump created: {dump_database()}")
+        rotate_backups(BACKUP_DIR)
     else:
-        create_backup()
+        create_backup(full=command == "full")
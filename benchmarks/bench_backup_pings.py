@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark: one tick of the backup ping loop with many registered chats.
+
+Registers N chats (default 100k), a fifth of them with an active backup ping,
+of which 1% are due, and times finding and rescheduling the due chats.
+
+"before" is the previous loop: every chat ID from user_reminder_settings, then
+select_from_backup_ping and a timestamp parse per chat; "after" is
+db.claim_due_backup_pings, an index range scan over next_due.
+
+Usage: python benchmarks/bench_backup_pings.py [chats]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+def populate(count: int, now: int) -> None:
+    settings = []
+    for chat_id in range(count):
+        if chat_id % 5:
+            continue
+        # Every 100th active chat got its last backup two hours ago
+        last_updated = now - (7200 if chat_id % 500 == 0 else 60)
+        settings.append((chat_id, last_updated, 60, last_updated + 3600))
+
+    with db.transaction() as cursor:
+        cursor.executemany(
+            "INSERT INTO user_reminder_settings (chat_id) VALUES (?)",
+            ((chat_id,) for chat_id in range(count)),
+        )
+        cursor.executemany(
+            """
+            INSERT INTO backup_ping_settings
+                (chat_id, last_updated_timestamp, update_timedelta, is_active, next_due)
+            VALUES (?, datetime(?, 'unixepoch', 'localtime'), ?, TRUE, ?)
+            """,
+            settings,
+        )
+
+
+def legacy_tick(now: int) -> list[int]:
+    due = []
+    chat_ids = (
+        db.get_connection()
+        .execute("SELECT DISTINCT chat_id FROM user_reminder_settings")
+        .fetchall()
+    )
+    for (chat_id,) in chat_ids:
+        settings = db.select_from_backup_ping(chat_id)
+        if settings.is_active is False:
+            continue
+        if now - settings.last_updated_timestamp < settings.update_timedelta * 60:
+            continue
+        due.append(chat_id)
+    return due
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    now = int(time.time())
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_FILE = os.path.join(tmp_dir, "bench.db")
+        db.init_db()
+        populate(count, now)
+
+        started = time.perf_counter()
+        legacy_due = legacy_tick(now)
+        legacy_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        due = db.claim_due_backup_pings(now)
+        elapsed = time.perf_counter() - started
+
+        assert sorted(due) == sorted(legacy_due)
+        print(f"before (scan all chats) {count} chats: {legacy_elapsed * 1000:8.1f} ms   {len(legacy_due)} due")
+        print(f"after (next_due index)  {count} chats: {elapsed * 1000:8.1f} ms   {len(due)} due")
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: registering a pasted list of birthdays.
+
+Builds a message of N name/date pairs (default 1000, a 2000-line contact
+export) and times turning it into stored birthdays.
+
+"before" is the previous handler: the message parsed once to validate it and
+again to register it, then db.register_birthday with a commit per pair;
+"after" is utils.parse_birthday_input and db.register_birthdays, one parse
+per date and a single transaction.
+
+Usage: python benchmarks/bench_bulk_register.py [pairs]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import utils  # noqa: E402
+
+CHAT_ID = 1
+
+
+def build_message(count: int) -> str:
+    lines = []
+    for i in range(count):
+        lines.append(f"Person {i}")
+        lines.append(f"{i % 28 + 1}.{i % 12 + 1}.{1950 + i % 50}")
+    return "\n".join(lines)
+
+
+def legacy_register(message: str) -> list[int]:
+    _, errors = utils.parse_birthday_input(message)
+    assert not errors
+    parsed_birthdays, _ = utils.parse_birthday_input(message)
+    return [
+        db.register_birthday(CHAT_ID, name, parsed_date, has_year)
+        for name, parsed_date, has_year in parsed_birthdays
+    ]
+
+
+def bulk_register(message: str) -> list[int]:
+    parsed_birthdays, errors = utils.parse_birthday_input(message)
+    assert not errors
+    return db.register_birthdays(CHAT_ID, parsed_birthdays)
+
+
+def timed(register, message: str, db_file: str) -> tuple[float, int]:
+    db.DB_FILE = db_file
+    db.init_db()
+    started = time.perf_counter()
+    birthday_ids = register(message)
+    elapsed = time.perf_counter() - started
+    db.close_connections()
+    return elapsed, len(birthday_ids)
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    message = build_message(count)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        legacy_elapsed, legacy_count = timed(
+            legacy_register, message, os.path.join(tmp_dir, "legacy.db")
+        )
+        elapsed, bulk_count = timed(bulk_register, message, os.path.join(tmp_dir, "bulk.db"))
+
+    assert legacy_count == bulk_count == count
+    print(f"before (commit per pair) {count} pairs: {legacy_elapsed * 1000:8.1f} ms")
+    print(f"after (one transaction)  {count} pairs: {elapsed * 1000:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+Benchmark: SQLite connects per request, before and after connection pooling.
+
+Replays the database traffic of a single /start request (language lookups for
+every translated string, backup ping settings, reminder settings) and counts
+how many sqlite3 connections are opened.
+
+"before" emulates the old connect-per-call behaviour by closing the pool after
+every db call; "after" uses the per-thread pooled connection.
+
+Usage: python benchmarks/bench_db_connections.py [requests]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import i18n  # noqa: E402
+
+CHAT_ID = 123456789
+
+BUTTONS = [
+    "start",
+    "backup",
+    "register_birthday",
+    "register_backup",
+    "delete_birthday",
+    "unregister_backup",
+    "share",
+    "stats",
+    "language",
+    "support",
+]
+
+WELCOME_MESSAGES = [
+    "welcome_title",
+    "welcome_subtitle",
+    "what_can_bot_do",
+    "bot_features",
+    "how_to_use",
+    "how_to_use_steps",
+    "available_commands",
+    "contribute",
+    "backup_ping_inactive",
+    "configure_reminders",
+    "reminder_example",
+    "days",
+    "days",
+    "days",
+    "days",
+]
+
+
+def simulate_start_request() -> None:
+    db.select_from_backup_ping(CHAT_ID)
+    for button in BUTTONS:
+        if button != "language":
+            i18n.get_button_text(button, CHAT_ID)
+            i18n.get_button_description(button, CHAT_ID)
+    for message_key in WELCOME_MESSAGES:
+        i18n.get_message(message_key, CHAT_ID)
+    for button in BUTTONS:
+        i18n.get_button_text(button, CHAT_ID)
+    db.get_reminder_settings(CHAT_ID)
+
+
+def run(requests: int, pooled: bool) -> tuple[int, float]:
+    original_get_connection = db.get_connection
+
+    def connect_per_call():
+        db.close_connections()
+        return original_get_connection()
+
+    if not pooled:
+        db.get_connection = connect_per_call
+
+    try:
+        db.close_connections()
+        connects_before = db.connection_manager.connects
+        started = time.perf_counter()
+        for _ in range(requests):
+            simulate_start_request()
+        elapsed = time.perf_counter() - started
+        return db.connection_manager.connects - connects_before, elapsed
+    finally:
+        db.get_connection = original_get_connection
+
+
+def main() -> None:
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_FILE = os.path.join(tmp_dir, "bench.db")
+        db.init_db()
+        db.update_reminder_settings(CHAT_ID, [0, 1, 3, 7])
+
+        for label, pooled in (("before (connect per call)", False), ("after (pooled)", True)):
+            connects, elapsed = run(requests, pooled)
+            print(
+                f"{label:<28} connects/request: {connects / requests:7.2f}   "
+                f"ms/request: {elapsed / requests * 1000:7.3f}"
+            )
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
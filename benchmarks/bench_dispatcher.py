@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Load test: update latency under mixed traffic, sequential vs dispatcher lanes.
+
+Feeds a fake stream of N updates (default 3000) from 300 chats at a steady
+rate. Most updates are quick (a reply, ~2 ms of Telegram round-trip), 2% are
+slow (a /backup of a huge list or /stats, ~150 ms). Latency is measured from
+arrival to the end of handling, and reported for the quick updates.
+
+"before" handles updates one at a time on the receiving thread, like
+bot.polling did; "after" uses dispatcher.TUpdateDispatcher. Per-chat order
+is checked for both.
+
+Usage: python benchmarks/bench_dispatcher.py [updates]
+"""
+
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import dispatcher  # noqa: E402
+
+CHATS = 300
+SLOW_SHARE = 0.02
+FAST_SECONDS = 0.002
+SLOW_SECONDS = 0.150
+UPDATES_PER_SECOND = 200
+
+
+def make_updates(count: int) -> list[SimpleNamespace]:
+    rng = random.Random(42)
+    updates = []
+    for update_id in range(count):
+        chat = SimpleNamespace(id=rng.randrange(CHATS))
+        slow = rng.random() < SLOW_SHARE
+        message = SimpleNamespace(chat=chat, text="/backup" if slow else "hi")
+        updates.append(SimpleNamespace(update_id=update_id, message=message))
+    return updates
+
+
+def run(updates: list[SimpleNamespace], workers: int | None) -> tuple[list[float], bool]:
+    arrived = {}
+    latencies = []
+    handled_by_chat: dict[int, list[int]] = {}
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def handle_update(update):
+        slow = update.message.text == "/backup"
+        time.sleep(SLOW_SECONDS if slow else FAST_SECONDS)
+        with lock:
+            if not slow:
+                latencies.append(time.perf_counter() - arrived[update.update_id])
+            handled_by_chat.setdefault(update.message.chat.id, []).append(update.update_id)
+            if sum(map(len, handled_by_chat.values())) == len(updates):
+                done.set()
+
+    if workers is None:
+        submit = handle_update
+    else:
+        updates_dispatcher = dispatcher.TUpdateDispatcher(handle_update, workers=workers)
+        updates_dispatcher.start()
+        submit = updates_dispatcher.submit
+
+    started = time.perf_counter()
+    for index, update in enumerate(updates):
+        # Updates arrive at a steady rate, and queue up if handling falls behind
+        arrival = started + index / UPDATES_PER_SECOND
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        arrived[update.update_id] = arrival
+        submit(update)
+    done.wait()
+
+    if workers is not None:
+        updates_dispatcher.stop()
+
+    in_order = all(ids == sorted(ids) for ids in handled_by_chat.values())
+    return latencies, in_order
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3000
+    updates = make_updates(count)
+
+    for label, workers in (
+        ("before (sequential)", None),
+        (f"after ({dispatcher.WORKERS} lanes)", dispatcher.WORKERS),
+    ):
+        latencies, in_order = run(updates, workers)
+        quantiles = statistics.quantiles(latencies, n=100)
+        print(
+            f"{label:<20} p50: {quantiles[49] * 1000:8.1f} ms   "
+            f"p95: {quantiles[94] * 1000:8.1f} ms   p99: {quantiles[98] * 1000:8.1f} ms   "
+            f"per-chat order kept: {in_order}"
+        )
+
+
+if __name__ == "__main__":
+    main()
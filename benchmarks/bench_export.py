@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: exporting a chat with many birthdays.
+
+Registers N birthdays (default 100k) in one chat and exports them.
+
+"before" is the previous /share: the share text split into 4096 character
+messages, each a separate Bot API call counted against the chat's flood
+limit; "after" is exporter.export_birthdays, one file per format sent with a
+single send_document. Peak memory is measured with tracemalloc and is
+bounded by exporter.EXPORT_BUFFER_SIZE, not by the number of birthdays.
+
+Usage: python benchmarks/bench_export.py [birthdays]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+import exporter  # noqa: E402
+import utils  # noqa: E402
+
+CHAT_ID = 1
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db.DB_FILE = os.path.join(tmp_dir, "bench.db")
+        db.init_db()
+        start = datetime(1950, 1, 1)
+        db.register_birthdays(
+            CHAT_ID,
+            [
+                (f"Person number {i}", start + timedelta(days=i % 20000), i % 3 != 0)
+                for i in range(count)
+            ],
+        )
+
+        started = time.perf_counter()
+        messages = sum(
+            1
+            for _ in utils.split_lines(
+                exporter.iter_share_lines(db.iter_birthdays(CHAT_ID))
+            )
+        )
+        elapsed = time.perf_counter() - started
+        print(
+            f"before (share messages)  {count} birthdays: {elapsed * 1000:8.1f} ms   "
+            f"{messages} messages"
+        )
+
+        for export_format in exporter.TExportFormat:
+            started = time.perf_counter()
+            with exporter.export_birthdays(CHAT_ID, export_format) as (document, _):
+                size = document.seek(0, os.SEEK_END)
+            elapsed = time.perf_counter() - started
+
+            # Measured separately, tracemalloc slows down the export a lot
+            tracemalloc.start()
+            with exporter.export_birthdays(CHAT_ID, export_format):
+                pass
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(
+                f"after ({export_format.value:5} document) {count} birthdays: "
+                f"{elapsed * 1000:8.1f} ms   1 document of {size / 1024 / 1024:5.1f} MB, "
+                f"peak {peak / 1024 / 1024:5.1f} MB"
+            )
+
+        db.close_connections()
+
+
+if __name__ == "__main__":
+    main()
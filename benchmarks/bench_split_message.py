@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark: splitting a long listing into Telegram-sized messages.
+
+Splits N lines (default 100k) of birthday-listing sized text into 4096
+character chunks.
+
+"before" is the previous utils.split_message, which re-summed the lengths of
+the current chunk for every line; "after" is utils.split_lines fed from a
+generator, so the full text is never built as one string.
+
+Usage: python benchmarks/bench_split_message.py [lines]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utils  # noqa: E402
+
+
+def legacy_split_message(message: str, max_length: int = 4096) -> list[str]:
+    lines = message.split("\n")
+    chunks = []
+    current_chunk = []
+
+    for line in lines:
+        if sum(len(chunk) + 1 for chunk in current_chunk) + len(line) + 1 > max_length:
+            chunks.append("\n".join(current_chunk))
+            current_chunk = []
+
+        current_chunk.append(line)
+
+    if current_chunk:
+        chunks.append("\n".join(current_chunk))
+
+    return chunks
+
+
+def make_line(i: int) -> str:
+    return f"- {i % 28 + 1:02d} May 1990, Person {i}, _(Current age: 35 years)_, ID: {i}"
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    started = time.perf_counter()
+    legacy_chunks = legacy_split_message("\n".join(make_line(i) for i in range(count)))
+    legacy_elapsed = time.perf_counter() - started
+
+    started = time.perf_counter()
+    chunks = list(utils.split_lines(make_line(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+
+    assert "\n".join(chunks) == "\n".join(legacy_chunks)
+    assert all(len(chunk) <= utils.MAX_MESSAGE_LENGTH for chunk in chunks)
+
+    print(f"before (re-summing) {count} lines: {legacy_elapsed:6.3f}s  {len(legacy_chunks)} chunks")
+    print(f"after (streaming)   {count} lines: {elapsed:6.3f}s  {len(chunks)} chunks")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark: building and formatting TBirthday objects for a large listing.
+
+Formats N birthday rows (default 100k), as /backup does for every line, and
+reports time and memory tracked by tracemalloc:
+- "retained" is the memory held by the N TBirthday objects themselves,
+- "peak" is the peak while building them and formatting every line.
+
+"before" is the previous TBirthday (a full datetime parsed with strptime per
+row, datetime.now() twice per formatted row); "after" is db.TBirthday with a
+today snapshot taken once for the whole batch.
+
+Usage: python benchmarks/bench_tbirthday.py [rows]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db  # noqa: E402
+
+
+class LegacyTBirthday:
+    def __init__(self, select_result: tuple, need_id: bool = False):
+        self.need_id = need_id
+        self.id = int(select_result[0])
+        self.name = select_result[2]
+        self.birthday = datetime.strptime(select_result[3], "%Y-%m-%d")
+        self.has_year = bool(select_result[4])
+
+    def __str__(self):
+        birthday_format = "%d %B %Y" if self.has_year else "%d %B"
+        birthday_str = self.birthday.strftime(birthday_format)
+
+        age_text = ""
+        if self.has_year:
+            current_year = datetime.now().year
+            age = current_year - self.birthday.year
+            birthday_this_year = db._safe_replace_year(self.birthday, current_year)
+            if datetime.now() < birthday_this_year:
+                age -= 1
+            age_text = f", _(Current age: {age} years)_"
+
+        id_text = f", ID: {self.id}" if self.need_id else ""
+
+        return f"{birthday_str}, {self.name}{age_text}{id_text}"
+
+
+def make_rows(count: int) -> list[tuple]:
+    rng = random.Random(42)
+    rows = []
+    for i in range(count):
+        birthday = date(rng.randint(1940, 2010), rng.randint(1, 12), rng.randint(1, 28))
+        rows.append((i, 1, f"Person {i}", birthday.isoformat(), rng.random() < 0.7))
+    return rows
+
+
+def run(rows: list[tuple], build) -> tuple[float, int, int]:
+    tracemalloc.start()
+    started = time.perf_counter()
+
+    before = tracemalloc.get_traced_memory()[0]
+    birthdays = build(rows)
+    retained = tracemalloc.get_traced_memory()[0] - before
+    lines = [str(birthday) for birthday in birthdays]
+
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert len(lines) == len(rows)
+    return elapsed, retained, peak
+
+
+def main() -> None:
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    rows = make_rows(count)
+
+    def build_legacy(rows):
+        return [LegacyTBirthday(row) for row in rows]
+
+    def build_slotted(rows):
+        today = date.today()
+        return [db.TBirthday(row, today=today) for row in rows]
+
+    # Both produce the same text
+    assert [str(b) for b in build_legacy(rows[:1000])] == [
+        str(b) for b in build_slotted(rows[:1000])
+    ]
+
+    for label, build in (("before (strptime)", build_legacy), ("after (slotted)", build_slotted)):
+        elapsed, retained, peak = run(rows, build)
+        print(
+            f"{label:<18} {count} rows: {elapsed:6.2f}s   "
+            f"retained: {retained / count:6.1f} B/row   peak: {peak / 2**20:7.1f} MiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
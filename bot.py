@@ -1,19 +1,34 @@
+import calendar
 import enum
+import io
+import itertools
 import logging
 import os
+import sqlite3
 import threading
 import time
-from collections import defaultdict
-from datetime import datetime
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Callable, Iterator
 
+import requests
 import telebot
 from dotenv import load_dotenv
 from telebot.types import (InlineKeyboardButton, InlineKeyboardMarkup,
                            ReplyKeyboardRemove)
 
 import db
+import delivery
+import dispatcher
+import exporter
 import i18n
+import importer
+import scheduler
+import state_store
+import stats
 import utils
+import webhook
 
 logging.basicConfig(
     level=logging.INFO,
@@ -42,16 +57,62 @@ else:
         raise ValueError("TELEGRAM_BOT_TOKEN is not set in the .env file!")
     logging.info("🚀 Running in PRODUCTION mode")
 
-bot = telebot.TeleBot(TOKEN)
+# Receive updates through a webhook server instead of long polling
+WEBHOOK_MODE = os.getenv("WEBHOOK_MODE", "false").lower() == "true"
+# Public HTTPS URL Telegram should push updates to, e.g. https://example.com/webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", webhook.WEBHOOK_PORT))
+# Keep conversation state in the database so unfinished flows survive restarts
+PERSIST_CONVERSATION_STATE = (
+    os.getenv("PERSIST_CONVERSATION_STATE", "false").lower() == "true"
+)
+
+# Worker lanes handling updates, each chat always uses the same lane
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", dispatcher.WORKERS))
+
+
+class TDispatchingTeleBot(dispatcher.TDispatchingMixin, telebot.TeleBot):
+    """
+    TeleBot that hands updates to a TUpdateDispatcher instead of handling them
+    on the thread that received them, for both polling and the webhook.
+    """
+
+    def __init__(self, token: str, workers: int = UPDATE_WORKERS):
+        # Handlers run on the dispatcher's lanes, not on telebot's own thread pool
+        super().__init__(token, threaded=False, workers=workers)
+
+
+bot = TDispatchingTeleBot(TOKEN)
+
+# Rate-limited queue for messages that nobody waits on (reminders, backups, lists)
+outbound = delivery.TOutboundQueue(bot.send_message)
 
-user_states = {}
+user_states = state_store.TStateStore(
+    "user_states",
+    persistent=PERSIST_CONVERSATION_STATE,
+    encode=lambda state: state.value,
+    decode=lambda value: TUserState(value),
+)
 
-# Global dictionary to track messages related to birthday registration
-birthday_registration_messages = defaultdict(list)
-# Global dictionary to track messages related to birthday deletion
-birthday_deletion_messages = defaultdict(list)
-# Global dictionary to track messages related to backup registration
-register_backup_messages = defaultdict(list)
+# Messages related to birthday registration
+birthday_registration_messages = state_store.TStateStore(
+    "birthday_registration_messages", persistent=PERSIST_CONVERSATION_STATE
+)
+# Messages related to birthday deletion
+birthday_deletion_messages = state_store.TStateStore(
+    "birthday_deletion_messages", persistent=PERSIST_CONVERSATION_STATE
+)
+# Messages related to backup registration
+register_backup_messages = state_store.TStateStore(
+    "register_backup_messages", persistent=PERSIST_CONVERSATION_STATE
+)
+conversation_state_stores = [
+    user_states,
+    birthday_registration_messages,
+    birthday_deletion_messages,
+    register_backup_messages,
+]
 
 REMINDED_DAYS = [0, 1, 3, 7]
 
@@ -91,20 +152,24 @@ COMMAND_MAPPINGS = {
 }
 
 
-def get_button_to_command_mapping(chat_id: int) -> dict:
-    """Get button text to command mapping for specific user's language"""
-    return {
-        i18n.get_button_text("start", chat_id): TCommand.Start,
-        i18n.get_button_text("backup", chat_id): TCommand.Backup,
-        i18n.get_button_text("register_birthday", chat_id): TCommand.RegisterBirthday,
-        i18n.get_button_text("register_backup", chat_id): TCommand.RegisterBackup,
-        i18n.get_button_text("unregister_backup", chat_id): TCommand.UnregisterBackup,
-        i18n.get_button_text("delete_birthday", chat_id): TCommand.DeleteBirthday,
-        i18n.get_button_text("share", chat_id): TCommand.Share,
-        i18n.get_button_text("stats", chat_id): TCommand.Stats,
-        i18n.get_button_text("language", chat_id): TCommand.Language,
-        i18n.get_button_text("support", chat_id): TCommand.Support,
-    }
+# Button keys (also used as callback data) to commands
+BUTTON_COMMAND_MAPPINGS = {
+    "start": TCommand.Start,
+    "backup": TCommand.Backup,
+    "register_birthday": TCommand.RegisterBirthday,
+    "register_backup": TCommand.RegisterBackup,
+    "unregister_backup": TCommand.UnregisterBackup,
+    "delete_birthday": TCommand.DeleteBirthday,
+    "stats": TCommand.Stats,
+    "share": TCommand.Share,
+    "language": TCommand.Language,
+    "support": TCommand.Support,
+}
+
+
+def get_button_command(text: str) -> TCommand | None:
+    """Route button text in any supported language through the prebuilt index"""
+    return BUTTON_COMMAND_MAPPINGS.get(i18n.get_button_key(text))
 
 
 def get_command_descriptions(chat_id: int) -> dict:
@@ -140,10 +205,6 @@ def get_command_descriptions(chat_id: int) -> dict:
     }
 
 
-def get_all_birthdays(chat_id: int, need_id: bool = False) -> str:
-    return "\n".join(db.get_all_birthdays(chat_id, need_id))
-
-
 def is_group_chat(message) -> bool:
     return message.chat.type in ["group", "supergroup"]
 
@@ -251,151 +312,58 @@ def get_reminder_settings_keyboard(chat_id) -> InlineKeyboardMarkup:
     return markup
 
 
-def handle_stats(message):
-    chat_id = message.chat.id
-
-    # Retrieve pre-formatted birthday strings used for display.
-    local_birthdays = db.get_all_birthdays(chat_id)
-    global_birthdays = db.get_all_birthdays_for_all_chats()
-
-    total_birthdays_for_this_chat = len(local_birthdays)
-    total_birthdays_for_all_chats = len(global_birthdays)
-    total_users = len(set(chat_id for chat_id, in db.get_all_chat_ids()))
-
-    # Calculate birthdays in the current month for the local chat.
-    current_month = datetime.now().month
-    birthdays_this_month = []
-    for birthday in local_birthdays:
-        date_str = birthday.split(", ")[0]
-        try:
-            date = datetime.strptime(date_str, "%d %B %Y")
-        except ValueError:
-            date = datetime.strptime(date_str, "%d %B")
-
-        if date.month == current_month:
-            birthdays_this_month.append(birthday)
-    total_birthdays_this_month = len(birthdays_this_month)
-
-    # Helper function to extract the month name from a birthday string.
-    def extract_month(birthday_line: str) -> str:
-        try:
-            date_part = birthday_line.split(",")[0].strip()
-            tokens = date_part.split(" ")
-            if len(tokens) >= 2:
-                return tokens[1]
-            return ""
-        except Exception:
-            return ""
-
-    # Calculate the most popular birthday month locally.
-    local_month_counts = {}
-    for birthday in local_birthdays:
-        month = extract_month(birthday)
-        if month:
-            local_month_counts[month] = local_month_counts.get(month, 0) + 1
-
-    if local_month_counts:
-        local_most_popular_month, local_count = max(
-            local_month_counts.items(), key=lambda x: x[1]
-        )
-    else:
-        local_most_popular_month, local_count = "N/A", 0
-
-    # Calculate the most popular birthday month globally.
-    global_month_counts = {}
-    for birthday in global_birthdays:
-        month = extract_month(birthday)
-        if month:
-            global_month_counts[month] = global_month_counts.get(month, 0) + 1
-
-    # Calculate most popular birthday month globally.
-    global_month_counts = {}
-    for birthday in global_birthdays:
-        month = extract_month(birthday)
-        if month:
-            global_month_counts[month] = global_month_counts.get(month, 0) + 1
-
-    if global_month_counts:
-        global_most_popular_month, global_count = max(
-            global_month_counts.items(), key=lambda x: x[1]
-        )
+def format_stats_section(birthday_stats: stats.TBirthdayStats) -> str:
+    """Format the month, date and age lines shared by local and global statistics."""
+    if birthday_stats.most_popular_month:
+        month, month_count = birthday_stats.most_popular_month
     else:
-        global_most_popular_month, global_count = "N/A", 0
+        month, month_count = "N/A", 0
+    text = f"• Most Popular Birthday Month: {month} ({month_count} birthdays)\n"
 
-    # Compute Age Statistics using the already given birthday strings.
-    # Only birthdays with a full_date (i.e. %d %B %Y format) are considered.
-    avg_age_local, min_age_local, max_age_local, median_age_local = (
-        utils.compute_age_metrics(local_birthdays)
-    )
-    avg_age_global, min_age_global, max_age_global, median_age_global = (
-        utils.compute_age_metrics(global_birthdays)
-    )
-
-    # Find most popular dates (day + month)
-    most_popular_date_local, popular_date_count_local = utils.find_most_popular_date(
-        local_birthdays
-    )
-    most_popular_date_global, popular_date_count_global = utils.find_most_popular_date(
-        global_birthdays
-    )
-
-    if avg_age_local is not None:
-        local_age_stats = (
-            f"• Age Statistics:\n"
-            f"   - Average Age: {avg_age_local:.1f}\n"
-            f"   - Median Age: {median_age_local:.1f}\n"
-            f"   - Minimum Age: {min_age_local}\n"
-            f"   - Maximum Age: {max_age_local}\n"
-        )
+    if birthday_stats.most_popular_date:
+        popular_date, date_count = birthday_stats.most_popular_date
+        text += f"• Most Popular Date: {popular_date} ({date_count} birthdays)\n"
     else:
-        local_age_stats = "• Age Statistics: N/A (no birthdays with full date)\n"
+        text += "• Most Popular Date: N/A\n"
 
-    if avg_age_global is not None:
-        global_age_stats = (
+    age_stats = birthday_stats.age_stats
+    if age_stats is not None:
+        text += (
             f"• Age Statistics:\n"
-            f"   - Average Age: {avg_age_global:.1f}\n"
-            f"   - Median Age: {median_age_global:.1f}\n"
-            f"   - Minimum Age: {min_age_global}\n"
-            f"   - Maximum Age: {max_age_global}\n"
+            f"   - Average Age: {age_stats.average:.1f}\n"
+            f"   - Median Age: {age_stats.median:.1f}\n"
+            f"   - Minimum Age: {age_stats.minimum}\n"
+            f"   - Maximum Age: {age_stats.maximum}\n"
         )
     else:
-        global_age_stats = "• Age Statistics: N/A (no birthdays with full date)\n"
+        text += "• Age Statistics: N/A (no birthdays with full date)\n"
+    return text
 
-    # Assemble the local statistics.
-    local_popular_date_str = ""
-    if most_popular_date_local:
-        local_popular_date_str = f"• Most Popular Date: {most_popular_date_local} ({popular_date_count_local} birthdays)\n"
-    else:
-        local_popular_date_str = "• Most Popular Date: N/A\n"
 
-    local_stats = (
-        "📍 *Local Statistics:*\n\n"
-        f"• Total Birthdays in this Chat: {total_birthdays_for_this_chat}\n"
-        f"• Birthdays in this Month: {total_birthdays_this_month}\n"
-        f"• Most Popular Birthday Month: {local_most_popular_month} ({local_count} birthdays)\n"
-        f"{local_popular_date_str}"
-        f"{local_age_stats}"
-    )
+def handle_stats(message):
+    chat_id = message.chat.id
 
-    # Assemble the global statistics.
-    global_popular_date_str = ""
-    if most_popular_date_global:
-        global_popular_date_str = f"• Most Popular Date: {most_popular_date_global} ({popular_date_count_global} birthdays)\n"
-    else:
-        global_popular_date_str = "• Most Popular Date: N/A\n"
+    now = datetime.now()
+    local_stats = stats.compute_birthday_stats(chat_id, now)
+    global_stats = stats.get_global_stats(now)
+    total_users = db.count_users()
 
-    global_stats = (
+    local_text = (
+        "📍 *Local Statistics:*\n\n"
+        f"• Total Birthdays in this Chat: {local_stats.total}\n"
+        f"• Birthdays in this Month: {local_stats.this_month}\n"
+        f"{format_stats_section(local_stats)}"
+    )
+    global_text = (
         "🌐 *Global Statistics:*\n\n"
-        f"• Total Birthdays in All Chats: {total_birthdays_for_all_chats}\n"
+        f"• Total Birthdays in All Chats: {global_stats.total}\n"
         f"• Total Users: {total_users}\n"
-        f"• Most Popular Birthday Month: {global_most_popular_month} ({global_count} birthdays)\n"
-        f"{global_popular_date_str}"
-        f"{global_age_stats}"
+        f"{format_stats_section(global_stats)}"
     )
 
-    stats_message = f"{local_stats}\n{global_stats}"
+    stats_message = f"{local_text}\n{global_text}"
 
-    bot.send_message(
+    outbound.send_message(
         chat_id,
         stats_message,
         parse_mode="Markdown",
@@ -482,6 +450,7 @@ def handle_reminder_callback(call):
         current_settings.append(days)
 
     db.update_reminder_settings(chat_id, current_settings)
+    reminder_scheduler.update_chat(chat_id, current_settings)
 
     bot.edit_message_reply_markup(
         chat_id=chat_id,
@@ -597,152 +566,396 @@ def handle_successful_payment(message):
         utils.log_exception(e)
 
 
-def get_all_birthdays_formatted(chat_id: int, need_id: bool = False) -> str:
-    all_birthdays = get_all_birthdays(chat_id, need_id)
+def format_birthday_line(
+    record: db.TBirthdayRecord, need_id: bool = False, today: date | None = None
+) -> str:
+    return str(db.TBirthday.from_record(record, need_id, today))
 
-    if not all_birthdays:
-        return i18n.get_message("no_birthdays", chat_id)
 
+def iter_birthday_list_lines(
+    chat_id: int, records: list[db.TBirthdayRecord], need_id: bool = False
+) -> Iterator[str]:
+    """Yield the lines of a markdown list of birthdays grouped by month."""
+    if not records:
+        yield i18n.get_message("no_birthdays", chat_id)
+        return
+
+    today = date.today()
     birthdays_by_month = {}
-    for line in all_birthdays.split("\n"):
-        date_str, name, *rest = line.split(", ")
-        date = datetime.strptime(
-            date_str, "%d %B %Y" if "Current age" in line else "%d %B"
+    for record in records:
+        birthdays_by_month.setdefault(record.month, []).append(
+            format_birthday_line(record, need_id, today)
         )
-        month = date.strftime("%B")
-        # Translate month name
-        translated_month = i18n.get_month_name(month, chat_id)
-        if translated_month not in birthdays_by_month:
-            birthdays_by_month[translated_month] = []
-        birthdays_by_month[translated_month].append(line)
 
-    markdown_message = f"{i18n.get_message('your_birthdays', chat_id)}\n\n"
+    yield i18n.get_message("your_birthdays", chat_id)
     for month, birthdays in birthdays_by_month.items():
-        markdown_message += f"*{month}*\n"
+        yield ""
+        # Translate month name
+        yield f"*{i18n.get_month_name(calendar.month_name[month], chat_id)}*"
         for birthday in birthdays:
-            markdown_message += f"- {birthday}\n"
-        markdown_message += "\n"
+            yield f"- {birthday}"
+    yield ""
 
-    user_states[chat_id] = TUserState.Default
 
-    return markdown_message
+def format_birthday_list(
+    chat_id: int, records: list[db.TBirthdayRecord], need_id: bool = False
+) -> str:
+    """Format birthdays as a markdown list grouped by month."""
+    if not records:
+        return i18n.get_message("no_birthdays", chat_id)
+    return "\n".join(iter_birthday_list_lines(chat_id, records, need_id)) + "\n"
+
+
+# Characters of rendered text kept in the render cache, across all entries
+RENDER_CACHE_MAX_SIZE = 16 * 1024 * 1024
+
+# (DB_FILE, chat_id, language, date, *what) -> (chat version, rendered output, size)
+_render_cache: OrderedDict[tuple, tuple[int, object, int]] = OrderedDict()
+_render_cache_size = 0
+_render_cache_lock = threading.Lock()
+
+
+def get_render_size(rendered) -> int:
+    """Characters of text in a rendered output; keyboards are small and not counted."""
+    if isinstance(rendered, str):
+        return len(rendered)
+    if isinstance(rendered, (list, tuple)):
+        return sum(get_render_size(item) for item in rendered)
+    return 0
+
+
+def get_cached_render(chat_id: int, what: tuple, render: Callable[[], object]):
+    """
+    Return render() for a chat, reusing the output while nothing it depends on changed.
+
+    Rendered birthday lists only depend on the chat's birthdays, its language
+    and the current date (through ages). The birthdays are represented by
+    db.get_chat_version, so a hit costs no database reads. The least recently
+    used entries are dropped once the cache holds more than
+    RENDER_CACHE_MAX_SIZE characters.
+
+    Args:
+        chat_id: Chat whose birthdays are rendered
+        what: Hashable description of the rendering, e.g. its kind and page
+        render: Builds the output on a miss
+    """
+    global _render_cache_size
+
+    version = db.get_chat_version(chat_id)
+    key = (db.DB_FILE, chat_id, i18n.get_user_language(chat_id), date.today(), *what)
+    with _render_cache_lock:
+        entry = _render_cache.get(key)
+        if entry is not None and entry[0] == version:
+            _render_cache.move_to_end(key)
+            return entry[1]
+
+    # A write during render() bumps the version, so the entry is stale on arrival
+    rendered = render()
+    size = get_render_size(rendered)
+    with _render_cache_lock:
+        entry = _render_cache.pop(key, None)
+        if entry is not None:
+            _render_cache_size -= entry[2]
+        if size <= RENDER_CACHE_MAX_SIZE:
+            _render_cache[key] = (version, rendered, size)
+            _render_cache_size += size
+        while _render_cache_size > RENDER_CACHE_MAX_SIZE:
+            _, (_, _, evicted_size) = _render_cache.popitem(last=False)
+            _render_cache_size -= evicted_size
+    return rendered
+
+
+def clear_render_cache() -> None:
+    """Forget all rendered birthday lists."""
+    global _render_cache_size
+
+    with _render_cache_lock:
+        _render_cache.clear()
+        _render_cache_size = 0
+
+
+def get_birthday_list_chunks(
+    chat_id: int, need_id: bool = False, heading_key: str | None = None
+) -> list[str]:
+    """
+    Render all birthdays of a chat as Telegram-sized markdown messages.
+
+    Args:
+        chat_id: Chat to list birthdays of
+        need_id: Whether to show birthday IDs
+        heading_key: Translation key of a line put above the list, if any
+    """
+
+    def render() -> list[str]:
+        lines = iter_birthday_list_lines(chat_id, db.list_birthdays(chat_id), need_id)
+        if heading_key is not None:
+            lines = itertools.chain([i18n.get_message(heading_key, chat_id)], lines)
+        return list(utils.split_lines(lines))
+
+    return get_cached_render(chat_id, ("list", need_id, heading_key), render)
+
+
+class TBirthdayListKind(enum.Enum):
+    Backup = "backup"
+    Deletion = "delete"
 
 
-def get_all_birthdays_for_share(chat_id: int) -> str:
-    all_birthdays = get_all_birthdays(chat_id)
+# callback_data of page buttons: list:<kind>:<prev|next>:<anchor>:<month_day>:<id>
+BIRTHDAY_PAGE_CALLBACK_PREFIX = "list:"
 
-    if not all_birthdays:
-        return "Nothing found"
 
-    formatted_birthdays = []
-    for line in all_birthdays.split("\n"):
-        date_str, name, *rest = line.split(", ")
-        date = datetime.strptime(
-            date_str, "%d %B %Y" if "Current age" in line else "%d %B"
+def render_birthdays_page(
+    chat_id: int,
+    kind: TBirthdayListKind,
+    after: tuple[str, int] | None = None,
+    before: tuple[str, int] | None = None,
+    anchor: str | None = None,
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    """Fetch one page of a chat's birthdays and build its text and navigation keyboard."""
+    return get_cached_render(
+        chat_id,
+        ("page", kind, after, before, anchor),
+        lambda: _render_birthdays_page(chat_id, kind, after, before, anchor),
+    )
+
+
+def _render_birthdays_page(
+    chat_id: int,
+    kind: TBirthdayListKind,
+    after: tuple[str, int] | None,
+    before: tuple[str, int] | None,
+    anchor: str | None,
+) -> tuple[str, InlineKeyboardMarkup | None]:
+    page = db.list_birthdays_page(chat_id, after=after, before=before, anchor=anchor)
+    text = format_birthday_list(
+        chat_id, page.records, need_id=kind == TBirthdayListKind.Deletion
+    )
+
+    buttons = []
+    if page.records and page.has_prev:
+        month_day, birthday_id = page.records[0].key
+        buttons.append(
+            InlineKeyboardButton(
+                i18n.get_message("page_prev", chat_id),
+                callback_data=f"{BIRTHDAY_PAGE_CALLBACK_PREFIX}{kind.value}:prev:{page.anchor}:{month_day}:{birthday_id}",
+            )
         )
-        if date.year != utils.DEFAULT_BD_YEAR:
-            formatted_date = date.strftime("%d.%m.%Y")
-        else:
-            formatted_date = date.strftime("%d.%m")
-        formatted_birthdays.append(name)
-        formatted_birthdays.append(formatted_date)
+    if page.records and page.has_next:
+        month_day, birthday_id = page.records[-1].key
+        buttons.append(
+            InlineKeyboardButton(
+                i18n.get_message("page_next", chat_id),
+                callback_data=f"{BIRTHDAY_PAGE_CALLBACK_PREFIX}{kind.value}:next:{page.anchor}:{month_day}:{birthday_id}",
+            )
+        )
+
+    if not buttons:
+        return text, None
+    markup = InlineKeyboardMarkup()
+    markup.row(*buttons)
+    return text, markup
+
+
+@bot.callback_query_handler(
+    func=lambda call: call.data.startswith(BIRTHDAY_PAGE_CALLBACK_PREFIX)
+)
+def handle_birthdays_page_callback(call):
+    chat_id = call.message.chat.id
+    try:
+        kind, direction, anchor, month_day, birthday_id = call.data[
+            len(BIRTHDAY_PAGE_CALLBACK_PREFIX) :
+        ].split(":")
+        kind = TBirthdayListKind(kind)
+        cursor = (month_day, int(birthday_id))
+    except ValueError:
+        bot.answer_callback_query(call.id, i18n.get_message("invalid_action", chat_id))
+        return
 
-    return "\n".join(formatted_birthdays)
+    if direction == "next":
+        text, markup = render_birthdays_page(chat_id, kind, after=cursor, anchor=anchor)
+    else:
+        text, markup = render_birthdays_page(chat_id, kind, before=cursor, anchor=anchor)
+
+    bot.edit_message_text(
+        text,
+        chat_id=chat_id,
+        message_id=call.message.message_id,
+        parse_mode="Markdown",
+        reply_markup=markup,
+    )
+    bot.answer_callback_query(call.id)
 
 
 def send_backup(message):
-    all_birthdays = get_all_birthdays_formatted(message.chat.id)
-    birthdays_messages = utils.split_message(all_birthdays)
+    text, markup = render_birthdays_page(message.chat.id, TBirthdayListKind.Backup)
+    outbound.send_message(
+        message.chat.id,
+        text,
+        parse_mode="Markdown",
+        reply_markup=markup,
+    )
 
-    for birthday_message in birthdays_messages:
-        bot.send_message(
-            message.chat.id,
-            birthday_message,
-            parse_mode="Markdown",
+    user_states[message.chat.id] = TUserState.Default
+
+
+def format_birthday_reminder(event: scheduler.TReminderEvent) -> str:
+    chat_id = event.chat_id
+
+    age_text = ""
+    if event.has_year:
+        age_text = i18n.get_message("age_suffix", chat_id, age=event.age)
+
+    if event.days_until == 0:
+        return i18n.get_message(
+            "today_birthday",
+            chat_id,
+            name=event.name,
+            age_text=age_text,
         )
+    return i18n.get_message(
+        "upcoming_birthday",
+        chat_id,
+        days=event.days_until,
+        name=event.name,
+        age_text=age_text,
+    )
 
-    user_states[message.chat.id] = TUserState.Default
 
+def send_birthday_reminders(events: list[scheduler.TReminderEvent]) -> None:
+    """Send each chat a single digest with all of its due reminders."""
+    events_by_chat = defaultdict(list)
+    for event in events:
+        events_by_chat[event.chat_id].append(event)
+
+    futures_by_chat = {
+        chat_id: send_reminder_digest(chat_id, chat_events)
+        for chat_id, chat_events in events_by_chat.items()
+    }
+    delivery.when_all(
+        [future for futures in futures_by_chat.values() for future in futures],
+        lambda _: on_birthday_reminders_delivered(events_by_chat, futures_by_chat),
+    )
 
-def process_birthday_pings():
-    while True:
-        minutes = 5
-        time.sleep(minutes * 60)
 
-        if not utils.is_daytime():
+def send_reminder_digest(chat_id: int, events: list[scheduler.TReminderEvent]) -> list:
+    events.sort(key=lambda event: (event.days_until, event.name))
+    lines = [format_birthday_reminder(event) for event in events]
+    if len(lines) > 1:
+        lines.insert(0, i18n.get_message("reminder_digest_title", chat_id))
+
+    return [
+        outbound.send_message(chat_id, chunk)
+        for chunk in utils.split_lines(lines)
+    ]
+
+
+def on_birthday_reminders_delivered(events_by_chat: dict, futures_by_chat: dict) -> None:
+    """
+    Runs on an outbound worker once every digest of a tick is delivered or has failed.
+    Delivered reminders are marked as sent with a single commit.
+    """
+    sent_reminders = []
+    for chat_id, events in events_by_chat.items():
+        errors = [e for e in (f.exception() for f in futures_by_chat[chat_id]) if e]
+        blocked = errors and all(getattr(e, "error_code", None) == 403 for e in errors)
+
+        if errors and not blocked:
+            logging.error(
+                f"Error delivering {len(events)} reminders to chat {chat_id}: {errors[0]}"
+            )
+            for event in events:
+                reminder_scheduler.retry_later(event)
             continue
 
-        try:
-            # Reset flags for birthdays that are far from current date
-            db.reset_birthday_reminder_flags()
+        if blocked:  # Bot was blocked by the user
+            logging.warning(
+                f"Bot was blocked by user {chat_id}, skipping notifications"
+            )
 
-            for days in REMINDED_DAYS:
-                upcoming_birthdays = db.get_upcoming_birthdays(days)
+        # Mark reminders as sent (also when blocked, to avoid retrying)
+        sent_reminders.extend(
+            (event.birthday_id, event.days_until, event.occurrence.year)
+            for event in events
+        )
 
-                for id, chat_id, name, birthday_str, has_year in upcoming_birthdays:
-                    user_settings = db.get_reminder_settings(chat_id)
-                    if not user_settings:
-                        continue
+    if sent_reminders:
+        db.mark_birthday_reminders_sent(sent_reminders)
 
-                    birthday = datetime.strptime(birthday_str, "%Y-%m-%d")
-                    current_year = datetime.now().year
-                    birthday_this_year = birthday.replace(year=current_year)
 
-                    today = datetime.now().replace(
-                        hour=0, minute=0, second=0, microsecond=0
-                    )
-                    days_until = (birthday_this_year - today).days
-
-                    # Only send reminder if user has enabled this day.
-                    if days_until in user_settings:
-                        try:
-                            age_text = ""
-                            if has_year:
-                                age = current_year - birthday.year
-                                age_text = i18n.get_message(
-                                    "age_suffix", chat_id, age=age
-                                )
-
-                            if days_until == 0:
-                                bot.send_message(chat_id, "🎂")
-                                reminder_text = i18n.get_message(
-                                    "today_birthday",
-                                    chat_id,
-                                    name=name,
-                                    age_text=age_text,
-                                )
-                            else:
-                                reminder_text = i18n.get_message(
-                                    "upcoming_birthday",
-                                    chat_id,
-                                    days=days_until,
-                                    name=name,
-                                    age_text=age_text,
-                                )
-
-                            bot.send_message(chat_id, reminder_text)
-                            db.mark_birthday_reminder_sent(id, days_until)
-                        except telebot.apihelper.ApiTelegramException as e:
-                            if e.error_code == 403:  # Bot was blocked by the user
-                                logging.warning(
-                                    f"Bot was blocked by user {chat_id}, skipping notifications"
-                                )
-                                # Mark reminder as sent to avoid retrying
-                                db.mark_birthday_reminder_sent(id, days_until)
-                            else:
-                                raise  # Re-raise other API exceptions
+reminder_scheduler = scheduler.TReminderScheduler(on_due=send_birthday_reminders)
 
-        except Exception as e:
-            logging.error(f"Error during birthday ping processing: {e}")
-            utils.log_exception(e)
+
+def build_reminder_schedule() -> None:
+    try:
+        reminder_scheduler.rebuild()
+    except Exception as e:
+        logging.error(f"Error building reminder schedule: {e}")
+        utils.log_exception(e)
+
+
+def process_birthday_pings():
+    build_reminder_schedule()
+    reminder_scheduler.run()
+
+
+EXPORT_CALLBACK_PREFIX = "export:"
+
+
+def get_export_keyboard(chat_id: int) -> InlineKeyboardMarkup:
+    markup = InlineKeyboardMarkup()
+    buttons = [
+        InlineKeyboardButton(
+            i18n.get_button_text(f"export_{export_format.value}", chat_id),
+            callback_data=f"{EXPORT_CALLBACK_PREFIX}{export_format.value}",
+        )
+        for export_format in exporter.TExportFormat
+    ]
+    for i in range(0, len(buttons), 2):
+        markup.row(*buttons[i : (i + 2)])
+    return markup
 
 
 def send_share_message(message):
-    all_birthdays = get_all_birthdays_for_share(message.chat.id)
-    birthdays_messages = utils.split_message(all_birthdays)
+    chat_id = message.chat.id
+    bot.send_message(
+        chat_id,
+        i18n.get_message("export_choose_format", chat_id),
+        reply_markup=get_export_keyboard(chat_id),
+        parse_mode="Markdown",
+    )
 
-    for birthday_message in birthdays_messages:
-        bot.send_message(message.chat.id, birthday_message, parse_mode="Markdown")
+
+def send_export(chat_id: int, export_format: exporter.TExportFormat) -> None:
+    """Send the chat's birthdays as a single file instead of a stream of messages."""
+    with exporter.export_birthdays(chat_id, export_format) as (document, count):
+        if count == 0:
+            bot.send_message(chat_id, "Nothing found", parse_mode="Markdown")
+            return
+        bot.send_document(
+            chat_id,
+            document,
+            visible_file_name=exporter.EXPORT_FILE_NAMES[export_format],
+            caption=i18n.get_message("export_caption", chat_id, count=count),
+        )
+
+
+@bot.callback_query_handler(
+    func=lambda call: call.data.startswith(EXPORT_CALLBACK_PREFIX)
+)
+def handle_export_callback(call):
+    chat_id = call.message.chat.id
+    try:
+        export_format = exporter.TExportFormat(call.data[len(EXPORT_CALLBACK_PREFIX) :])
+    except ValueError:
+        bot.answer_callback_query(call.id, i18n.get_message("invalid_action", chat_id))
+        return
+
+    bot.answer_callback_query(call.id)
+    try:
+        send_export(chat_id, export_format)
+    except Exception as e:
+        logging.error(f"Error exporting birthdays for Chat ID {chat_id}: {e}")
+        utils.log_exception(e)
 
 
 def register_birthday(message):
@@ -754,44 +967,138 @@ def register_birthday(message):
         parse_mode="Markdown",
     )
 
-    birthday_registration_messages[chat_id] = set([instruct_msg.message_id])
+    birthday_registration_messages[chat_id] = [instruct_msg.message_id]
     user_states[chat_id] = TUserState.AwaitingBirthday
 
 
-def process_backup_pings():
-    while True:
-        minutes = 5
-        time.sleep(minutes * 60)
-        try:
-            all_chat_ids = db.get_all_chat_ids()
-            if all_chat_ids is None:
-                logging.error("Failed to retrieve chat IDs")
-                continue
+# Minimum time between two edits of an import's progress message
+IMPORT_PROGRESS_INTERVAL_SECONDS = 3
+TELEGRAM_FILE_URL = "https://api.telegram.org/file/bot{0}/{1}"
 
-            for chat_id in all_chat_ids:
-                chat_id = chat_id[0]
 
-                backup_ping_settings = db.select_from_backup_ping(chat_id)
+@contextmanager
+def open_document(file_id: str) -> Iterator[io.TextIOBase]:
+    """Open a file sent to the bot as text, read while it downloads instead of all at once."""
+    file_path = bot.get_file(file_id).file_path
+    url = (telebot.apihelper.FILE_URL or TELEGRAM_FILE_URL).format(TOKEN, file_path)
+    with requests.get(
+        url, stream=True, proxies=telebot.apihelper.proxy, timeout=60
+    ) as response:
+        response.raise_for_status()
+        response.raw.decode_content = True
+        yield io.TextIOWrapper(
+            response.raw, encoding="utf-8-sig", errors="replace", newline=""
+        )
 
-                if backup_ping_settings.is_active is False:
-                    continue
 
-                now = int(time.time())
-                delta_seconds = now - backup_ping_settings.last_updated_timestamp
-                settings_delta_seconds = backup_ping_settings.update_timedelta * 60
+@bot.message_handler(content_types=["document"])
+def handle_document(message):
+    chat_id = message.chat.id
+    # Files are only imported when asked to, with /register_birthday
+    if user_states.get(chat_id) != TUserState.AwaitingBirthday:
+        # Groups share all sorts of files, only private chats get a hint
+        if not is_group_chat(message):
+            bot.send_message(chat_id, i18n.get_message("import_not_requested", chat_id))
+        return
+
+    document = message.document
+    import_format = importer.detect_format(document.file_name, document.mime_type)
+    if import_format is None:
+        bot.send_message(
+            chat_id,
+            i18n.get_message("import_unsupported_format", chat_id),
+            parse_mode="Markdown",
+        )
+        return
+    if document.file_size and document.file_size > importer.MAX_IMPORT_FILE_SIZE:
+        bot.send_message(
+            chat_id,
+            i18n.get_message(
+                "import_file_too_big",
+                chat_id,
+                size=importer.MAX_IMPORT_FILE_SIZE // (1024 * 1024),
+            ),
+            parse_mode="Markdown",
+        )
+        return
 
-                if delta_seconds < settings_delta_seconds:
-                    continue
+    status = bot.send_message(chat_id, i18n.get_message("import_started", chat_id))
+    last_progress = time.monotonic()
 
-                db.update_backup_ping(chat_id)
+    def on_batch(birthday_ids, batch, report):
+        nonlocal last_progress
+        for birthday_id, (name, parsed_date, has_year) in zip(birthday_ids, batch):
+            reminder_scheduler.add_birthday(
+                birthday_id, chat_id, name, parsed_date, has_year
+            )
 
-                all_birthdays = get_all_birthdays_formatted(chat_id)
-                bot.send_message(
-                    chat_id,
-                    f"{i18n.get_message('latest_backup', chat_id)}\n{all_birthdays}",
-                    parse_mode="Markdown",
+        if time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL_SECONDS:
+            last_progress = time.monotonic()
+            try:
+                bot.edit_message_text(
+                    i18n.get_message(
+                        "import_progress",
+                        chat_id,
+                        imported=report.imported,
+                        errors=report.error_count,
+                    ),
+                    chat_id=chat_id,
+                    message_id=status.message_id,
                 )
+            except (telebot.apihelper.ApiException, requests.RequestException) as e:
+                # Only the progress is lost, the import goes on
+                logging.warning(f"Error updating import progress for Chat ID {chat_id}: {e}")
+
+    report = importer.TImportReport()
+    try:
+        with open_document(document.file_id) as lines:
+            importer.import_birthdays(
+                chat_id, importer.ENTRY_READERS[import_format](lines), on_batch, report=report
+            )
+    except Exception as e:
+        logging.error(f"Error importing birthdays for Chat ID {chat_id}: {e}")
+        if not report.imported:
+            bot.edit_message_text(
+                i18n.get_message("import_failed", chat_id),
+                chat_id=chat_id,
+                message_id=status.message_id,
+            )
+            return
+        # The batches saved before the download or the file broke off stay imported
+        report.failed = True
+
+    bot.edit_message_text(
+        importer.format_import_report(chat_id, report),
+        chat_id=chat_id,
+        message_id=status.message_id,
+    )
+
+    if report.imported and user_states.get(chat_id) == TUserState.AwaitingBirthday:
+        user_states[chat_id] = TUserState.Default
+        for old_message_id in birthday_registration_messages.pop(chat_id, []):
+            bot.delete_message(chat_id, old_message_id)
+
 
+BACKUP_PING_CHECK_SECONDS = 5 * 60
+
+
+def send_due_backups() -> None:
+    due_chat_ids = db.claim_due_backup_pings()
+    if due_chat_ids is None:
+        logging.error("Failed to retrieve due backup pings")
+        return
+
+    for chat_id in due_chat_ids:
+        for chunk in get_birthday_list_chunks(chat_id, heading_key="latest_backup"):
+            outbound.send_message(chat_id, chunk, parse_mode="Markdown")
+        user_states[chat_id] = TUserState.Default
+
+
+def process_backup_pings():
+    while True:
+        time.sleep(BACKUP_PING_CHECK_SECONDS)
+        try:
+            send_due_backups()
         except Exception as e:
             logging.error(f"Error during backup ping processing: {e}")
 
@@ -824,8 +1131,7 @@ def unregister_backup(message):
 
 def handle_deletion(message):
     chat_id = message.chat.id
-    all_birthdays = get_all_birthdays_formatted(chat_id, need_id=True)
-    birthdays_messages = utils.split_message(all_birthdays)
+    text, markup = render_birthdays_page(chat_id, TBirthdayListKind.Deletion)
 
     instruct_msg = bot.send_message(
         chat_id,
@@ -835,9 +1141,8 @@ def handle_deletion(message):
 
     birthday_deletion_messages[chat_id] = [instruct_msg.message_id]
 
-    for birthday_message in birthdays_messages:
-        msg = bot.send_message(chat_id, birthday_message, parse_mode="Markdown")
-        birthday_deletion_messages[chat_id].append(msg.message_id)
+    msg = bot.send_message(chat_id, text, parse_mode="Markdown", reply_markup=markup)
+    birthday_deletion_messages.append(chat_id, msg.message_id)
 
     user_states[chat_id] = TUserState.AwaitingDeletion
 
@@ -861,28 +1166,16 @@ def handle_callback_query(call):
         call.data.startswith("reminder_")
         or call.data.startswith("lang_")
         or call.data.startswith("support_pay_")
+        or call.data.startswith(BIRTHDAY_PAGE_CALLBACK_PREFIX)
+        or call.data.startswith(EXPORT_CALLBACK_PREFIX)
     ):
         return
 
     message = call.message
     chat_id = message.chat.id
 
-    # Map callback data to commands
-    command_mapping = {
-        "start": TCommand.Start,
-        "backup": TCommand.Backup,
-        "register_birthday": TCommand.RegisterBirthday,
-        "register_backup": TCommand.RegisterBackup,
-        "unregister_backup": TCommand.UnregisterBackup,
-        "delete_birthday": TCommand.DeleteBirthday,
-        "stats": TCommand.Stats,
-        "share": TCommand.Share,
-        "language": TCommand.Language,
-        "support": TCommand.Support,
-    }
-
-    if call.data in command_mapping:
-        command = command_mapping[call.data]
+    if call.data in BUTTON_COMMAND_MAPPINGS:
+        command = BUTTON_COMMAND_MAPPINGS[call.data]
 
         if command == TCommand.Start:
             handle_start(message)
@@ -960,10 +1253,9 @@ def handle_message(message):
             handle_support(message)
             return
 
-    # Handle button texts in user's language
-    button_mapping = get_button_to_command_mapping(chat_id)
-    if user_message in button_mapping:
-        command = button_mapping[user_message]
+    # Handle button texts, the index is prebuilt so this needs no DB lookups
+    command = get_button_command(user_message)
+    if command is not None:
         if command == TCommand.Start:
             handle_start(message)
             return
@@ -1014,12 +1306,9 @@ def handle_message(message):
 
                 bot.delete_message(chat_id, message.message_id)
 
-                for old_message_id in register_backup_messages[chat_id]:
+                for old_message_id in register_backup_messages.pop(chat_id, []):
                     bot.delete_message(chat_id, old_message_id)
 
-                if chat_id in register_backup_messages.keys():
-                    del register_backup_messages[chat_id]
-
             except Exception:
                 error_msg = bot.send_message(
                     chat_id,
@@ -1027,7 +1316,7 @@ def handle_message(message):
                     parse_mode="Markdown",
                 )
 
-                register_backup_messages[chat_id].append(error_msg.message_id)
+                register_backup_messages.append(chat_id, error_msg.message_id)
 
         case TUserState.AwaitingDeletion:
             try:
@@ -1041,6 +1330,7 @@ def handle_message(message):
                     deleted_rows = db.delete_birthday(chat_id, birthday_id)
                     if deleted_rows > 0:
                         deleted_ids.append(birthday_id)
+                        reminder_scheduler.remove_birthday(birthday_id)
                     else:
                         not_found_ids.append(birthday_id)
 
@@ -1071,67 +1361,71 @@ def handle_message(message):
 
                 user_states[chat_id] = TUserState.Default
 
-                birthday_deletion_messages[chat_id].append(message.message_id)
+                birthday_deletion_messages.append(chat_id, message.message_id)
 
-                for old_message_id in birthday_deletion_messages[chat_id]:
+                for old_message_id in birthday_deletion_messages.pop(chat_id, []):
                     bot.delete_message(chat_id, old_message_id)
 
-                if chat_id in birthday_deletion_messages.keys():
-                    del birthday_deletion_messages[chat_id]
-
             except ValueError:
                 error_msg = bot.send_message(
                     chat_id,
                     i18n.get_message("invalid_ids_format", chat_id),
                     parse_mode="Markdown",
                 )
-                birthday_deletion_messages[chat_id].append(error_msg.message_id)
+                birthday_deletion_messages.append(chat_id, error_msg.message_id)
             except Exception as e:
                 logging.error(f"Error deleting birthdays for Chat ID {chat_id}: {e}")
 
         case TUserState.AwaitingBirthday:
             try:
-                success, error_message = utils.validate_birthday_input(
+                parsed_birthdays, errors = utils.parse_birthday_input(
                     user_message, chat_id
                 )
-                if not success:
+                if errors:
+                    for chunk in utils.split_message(
+                        utils.format_birthday_input_errors(errors, chat_id)
+                    ):
+                        err_msg = bot.send_message(
+                            chat_id, chunk, parse_mode="Markdown"
+                        )
+                        birthday_registration_messages.append(
+                            chat_id, err_msg.message_id
+                        )
+                    return
+
+                try:
+                    birthday_ids = db.register_birthdays(chat_id, parsed_birthdays)
+                except sqlite3.Error:
+                    # Nothing was saved, the user is still asked for birthdays
                     err_msg = bot.send_message(
                         chat_id,
-                        error_message,
+                        i18n.get_message("birthdays_not_saved", chat_id),
                         parse_mode="Markdown",
                     )
-                    birthday_registration_messages[chat_id].add(err_msg.message_id)
+                    birthday_registration_messages.append(chat_id, err_msg.message_id)
                     return
 
-                success, parsed_birthdays = utils.parse_dates(user_message)
-                for name, parsed_date, has_year in parsed_birthdays:
-                    db.register_birthday(chat_id, name, parsed_date, has_year)
+                for birthday_id, (name, parsed_date, has_year) in zip(
+                    birthday_ids, parsed_birthdays
+                ):
+                    reminder_scheduler.add_birthday(
+                        birthday_id, chat_id, name, parsed_date, has_year
+                    )
 
-                birthday_msg = ""
+                lines = [i18n.get_message("birthdays_registered", chat_id)]
                 for name, parsed_date, has_year in parsed_birthdays:
-                    if has_year:
-                        birthday_msg += (
-                            f"- {name}: {parsed_date.strftime('%d %B %Y')}\n"
-                        )
-                    else:
-                        birthday_msg += f"- {name}: {parsed_date.strftime('%d %B')}\n"
-
-                bot.send_message(
-                    chat_id,
-                    f"{i18n.get_message('birthdays_registered', chat_id)}\n{birthday_msg}",
-                    parse_mode="Markdown",
-                )
+                    date_format = "%d %B %Y" if has_year else "%d %B"
+                    lines.append(f"- {name}: {parsed_date.strftime(date_format)}")
+                for chunk in utils.split_lines(lines):
+                    bot.send_message(chat_id, chunk, parse_mode="Markdown")
 
                 user_states[chat_id] = TUserState.Default
 
                 bot.delete_message(chat_id, message.message_id)
 
-                for old_message_id in birthday_registration_messages[chat_id]:
+                for old_message_id in birthday_registration_messages.pop(chat_id, []):
                     bot.delete_message(chat_id, old_message_id)
 
-                if chat_id in birthday_registration_messages.keys():
-                    del birthday_registration_messages[chat_id]
-
             except Exception:
                 bot.send_message(
                     chat_id,
@@ -1142,23 +1436,65 @@ def handle_message(message):
             pass
 
 
+CLEANUP_INTERVAL_SECONDS = 24 * 60 * 60
+
+
+def clean_up() -> None:
+    """Delete old log files and expired conversation state."""
+    utils.cleanup_old_logs()
+    for store in conversation_state_stores:
+        store.purge_expired()
+
+
 def log_cleaner():
-    """Thread function to periodically clean up old log files."""
+    """Thread function to periodically clean up old log files and expired conversation state."""
     while True:
         try:
-            utils.cleanup_old_logs()
-            time.sleep(24 * 60 * 60)
+            clean_up()
+            time.sleep(CLEANUP_INTERVAL_SECONDS)
         except Exception as e:
             logging.error(f"Error in log cleaner thread: {e}")
             utils.log_exception(e)
             time.sleep(60 * 60)
 
 
+def process_webhook_update(update: dict) -> None:
+    bot.process_new_updates([telebot.types.Update.de_json(update)])
+
+
+def run_webhook() -> None:
+    """Serve updates pushed by Telegram until interrupted."""
+    if not WEBHOOK_SECRET:
+        logging.warning("WEBHOOK_SECRET is not set, webhook requests are not authenticated!")
+
+    # Updates are only parsed and queued here, one worker keeps their arrival order
+    server = webhook.TWebhookServer(
+        process_webhook_update, secret_token=WEBHOOK_SECRET, port=WEBHOOK_PORT, workers=1
+    )
+    if WEBHOOK_URL:
+        bot.set_webhook(url=WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+        logging.info(f"Webhook registered at {WEBHOOK_URL}")
+    else:
+        logging.warning("WEBHOOK_URL is not set, assuming the webhook is registered already")
+
+    logging.info(f"Listening for webhook updates on port {WEBHOOK_PORT}...")
+    try:
+        server.serve_forever()
+    finally:
+        server.stop()
+
+
 if __name__ == "__main__":
     db.init_db()
 
     logging.info("Bot is running...")
     try:
+        logging.info("Starting outbound message workers...")
+        outbound.start()
+
+        logging.info(f"Starting {UPDATE_WORKERS} update workers...")
+        bot.dispatcher.start()
+
         logging.info("Starting backup ping thread...")
         backup_thread = threading.Thread(target=process_backup_pings, daemon=True)
         backup_thread.start()
@@ -1171,7 +1507,10 @@ if __name__ == "__main__":
         log_cleaner_thread = threading.Thread(target=log_cleaner, daemon=True)
         log_cleaner_thread.start()
 
-        bot.polling(none_stop=True, timeout=60, long_polling_timeout=60)
+        if WEBHOOK_MODE:
+            run_webhook()
+        else:
+            bot.polling(none_stop=True, timeout=60, long_polling_timeout=60)
 
     except KeyboardInterrupt:
         logging.info("Shutting down bot gracefully...")
@@ -1179,6 +1518,10 @@ if __name__ == "__main__":
         backup_thread.join(timeout=2)
         birthday_thread.join(timeout=2)
         log_cleaner_thread.join(timeout=2)
+        bot.dispatcher.stop(timeout=2)
+        outbound.stop(timeout=2)
+
+        db.close_connections()
 
     except Exception as e:
         logging.critical(f"Bot polling encountered an error: {e}")
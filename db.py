@@ -1,7 +1,12 @@
+import calendar
 import logging
 import os
 import sqlite3
-from datetime import datetime, timedelta
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date, datetime
+from typing import Iterator, NamedTuple
 
 import utils
 
@@ -23,6 +28,127 @@ logging.basicConfig(
 )
 
 
+# Connection-level settings applied once per connection instead of per query
+CONNECTION_PRAGMAS = [
+    "PRAGMA journal_mode=WAL;",
+    "PRAGMA busy_timeout=5000;",
+]
+
+
+class TConnectionManager:
+    """
+    Hands out one reusable SQLite connection per thread.
+
+    Every thread (polling, birthday pings, backup pings) gets its own
+    connection, so connections are never shared across threads. Connections
+    are keyed by database path, so changing DB_FILE transparently opens a
+    new one.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections: set[sqlite3.Connection] = set()
+        self.connects = 0
+
+    def get_connection(self, db_file: str) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.db_file == db_file:
+            return conn
+
+        if conn is not None:
+            self._discard(conn)
+
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+
+        self._local.conn = conn
+        self._local.db_file = db_file
+        self._local.depth = 0
+        with self._lock:
+            self._connections.add(conn)
+            self.connects += 1
+        return conn
+
+    @contextmanager
+    def transaction(self, db_file: str):
+        """
+        Run a block of statements in a single transaction on the thread's connection.
+
+        Nested blocks join the outermost transaction, which commits on success
+        and rolls back if any exception escapes.
+        """
+        conn = self.get_connection(db_file)
+        self._local.depth += 1
+        try:
+            yield conn.cursor()
+        except BaseException:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.rollback()
+            raise
+        else:
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                conn.commit()
+
+    def close_all(self) -> None:
+        """Close every connection handed out so far, in all threads."""
+        with self._lock:
+            connections = list(self._connections)
+            self._connections.clear()
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def _discard(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.discard(conn)
+        conn.close()
+        self._local.conn = None
+
+
+connection_manager = TConnectionManager()
+
+
+def get_connection() -> sqlite3.Connection:
+    """Get the calling thread's connection to DB_FILE."""
+    return connection_manager.get_connection(DB_FILE)
+
+
+def transaction():
+    """Context manager yielding a cursor; commits once when the block exits."""
+    return connection_manager.transaction(DB_FILE)
+
+
+def close_connections() -> None:
+    """Close all pooled connections, e.g. before removing or replacing DB_FILE."""
+    connection_manager.close_all()
+
+
+# (DB_FILE, chat_id) -> number of times the chat's birthdays changed in this process
+_chat_versions: dict[tuple[str, int], int] = {}
+_chat_versions_lock = threading.Lock()
+
+
+def get_chat_version(chat_id: int) -> int:
+    """
+    Get a counter that changes whenever a birthday of the chat is added or deleted.
+
+    Kept in memory, so callers can tell whether anything derived from the
+    chat's birthdays is still current without reading the database.
+    """
+    with _chat_versions_lock:
+        return _chat_versions.get((DB_FILE, chat_id), 0)
+
+
+def _bump_chat_version(chat_id: int) -> None:
+    with _chat_versions_lock:
+        key = (DB_FILE, chat_id)
+        _chat_versions[key] = _chat_versions.get(key, 0) + 1
+
+
 class TBackupPingSettings:
     def __init__(self, select_result: tuple):
         if select_result is None:
@@ -72,36 +198,117 @@ def _safe_replace_year(date: datetime, new_year: int) -> datetime:
         raise
 
 
+class TBirthdayRecord(NamedTuple):
+    """A birthday row with its date split into components, ready for formatting."""
+
+    id: int
+    chat_id: int
+    name: str
+    month: int
+    day: int
+    # None if the birth year is unknown
+    year: int | None
+    has_year: bool
+
+    @classmethod
+    def from_row(cls, row: tuple) -> "TBirthdayRecord":
+        """Build a record from an (id, chat_id, name, birthday, has_year) row."""
+        birthday_id, chat_id, name, birthday, has_year = row
+        # birthday is stored as 'YYYY-MM-DD', slicing is much cheaper than strptime
+        return cls(
+            birthday_id,
+            chat_id,
+            name,
+            int(birthday[5:7]),
+            int(birthday[8:10]),
+            int(birthday[:4]) if has_year else None,
+            bool(has_year),
+        )
+
+    @property
+    def key(self) -> tuple[str, int]:
+        """Position in listings as (month_day, id), used as a pagination cursor."""
+        return f"{self.month:02d}-{self.day:02d}", self.id
+
+    def age_on(self, today: date) -> int | None:
+        """Age on the given day, None if the birth year is unknown."""
+        if self.year is None:
+            return None
+        return _age_on(self.year, self.month, self.day, today)
+
+
+def _age_on(year: int, month: int, day: int, today: date) -> int:
+    had_birthday = (today.month, today.day) >= (month, day) or (
+        # Feb 29 birthdays are celebrated on Feb 28 in non-leap years
+        (month, day) == (2, 29)
+        and (today.month, today.day) == (2, 28)
+        and not calendar.isleap(today.year)
+    )
+    return today.year - year - (0 if had_birthday else 1)
+
+
 class TBirthday:
-    def __init__(self, select_result: tuple, need_id: bool = False):
+    """
+    A birthday ready for display, built for every row of every listing.
+
+    Slotted and cheap to build: the stored 'YYYY-MM-DD' date is kept as
+    integer components and only turned into a datetime when .birthday is
+    accessed. Ages are computed against `today`, which listing functions
+    snapshot once per batch instead of calling datetime.now() per row.
+    """
+
+    __slots__ = ("id", "name", "year", "month", "day", "has_year", "need_id", "today")
+
+    def __init__(
+        self, select_result: tuple, need_id: bool = False, today: date | None = None
+    ):
         self.need_id = need_id
+        self.today = today
 
         if select_result is None:
             self.id = None
             self.name = None
-            self.birthday = None
+            self.year = self.month = self.day = None
             self.has_year = False
             return
 
         self.id = int(select_result[0])
         self.name = select_result[2]
-        self.birthday = datetime.strptime(select_result[3], "%Y-%m-%d")
+        birthday = select_result[3]
+        self.year = int(birthday[:4])
+        self.month = int(birthday[5:7])
+        self.day = int(birthday[8:10])
         self.has_year = bool(select_result[4])
 
-    def __str__(self):
-        birthday_format = "%d %B %Y" if self.has_year else "%d %B"
-        birthday_str = self.birthday.strftime(birthday_format)
+    @classmethod
+    def from_record(
+        cls, record: TBirthdayRecord, need_id: bool = False, today: date | None = None
+    ) -> "TBirthday":
+        birthday = cls(None, need_id, today)
+        birthday.id = record.id
+        birthday.name = record.name
+        # Any leap year works when the year is unknown, it is never displayed
+        birthday.year = record.year if record.year is not None else 2000
+        birthday.month = record.month
+        birthday.day = record.day
+        birthday.has_year = record.has_year
+        return birthday
+
+    @property
+    def birthday(self) -> datetime | None:
+        if self.year is None:
+            return None
+        return datetime(self.year, self.month, self.day)
 
-        age_text = ""
+    def __str__(self):
+        month_name = calendar.month_name[self.month]
         if self.has_year:
-            current_year = datetime.now().year
-            age = current_year - self.birthday.year
-            # Check if birthday hasn't happened yet this year
-            # Handle leap year edge case (Feb 29 -> non-leap year)
-            birthday_this_year = _safe_replace_year(self.birthday, current_year)
-            if datetime.now() < birthday_this_year:
-                age -= 1
+            birthday_str = f"{self.day:02d} {month_name} {self.year}"
+            age = _age_on(self.year, self.month, self.day, self.today or date.today())
             age_text = f", _(Current age: {age} years)_"
+        else:
+            birthday_str = f"{self.day:02d} {month_name}"
+            age_text = ""
 
         id_text = f", ID: {self.id}" if self.need_id else ""
 
@@ -111,191 +318,732 @@ class TBirthday:
 def init_db() -> None:
     logging.debug(f"Initializing database at '{DB_FILE}'...")
     try:
-        conn = sqlite3.connect(DB_FILE)
-        logging.info("Database connected successfully.")
-        cursor = conn.cursor()
-        cursor.execute("PRAGMA journal_mode=WAL;")
+        # Drop connections that may point at a previous DB_FILE or a removed file
+        close_connections()
+        with transaction() as cursor:
+            logging.info("Database connected successfully.")
 
-        cursor.execute(
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_reminder_settings (
+                    chat_id INTEGER PRIMARY KEY,
+                    reminder_days TEXT DEFAULT "0,1,3,7",
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS user_language_settings (
+                    chat_id INTEGER PRIMARY KEY,
+                    language_code TEXT DEFAULT "en",
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                );
+            """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS backup_ping_settings (
+                    chat_id INTEGER PRIMARY KEY NOT NULL,
+                    last_updated_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    update_timedelta INT NOT NULL,
+                    is_active BOOLEAN DEFAULT FALSE,
+                    next_due INTEGER
+                );
+            """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS birthdays (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    chat_id INTEGER NOT NULL,
+                    name TEXT NOT NULL,
+                    birthday DATE NOT NULL,
+                    has_year BOOLEAN DEFAULT FALSE,
+                    month_day TEXT
+                );
             """
-            CREATE TABLE IF NOT EXISTS user_reminder_settings (
-                chat_id INTEGER PRIMARY KEY,
-                reminder_days TEXT DEFAULT "0,1,3,7",
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS reminder_ledger (
+                    birthday_id INTEGER NOT NULL,
+                    target_year INTEGER NOT NULL,
+                    days_until INTEGER NOT NULL,
+                    sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    PRIMARY KEY (birthday_id, target_year, days_until)
+                ) WITHOUT ROWID;
+            """
+            )
+            cursor.execute(
+                """
+                CREATE INDEX IF NOT EXISTS idx_reminder_ledger_target_year
+                ON reminder_ledger (target_year)
+                """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS conversation_state (
+                    store TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    value TEXT NOT NULL,
+                    expires_at REAL NOT NULL,
+                    PRIMARY KEY (store, chat_id)
+                ) WITHOUT ROWID;
+            """
+            )
+            _migrate_month_day(cursor)
+            _migrate_backup_next_due(cursor)
+            _migrate_reminder_flags(cursor)
+            _create_stats_tables(cursor)
+        logging.info("Database initialized successfully.")
+    except sqlite3.Error as e:
+        logging.error(f"Error initializing the database: {e}")
+        utils.log_exception(e)
+
+
+def _migrate_month_day(cursor: sqlite3.Cursor) -> None:
+    """
+    Add and backfill the indexed month_day ('MM-DD') column on birthdays.
+
+    Reminder and listing queries filter and sort by month_day instead of
+    strftime('%m-%d', birthday), which SQLite cannot serve from an index.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(birthdays)")]
+    if "month_day" not in columns:
+        logging.info("Migrating birthdays table: adding month_day column...")
+        cursor.execute("ALTER TABLE birthdays ADD COLUMN month_day TEXT")
+
+    cursor.execute(
         """
-        )
+        UPDATE birthdays
+        SET month_day = strftime('%m-%d', birthday)
+        WHERE month_day IS NULL
+        """
+    )
+    if cursor.rowcount > 0:
+        logging.info(f"Backfilled month_day for {cursor.rowcount} birthdays")
+
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_birthdays_month_day ON birthdays (month_day)"
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_birthdays_chat_id_month_day
+        ON birthdays (chat_id, month_day)
+        """
+    )
+
+
+def _migrate_backup_next_due(cursor: sqlite3.Cursor) -> None:
+    """
+    Add and backfill the indexed next_due column on backup_ping_settings.
+
+    next_due is the Unix time at which an active chat gets its next backup,
+    NULL for inactive chats, so finding the due chats is an index range scan
+    instead of a check of every chat.
+    """
+    columns = [
+        row[1] for row in cursor.execute("PRAGMA table_info(backup_ping_settings)")
+    ]
+    if "next_due" not in columns:
+        logging.info("Migrating backup_ping_settings table: adding next_due column...")
+        cursor.execute("ALTER TABLE backup_ping_settings ADD COLUMN next_due INTEGER")
         cursor.execute(
             """
-            CREATE TABLE IF NOT EXISTS user_language_settings (
-                chat_id INTEGER PRIMARY KEY,
-                language_code TEXT DEFAULT "en",
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            );
+            UPDATE backup_ping_settings
+            SET next_due = CAST(strftime('%s', last_updated_timestamp) AS INTEGER)
+                + update_timedelta * 60
+            WHERE is_active
+            """
+        )
+        logging.info(f"Backfilled next_due for {cursor.rowcount} backup pings")
+
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_backup_ping_settings_next_due
+        ON backup_ping_settings (next_due) WHERE next_due IS NOT NULL
         """
+    )
+
+
+# Boolean columns that recorded sent reminders before the reminder_ledger table
+LEGACY_REMINDER_FLAG_COLUMNS = {
+    0: "was_reminded_0_days_ago",
+    1: "was_reminded_1_days_ago",
+    3: "was_reminded_3_days_ago",
+    7: "was_reminded_7_days_ago",
+}
+# Legacy flags were only trusted this close to the birthday, older ones were stale
+LEGACY_REMINDER_FLAG_WINDOW_DAYS = 10
+
+
+def _migrate_reminder_flags(cursor: sqlite3.Cursor, now: datetime | None = None) -> None:
+    """
+    Move the legacy was_reminded_N_days_ago flags into reminder_ledger.
+
+    A set flag is carried over as a ledger row for the birthday occurrence
+    nearest to today, if that occurrence lies within the window in which the
+    old reset sweep kept flags alive. The flag columns are dropped afterwards.
+    """
+    columns = [row[1] for row in cursor.execute("PRAGMA table_info(birthdays)")]
+    legacy_columns = {
+        days: column
+        for days, column in LEGACY_REMINDER_FLAG_COLUMNS.items()
+        if column in columns
+    }
+    if not legacy_columns:
+        return
+
+    logging.info("Migrating birthdays table: moving reminder flags to reminder_ledger...")
+    today = (now or datetime.now()).date()
+    flagged = cursor.execute(
+        f"""
+        SELECT id, birthday, {", ".join(legacy_columns.values())} FROM birthdays
+        WHERE {" OR ".join(f"{column} = TRUE" for column in legacy_columns.values())}
+        """
+    ).fetchall()
+
+    entries = []
+    for birthday_id, birthday_str, *flags in flagged:
+        birthday = datetime.strptime(birthday_str, "%Y-%m-%d")
+        occurrence = min(
+            (
+                _safe_replace_year(birthday, year).date()
+                for year in (today.year - 1, today.year, today.year + 1)
+            ),
+            key=lambda day: abs((day - today).days),
+        )
+        if abs((occurrence - today).days) > LEGACY_REMINDER_FLAG_WINDOW_DAYS:
+            continue
+        entries.extend(
+            (birthday_id, occurrence.year, days)
+            for days, flag in zip(legacy_columns, flags)
+            if flag
         )
+
+    cursor.executemany(
+        """
+        INSERT OR IGNORE INTO reminder_ledger (birthday_id, target_year, days_until)
+        VALUES (?, ?, ?)
+        """,
+        entries,
+    )
+    logging.info(f"Moved {len(entries)} reminder flags to reminder_ledger")
+
+    # ALTER TABLE ... DROP COLUMN needs SQLite 3.35, older versions keep the unused columns
+    if sqlite3.sqlite_version_info >= (3, 35, 0):
+        for column in legacy_columns.values():
+            cursor.execute(f"ALTER TABLE birthdays DROP COLUMN {column}")
+    else:
+        # Cleared flags are not migrated again by the next init_db
         cursor.execute(
+            f"""
+            UPDATE birthdays SET {", ".join(f"{column} = FALSE" for column in legacy_columns.values())}
+            WHERE {" OR ".join(f"{column} = TRUE" for column in legacy_columns.values())}
             """
-            CREATE TABLE IF NOT EXISTS backup_ping_settings (
-                chat_id INTEGER PRIMARY KEY NOT NULL,
-                last_updated_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                update_timedelta INT NOT NULL,
-                is_active BOOLEAN DEFAULT FALSE
-            );
+        )
+
+
+# Birth year recorded in birthday_stats, 0 when the year is unknown
+_STATS_BIRTH_YEAR = (
+    "CASE WHEN {row}.has_year THEN CAST(substr({row}.birthday, 1, 4) AS INTEGER) ELSE 0 END"
+)
+_STATS_MONTH_DAY = "strftime('%m-%d', {row}.birthday)"
+
+
+def _create_stats_tables(cursor: sqlite3.Cursor) -> None:
+    """
+    Create the materialized global statistics and the triggers maintaining them.
+
+    birthday_stats holds the number of birthdays per (month_day, birth_year),
+    stats_counters the number of users and a version that changes with every
+    birthday write, so readers can cache what they derive from the table.
+    Triggers keep both in step with every write, whichever code path made it.
+    """
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS birthday_stats (
+            month_day TEXT NOT NULL,
+            birth_year INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (month_day, birth_year)
+        ) WITHOUT ROWID;
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        );
+        """
+    )
+
+    increment = """
+        INSERT INTO birthday_stats (month_day, birth_year, count)
+        VALUES ({month_day}, {birth_year}, 1)
+        ON CONFLICT (month_day, birth_year) DO UPDATE SET count = count + 1;
+    """.format(
+        month_day=_STATS_MONTH_DAY.format(row="NEW"),
+        birth_year=_STATS_BIRTH_YEAR.format(row="NEW"),
+    )
+    decrement = """
+        UPDATE birthday_stats SET count = count - 1
+        WHERE month_day = {month_day} AND birth_year = {birth_year};
+        DELETE FROM birthday_stats
+        WHERE month_day = {month_day} AND birth_year = {birth_year} AND count <= 0;
+    """.format(
+        month_day=_STATS_MONTH_DAY.format(row="OLD"),
+        birth_year=_STATS_BIRTH_YEAR.format(row="OLD"),
+    )
+    bump_version = "UPDATE stats_counters SET value = value + 1 WHERE name = 'version';"
+
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS birthdays_stats_insert
+        AFTER INSERT ON birthdays
+        BEGIN
+            {increment}
+            {bump_version}
+        END;
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS birthdays_stats_delete
+        AFTER DELETE ON birthdays
+        BEGIN
+            {decrement}
+            {bump_version}
+        END;
+        """
+    )
+    cursor.execute(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS birthdays_stats_update
+        AFTER UPDATE OF birthday, has_year ON birthdays
+        BEGIN
+            {decrement}
+            {increment}
+            {bump_version}
+        END;
+        """
+    )
+    # BEFORE, so INSERT OR REPLACE of an existing chat is not counted twice
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS user_reminder_settings_stats_insert
+        BEFORE INSERT ON user_reminder_settings
+        WHEN NOT EXISTS (SELECT 1 FROM user_reminder_settings WHERE chat_id = NEW.chat_id)
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+        END;
+        """
+    )
+    cursor.execute(
         """
+        CREATE TRIGGER IF NOT EXISTS user_reminder_settings_stats_delete
+        AFTER DELETE ON user_reminder_settings
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'users';
+        END;
+        """
+    )
+
+    initialized = cursor.execute(
+        "SELECT 1 FROM stats_counters WHERE name = 'version'"
+    ).fetchone()
+    if not initialized:
+        logging.info("Building materialized statistics...")
+        _rebuild_stats(cursor)
+
+
+def _rebuild_stats(cursor: sqlite3.Cursor) -> None:
+    cursor.execute("DELETE FROM birthday_stats")
+    cursor.execute(
+        """
+        INSERT INTO birthday_stats (month_day, birth_year, count)
+        SELECT {month_day}, {birth_year} AS birth_year, COUNT(*)
+        FROM birthdays
+        GROUP BY 1, 2
+        """.format(
+            month_day=_STATS_MONTH_DAY.format(row="birthdays"),
+            birth_year=_STATS_BIRTH_YEAR.format(row="birthdays"),
         )
-        cursor.execute(
-            """
-            CREATE TABLE IF NOT EXISTS birthdays (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER NOT NULL,
-                name TEXT NOT NULL,
-                birthday DATE NOT NULL,
-                has_year BOOLEAN DEFAULT FALSE,
-                was_reminded_0_days_ago BOOLEAN DEFAULT FALSE,
-                was_reminded_1_days_ago BOOLEAN DEFAULT FALSE,
-                was_reminded_3_days_ago BOOLEAN DEFAULT FALSE,
-                was_reminded_7_days_ago BOOLEAN DEFAULT FALSE
-            );
+    )
+    cursor.execute(
+        """
+        INSERT INTO stats_counters (name, value)
+        VALUES ('users', (SELECT COUNT(*) FROM user_reminder_settings))
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
         """
+    )
+    # A new version invalidates whatever readers cached from the old numbers
+    cursor.execute(
+        """
+        INSERT INTO stats_counters (name, value) VALUES ('version', 0)
+        ON CONFLICT (name) DO UPDATE SET value = value + 1
+        """
+    )
+
+
+def rebuild_stats() -> None:
+    """Recompute the materialized statistics from the birthdays table."""
+    try:
+        with transaction() as cursor:
+            _rebuild_stats(cursor)
+        logging.info("Materialized statistics rebuilt")
+    except sqlite3.Error as e:
+        logging.error(f"Error rebuilding statistics: {e}")
+        utils.log_exception(e)
+
+
+def check_stats() -> list[str]:
+    """
+    Compare the materialized statistics with a full recount.
+
+    Returns:
+        Human readable descriptions of every mismatch, empty if consistent
+    """
+    try:
+        conn = get_connection()
+        actual = dict(
+            (row[:2], row[2])
+            for row in conn.execute(
+                """
+                SELECT {month_day}, {birth_year}, COUNT(*) FROM birthdays
+                GROUP BY 1, 2
+                """.format(
+                    month_day=_STATS_MONTH_DAY.format(row="birthdays"),
+                    birth_year=_STATS_BIRTH_YEAR.format(row="birthdays"),
+                )
+            )
         )
-        conn.commit()
-        conn.close()
-        logging.info("Database initialized successfully.")
+        stored = {
+            (month_day, birth_year): count
+            for month_day, birth_year, count in get_birthday_stats()
+        }
+
+        mismatches = [
+            f"{month_day} (birth year {birth_year or 'unknown'}): "
+            f"stored {stored.get((month_day, birth_year), 0)}, "
+            f"actual {actual.get((month_day, birth_year), 0)}"
+            for month_day, birth_year in sorted(actual.keys() | stored.keys())
+            if stored.get((month_day, birth_year)) != actual.get((month_day, birth_year))
+        ]
+
+        actual_users = conn.execute(
+            "SELECT COUNT(*) FROM user_reminder_settings"
+        ).fetchone()[0]
+        stored_users = count_users()
+        if stored_users != actual_users:
+            mismatches.append(f"users: stored {stored_users}, actual {actual_users}")
+        return mismatches
     except sqlite3.Error as e:
-        logging.error(f"Error initializing the database: {e}")
+        logging.error(f"Error checking statistics: {e}")
         utils.log_exception(e)
 
 
-def get_reminder_settings(chat_id):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
+def get_birthday_stats() -> list[tuple[str, int, int]]:
+    """
+    Get the materialized birthday counts of all chats.
 
-    cursor.execute(
+    Returns:
+        Rows of (month_day, birth_year, count), birth_year is 0 if unknown
+    """
+    try:
+        cursor = get_connection().execute(
+            "SELECT month_day, birth_year, count FROM birthday_stats"
+        )
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error retrieving statistics: {e}")
+        utils.log_exception(e)
+
+
+def get_stats_version() -> int:
+    """Get a number that changes whenever the materialized statistics change."""
+    try:
+        cursor = get_connection().execute(
+            "SELECT value FROM stats_counters WHERE name = 'version'"
+        )
+        return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Error retrieving statistics version: {e}")
+        utils.log_exception(e)
+
+
+def _select_ordered_birthdays(where: str = "", params: tuple = ()) -> list[tuple]:
+    """
+    Select birthdays ordered by the next occurrence, starting from today.
+
+    Runs two index range scans (today..end of year, then start of year..today)
+    instead of sorting on a computed expression.
+    """
+    today = datetime.now().strftime("%m-%d")
+    condition = f"{where} AND" if where else ""
+    query = f"""
+        SELECT id, chat_id, name, birthday, has_year FROM birthdays
+        WHERE {condition} month_day {{}} ?
+        ORDER BY month_day, id
+    """
+
+    conn = get_connection()
+    this_year = conn.execute(query.format(">="), (*params, today)).fetchall()
+    next_year = conn.execute(query.format("<"), (*params, today)).fetchall()
+    return this_year + next_year
+
+
+def get_reminder_settings(chat_id):
+    cursor = get_connection().execute(
         "SELECT reminder_days FROM user_reminder_settings WHERE chat_id = ?", (chat_id,)
     )
     result = cursor.fetchone()
 
-    conn.close()
-
     if result and result[0]:
         return [int(x) for x in result[0].split(",")]
     return []
 
 
-def update_reminder_settings(chat_id, days):
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-
-    days_str = ",".join(map(str, sorted(days)))
-
-    cursor.execute(
-        """
-        INSERT OR REPLACE INTO user_reminder_settings (chat_id, reminder_days)
-        VALUES (?, ?)
-    """,
-        (chat_id, days_str),
+def get_all_reminder_settings() -> dict[int, list[int]]:
+    """Get reminder days for every chat in a single query."""
+    cursor = get_connection().execute(
+        "SELECT chat_id, reminder_days FROM user_reminder_settings"
     )
+    return {
+        chat_id: [int(x) for x in reminder_days.split(",")] if reminder_days else []
+        for chat_id, reminder_days in cursor
+    }
 
-    conn.commit()
-    conn.close()
 
+def update_reminder_settings(chat_id, days):
+    days_str = ",".join(map(str, sorted(days)))
 
-def get_all_birthdays_for_all_chats(need_id: bool = False) -> list[str]:
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+    with transaction() as cursor:
         cursor.execute(
             """
-            WITH ordered_birthdays AS (
-                SELECT *,
-                    CASE
-                        WHEN strftime('%m-%d', birthday) >= strftime('%m-%d', 'now')
-                        THEN 0  -- This year
-                        ELSE 1  -- Next year
-                    END as year_offset,
-                    strftime('%m-%d', birthday) as date_without_year
-                FROM birthdays
-            )
-            SELECT * FROM ordered_birthdays
-            ORDER BY year_offset, date_without_year
-            """,
+            INSERT OR REPLACE INTO user_reminder_settings (chat_id, reminder_days)
+            VALUES (?, ?)
+        """,
+            (chat_id, days_str),
         )
-        birthdays = cursor.fetchall()
-        conn.close()
-        return [str(TBirthday(birthday, need_id)) for birthday in birthdays]
+
+
+def list_birthdays(chat_id: int | None = None) -> list[TBirthdayRecord]:
+    """
+    List birthdays ordered by their next occurrence, starting from today.
+
+    Args:
+        chat_id: Chat to list birthdays of, or None for all chats
+    """
+    try:
+        if chat_id is None:
+            rows = _select_ordered_birthdays()
+        else:
+            rows = _select_ordered_birthdays("chat_id = ?", (chat_id,))
+        return [TBirthdayRecord.from_row(row) for row in rows]
     except sqlite3.Error as e:
         logging.error(f"Error retrieving birthdays from database: {e}")
         utils.log_exception(e)
 
 
-def get_all_birthdays(chat_id: int, need_id: bool = False) -> list[str]:
+def iter_birthdays(chat_id: int) -> Iterator[TBirthdayRecord]:
+    """
+    Like list_birthdays(), but yields records straight from the cursor.
+
+    Rows are fetched lazily, so memory does not grow with the size of the list.
+    """
+    today = datetime.now().strftime("%m-%d")
+    query = """
+        SELECT id, chat_id, name, birthday, has_year FROM birthdays
+        WHERE chat_id = ? AND month_day {} ?
+        ORDER BY month_day, id
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            WITH ordered_birthdays AS (
-                SELECT *,
-                    CASE
-                        WHEN strftime('%m-%d', birthday) >= strftime('%m-%d', 'now')
-                        THEN 0  -- This year
-                        ELSE 1  -- Next year
-                    END as year_offset,
-                    strftime('%m-%d', birthday) as date_without_year
-                FROM birthdays
-                WHERE chat_id = ?
-            )
-            SELECT * FROM ordered_birthdays
-            ORDER BY year_offset, date_without_year
-            """,
-            (chat_id,),
-        )
-        birthdays = cursor.fetchall()
-        conn.close()
-        return [str(TBirthday(birthday, need_id)) for birthday in birthdays]
+        conn = get_connection()
+        for operator in (">=", "<"):
+            for row in conn.execute(query.format(operator), (chat_id, today)):
+                yield TBirthdayRecord.from_row(row)
     except sqlite3.Error as e:
         logging.error(f"Error retrieving birthdays from database: {e}")
         utils.log_exception(e)
 
 
-def get_all_chat_ids() -> list[int]:
+# Birthdays shown per page of /backup and /delete_birthday
+BIRTHDAYS_PAGE_SIZE = 20
+
+
+class TBirthdayPage(NamedTuple):
+    records: list[TBirthdayRecord]
+    has_prev: bool
+    has_next: bool
+    # 'MM-DD' the listing starts at, to page on from the same point later
+    anchor: str
+
+
+def list_birthdays_page(
+    chat_id: int,
+    after: tuple[str, int] | None = None,
+    before: tuple[str, int] | None = None,
+    limit: int = BIRTHDAYS_PAGE_SIZE,
+    anchor: str | None = None,
+) -> TBirthdayPage:
+    """
+    Fetch one page of a chat's birthdays, in the same order as list_birthdays().
+
+    Pages are addressed by keyset cursors on (month_day, id) rather than
+    offsets, so every page costs at most two index range scans of `limit` + 1
+    rows. The listing starts at the anchor date and wraps around the end of
+    the year, so it is split into a segment of dates from the anchor on and
+    one of earlier dates.
+
+    Args:
+        chat_id: Chat to list birthdays of
+        after: Cursor of the last record of the previous page, to page forward
+        before: Cursor of the first record of the next page, to page backward
+        limit: Page size
+        anchor: 'MM-DD' the listing starts at, today by default; pass the
+            page's anchor back with its cursors so pages stay consistent
+            across midnight
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            SELECT DISTINCT chat_id FROM user_reminder_settings
-        """
+        if anchor is None:
+            anchor = datetime.now().strftime("%m-%d")
+        segments = ["month_day >= ?", "month_day < ?"]
+        conn = get_connection()
+
+        def fetch(segment: int, cursor_op: str, cursor: tuple | None, order: str, count: int):
+            condition = segments[segment]
+            params = [chat_id, anchor]
+            if cursor is not None:
+                condition += f" AND (month_day, id) {cursor_op} (?, ?)"
+                params.extend(cursor)
+            return conn.execute(
+                f"""
+                SELECT id, chat_id, name, birthday, has_year FROM birthdays
+                WHERE chat_id = ? AND {condition}
+                ORDER BY month_day {order}, id {order}
+                LIMIT ?
+                """,
+                (*params, count),
+            ).fetchall()
+
+        rows = []
+        if before is None:
+            start = 0 if after is None or after[0] >= anchor else 1
+            for segment in range(start, 2):
+                cursor = after if segment == start else None
+                rows += fetch(segment, ">", cursor, "ASC", limit + 1 - len(rows))
+                if len(rows) > limit:
+                    break
+            has_prev, has_next = after is not None, len(rows) > limit
+            rows = rows[:limit]
+        else:
+            start = 1 if before[0] < anchor else 0
+            for segment in range(start, -1, -1):
+                cursor = before if segment == start else None
+                rows += fetch(segment, "<", cursor, "DESC", limit + 1 - len(rows))
+                if len(rows) > limit:
+                    break
+            has_prev, has_next = len(rows) > limit, True
+            rows = rows[:limit][::-1]
+
+        return TBirthdayPage(
+            [TBirthdayRecord.from_row(row) for row in rows], has_prev, has_next, anchor
         )
-        chat_ids = cursor.fetchall()
-        conn.close()
-        return chat_ids
     except sqlite3.Error as e:
-        logging.error(f"Error retrieving chat_ids from database: {e}")
+        logging.error(f"Error retrieving birthdays page from database: {e}")
         utils.log_exception(e)
 
 
-def register_backup_ping(chat_id: int, update_timedelta: int) -> None:
+def get_month_day_counts(chat_id: int | None = None) -> dict[str, int]:
+    """
+    Count birthdays per 'MM-DD' date, for one chat or for all chats.
+
+    Served by a scan of the month_day indexes, no table rows are read.
+    """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        where = "WHERE chat_id = ?" if chat_id is not None else ""
+        params = (chat_id,) if chat_id is not None else ()
+        cursor = get_connection().execute(
+            f"""
+            SELECT month_day, COUNT(*) FROM birthdays {where}
+            GROUP BY month_day
+            """,
+            params,
+        )
+        return dict(cursor.fetchall())
+    except sqlite3.Error as e:
+        logging.error(f"Error counting birthdays per date: {e}")
+        utils.log_exception(e)
 
-        cursor.execute(
-            """
-            INSERT INTO backup_ping_settings (chat_id, is_active, last_updated_timestamp, update_timedelta)
-            VALUES (?, TRUE, CURRENT_TIMESTAMP, ?)
-            ON CONFLICT(chat_id) DO UPDATE SET
-                is_active = TRUE,
-                last_updated_timestamp = CURRENT_TIMESTAMP,
-                update_timedelta = ?
+
+def get_birth_year_counts(
+    today_month_day: str, chat_id: int | None = None
+) -> list[tuple[int, bool, int]]:
+    """
+    Count birthdays with a known year per birth year.
+
+    Args:
+        today_month_day: Today as 'MM-DD', splits every year into birthdays
+            that already happened this year and those still ahead
+        chat_id: Restrict to one chat, or None for all chats
+
+    Returns:
+        Rows of (birth_year, had_birthday_this_year, count)
+    """
+    try:
+        condition = "AND chat_id = ?" if chat_id is not None else ""
+        params = (chat_id,) if chat_id is not None else ()
+        cursor = get_connection().execute(
+            f"""
+            SELECT CAST(substr(birthday, 1, 4) AS INTEGER) AS birth_year,
+                month_day <= ? AS had_birthday,
+                COUNT(*)
+            FROM birthdays
+            WHERE has_year = TRUE {condition}
+            GROUP BY birth_year, had_birthday
             """,
-            (chat_id, update_timedelta, update_timedelta),
+            (today_month_day, *params),
         )
+        return [
+            (birth_year, bool(had_birthday), count)
+            for birth_year, had_birthday, count in cursor
+        ]
+    except sqlite3.Error as e:
+        logging.error(f"Error counting birthdays per birth year: {e}")
+        utils.log_exception(e)
 
-        conn.commit()
-        conn.close()
+
+def count_users() -> int:
+    try:
+        cursor = get_connection().execute(
+            "SELECT value FROM stats_counters WHERE name = 'users'"
+        )
+        return cursor.fetchone()[0]
+    except sqlite3.Error as e:
+        logging.error(f"Error counting users: {e}")
+        utils.log_exception(e)
+
+
+def register_backup_ping(chat_id: int, update_timedelta: int) -> None:
+    try:
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO backup_ping_settings
+                    (chat_id, is_active, last_updated_timestamp, update_timedelta, next_due)
+                VALUES (?, TRUE, CURRENT_TIMESTAMP, ?, CAST(strftime('%s', 'now') AS INTEGER) + ? * 60)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    is_active = TRUE,
+                    last_updated_timestamp = excluded.last_updated_timestamp,
+                    update_timedelta = excluded.update_timedelta,
+                    next_due = excluded.next_due
+                """,
+                (chat_id, update_timedelta, update_timedelta),
+            )
     except sqlite3.Error as e:
         logging.error(f"Error registering backup ping: {e}")
         utils.log_exception(e)
@@ -303,18 +1051,18 @@ def register_backup_ping(chat_id: int, update_timedelta: int) -> None:
 
 def update_backup_ping(chat_id: int) -> None:
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE backup_ping_settings
-            SET last_updated_timestamp = CURRENT_TIMESTAMP
-            WHERE chat_id = ?
-        """,
-            (chat_id,),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                UPDATE backup_ping_settings
+                SET last_updated_timestamp = CURRENT_TIMESTAMP,
+                    next_due = CASE WHEN is_active
+                        THEN CAST(strftime('%s', 'now') AS INTEGER) + update_timedelta * 60
+                    END
+                WHERE chat_id = ?
+            """,
+                (chat_id,),
+            )
     except sqlite3.Error as e:
         logging.error(f"Error updating last backup sent: {e}")
         utils.log_exception(e)
@@ -322,36 +1070,66 @@ def update_backup_ping(chat_id: int) -> None:
 
 def unregister_backup_ping(chat_id: int) -> None:
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            """
-            UPDATE backup_ping_settings
-            SET is_active = FALSE
-            WHERE chat_id = ?
-        """,
-            (chat_id,),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                UPDATE backup_ping_settings
+                SET is_active = FALSE, next_due = NULL
+                WHERE chat_id = ?
+            """,
+                (chat_id,),
+            )
     except sqlite3.Error as e:
         logging.error(f"Error unregistering backup ping: {e}")
         utils.log_exception(e)
 
 
+def claim_due_backup_pings(now: int | None = None) -> list[int]:
+    """
+    Find the chats whose backup is due and schedule their next one.
+
+    Only the due rows are read, through the index on next_due.
+
+    Args:
+        now: Unix time to compare next_due against, defaults to the current time
+
+    Returns:
+        Chat IDs to send a backup to, most overdue first
+    """
+    now = int(time.time()) if now is None else now
+    try:
+        with transaction() as cursor:
+            due = cursor.execute(
+                """
+                SELECT chat_id, update_timedelta FROM backup_ping_settings
+                WHERE next_due <= ?
+                ORDER BY next_due
+                """,
+                (now,),
+            ).fetchall()
+            cursor.executemany(
+                """
+                UPDATE backup_ping_settings
+                SET last_updated_timestamp = datetime(?, 'unixepoch'), next_due = ?
+                WHERE chat_id = ?
+                """,
+                [(now, now + interval * 60, chat_id) for chat_id, interval in due],
+            )
+        return [chat_id for chat_id, _ in due]
+    except sqlite3.Error as e:
+        logging.error(f"Error claiming due backup pings: {e}")
+        utils.log_exception(e)
+
+
 def select_from_backup_ping(chat_id: int) -> TBackupPingSettings:
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
+        cursor = get_connection().execute(
             """
             SELECT * FROM backup_ping_settings WHERE chat_id = ?
         """,
             (chat_id,),
         )
-        data = cursor.fetchone()
-        conn.close()
-        return TBackupPingSettings(data)
+        return TBackupPingSettings(cursor.fetchone())
     except sqlite3.Error as e:
         logging.error(f"Error retrieving last backup sent: {e}")
         utils.log_exception(e)
@@ -359,182 +1137,190 @@ def select_from_backup_ping(chat_id: int) -> TBackupPingSettings:
 
 def register_birthday(
     chat_id: int, name: str, birthday: datetime, has_year: bool
-) -> None:
+) -> int | None:
+    """Insert a birthday and return its ID."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
         birthday_str = birthday.strftime("%Y-%m-%d")
+        month_day = birthday.strftime("%m-%d")
 
-        cursor.execute(
-            """
-            INSERT INTO birthdays (chat_id, name, birthday, has_year)
-            VALUES (?, ?, ?, ?)
-            """,
-            (chat_id, name, birthday_str, has_year),
-        )
-        conn.commit()
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO birthdays (chat_id, name, birthday, has_year, month_day)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                (chat_id, name, birthday_str, has_year, month_day),
+            )
+            birthday_id = cursor.lastrowid
+
+        _bump_chat_version(chat_id)
+        return birthday_id
     except sqlite3.Error as e:
         logging.error(f"Error registering birthday: {e}")
         utils.log_exception(e)
 
 
-def get_upcoming_birthdays(days_ahead: int) -> list[tuple]:
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        today = datetime.now()
-        future_date = today + timedelta(days=days_ahead)
-        start_date_str = future_date.strftime("%m-%d")
-        end_date_str = future_date.strftime("%m-%d")
+def register_birthdays(
+    chat_id: int, birthdays: list[utils.TParsedBirthday]
+) -> list[int]:
+    """
+    Insert many birthdays of a chat in a single transaction.
 
-        reminder_field = f"was_reminded_{days_ahead}_days_ago"
+    Args:
+        chat_id: Chat the birthdays belong to
+        birthdays: (name, birthday, has_year) of each birthday
 
-        query = f"""
-            SELECT id, chat_id, name, birthday, has_year FROM birthdays
-            WHERE strftime('%m-%d', birthday) BETWEEN ? AND ?
-            AND {reminder_field} = FALSE
-        """
+    Returns:
+        IDs of the inserted birthdays, in the order given
 
-        cursor.execute(query, (start_date_str, end_date_str))
+    Raises:
+        sqlite3.Error: If the birthdays couldn't be saved, then none of them are
+    """
+    if not birthdays:
+        return []
 
-        birthdays = cursor.fetchall()
-        conn.close()
+    rows = [
+        (chat_id, name, birthday.strftime("%Y-%m-%d"), has_year, birthday.strftime("%m-%d"))
+        for name, birthday, has_year in birthdays
+    ]
+    try:
+        with transaction() as cursor:
+            cursor.executemany(
+                """
+                INSERT INTO birthdays (chat_id, name, birthday, has_year, month_day)
+                VALUES (?, ?, ?, ?, ?)
+                """,
+                rows,
+            )
+            # The transaction holds the write lock, so the AUTOINCREMENT ids
+            # handed out by executemany are consecutive
+            last_id = cursor.execute("SELECT last_insert_rowid()").fetchone()[0]
 
-        return birthdays
+        _bump_chat_version(chat_id)
+        return list(range(last_id - len(rows) + 1, last_id + 1))
     except sqlite3.Error as e:
-        logging.error(f"Error retrieving upcoming birthdays: {e}")
+        logging.error(f"Error registering birthdays: {e}")
+        # Re-raises, an empty list would read as nothing to register
         utils.log_exception(e)
 
 
-def mark_birthday_reminder_sent(birthday_id: int, days_until: int) -> None:
+def get_all_birthdays_for_reminders() -> list[tuple]:
     """
-    Mark that a birthday reminder has been sent for a specific number of days.
+    Get every birthday, for building the reminder schedule.
 
-    Args:
-        birthday_id: The ID of the birthday record
-        days_until: Number of days until the birthday (0, 1, 3, or 7)
+    Returns:
+        Rows of (id, chat_id, name, birthday, has_year)
     """
     try:
-        # Validate input to prevent SQL injection
-        if days_until not in [0, 1, 3, 7]:
-            logging.error(
-                f"Invalid days_until value: {days_until}. Must be 0, 1, 3, or 7."
-            )
-            return
-
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        cursor = get_connection().execute(
+            "SELECT id, chat_id, name, birthday, has_year FROM birthdays"
+        )
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"Error retrieving birthdays for reminders: {e}")
+        utils.log_exception(e)
 
-        # Use proper parameterized query for safety
-        if days_until == 0:
-            cursor.execute(
-                "UPDATE birthdays SET was_reminded_0_days_ago = TRUE WHERE id = ?",
-                (birthday_id,),
-            )
-        elif days_until == 1:
-            cursor.execute(
-                "UPDATE birthdays SET was_reminded_1_days_ago = TRUE WHERE id = ?",
-                (birthday_id,),
-            )
-        elif days_until == 3:
-            cursor.execute(
-                "UPDATE birthdays SET was_reminded_3_days_ago = TRUE WHERE id = ?",
-                (birthday_id,),
-            )
-        elif days_until == 7:
-            cursor.execute(
-                "UPDATE birthdays SET was_reminded_7_days_ago = TRUE WHERE id = ?",
-                (birthday_id,),
-            )
 
-        conn.commit()
-        conn.close()
+def get_sent_reminders(min_year: int, chat_id: int | None = None) -> set[tuple[int, int, int]]:
+    """
+    Get reminders sent for birthday occurrences in `min_year` or later.
 
-        logging.debug(
-            f"Marked {days_until}-day reminder as sent for birthday ID {birthday_id}"
-        )
+    Args:
+        min_year: Earliest birthday occurrence year to include
+        chat_id: Only include birthdays of this chat, all chats if None
 
+    Returns:
+        Set of (birthday_id, days_until, target_year)
+    """
+    try:
+        if chat_id is None:
+            cursor = get_connection().execute(
+                """
+                SELECT birthday_id, days_until, target_year FROM reminder_ledger
+                WHERE target_year >= ?
+                """,
+                (min_year,),
+            )
+        else:
+            cursor = get_connection().execute(
+                """
+                SELECT birthday_id, days_until, target_year FROM reminder_ledger
+                WHERE target_year >= ? AND birthday_id IN (
+                    SELECT id FROM birthdays WHERE chat_id = ?
+                )
+                """,
+                (min_year, chat_id),
+            )
+        return set(cursor.fetchall())
     except sqlite3.Error as e:
-        logging.error(f"Error marking reminder as sent: {e}")
+        logging.error(f"Error retrieving sent reminders: {e}")
         utils.log_exception(e)
 
 
-def reset_birthday_reminder_flags() -> None:
+def mark_birthday_reminders_sent(reminders: list[tuple[int, int, int]]) -> None:
     """
-    Reset reminder flags for birthdays that are:
-    - More than 10 days in the future
-    - More than 10 days in the past
-    This ensures that reminders will be sent again next year and prevents duplicate reminders.
+    Record many sent reminders in the ledger with a single transaction.
+
+    Reminders are only written for current occurrences, so ledger rows more
+    than a year older than those can never be consulted again. They are pruned
+    here, on the write path, instead of by a periodic sweep.
+
+    Args:
+        reminders: Triples of (birthday_id, days_until, target_year)
     """
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        # Reset flags for birthdays that are either:
-        # 1. More than 10 days in the past
-        # 2. More than 10 days in the future
-        query = """
-            UPDATE birthdays
-            SET was_reminded_0_days_ago = FALSE,
-                was_reminded_1_days_ago = FALSE,
-                was_reminded_3_days_ago = FALSE,
-                was_reminded_7_days_ago = FALSE
-            WHERE (
-                was_reminded_0_days_ago = TRUE
-                OR was_reminded_1_days_ago = TRUE
-                OR was_reminded_3_days_ago = TRUE
-                OR was_reminded_7_days_ago = TRUE
-            )
-            AND (
-                -- Case 1: Birthday is more than 10 days in the past
-                (
-                    strftime('%m-%d', birthday) < strftime('%m-%d', date('now', '-10 days'))
-                    AND
-                    strftime('%m-%d', birthday) < strftime('%m-%d', 'now')
-                )
-                OR
-                -- Case 2: Birthday is more than 10 days in the future
-                (
-                    strftime('%m-%d', birthday) > strftime('%m-%d', date('now', '+10 days'))
-                    AND
-                    strftime('%m-%d', birthday) > strftime('%m-%d', 'now')
+        entries = []
+        for birthday_id, days_until, target_year in reminders:
+            if days_until < 0:
+                logging.error(
+                    f"Invalid days_until value: {days_until}. Must not be negative."
                 )
-            )
-        """
+                continue
+            entries.append((birthday_id, target_year, days_until))
 
-        cursor.execute(query)
-        rows_affected = cursor.rowcount
-        conn.commit()
+        if not entries:
+            return
 
-        if rows_affected > 0:
-            logging.info(f"Reset reminder flags for {rows_affected} birthdays")
-        conn.close()
+        with transaction() as cursor:
+            cursor.executemany(
+                """
+                INSERT OR IGNORE INTO reminder_ledger (birthday_id, target_year, days_until)
+                VALUES (?, ?, ?)
+                """,
+                entries,
+            )
+            cursor.execute(
+                "DELETE FROM reminder_ledger WHERE target_year < ?",
+                (min(entry[1] for entry in entries) - 1,),
+            )
+            if cursor.rowcount > 0:
+                logging.info(f"Pruned {cursor.rowcount} old reminder ledger entries")
+
+        logging.debug(f"Marked {len(entries)} reminders as sent")
 
     except sqlite3.Error as e:
-        logging.error(f"Error resetting birthday reminder flags: {e}")
+        logging.error(f"Error marking reminders as sent: {e}")
         utils.log_exception(e)
 
 
 def delete_birthday(chat_id: int, birthday_id: int) -> None:
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        cursor.execute(
-            """
-            DELETE FROM birthdays
-            WHERE id = ? AND chat_id = ?
-            """,
-            (birthday_id, chat_id),
-        )
-
-        conn.commit()
-        deleted_rows = cursor.rowcount
-        conn.close()
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                DELETE FROM birthdays
+                WHERE id = ? AND chat_id = ?
+                """,
+                (birthday_id, chat_id),
+            )
+            deleted_rows = cursor.rowcount
+            if deleted_rows:
+                cursor.execute(
+                    "DELETE FROM reminder_ledger WHERE birthday_id = ?", (birthday_id,)
+                )
 
+        if deleted_rows:
+            _bump_chat_version(chat_id)
         return deleted_rows
     except sqlite3.Error as e:
         logging.error(f"Error deleting birthday: {e}")
@@ -545,15 +1331,11 @@ def delete_birthday(chat_id: int, birthday_id: int) -> None:
 def get_user_language(chat_id: int) -> str:
     """Get user's language preference. Returns 'en' as default."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-
-        cursor.execute(
+        cursor = get_connection().execute(
             "SELECT language_code FROM user_language_settings WHERE chat_id = ?",
             (chat_id,),
         )
         result = cursor.fetchone()
-        conn.close()
 
         return result[0] if result else "en"
     except sqlite3.Error as e:
@@ -565,25 +1347,98 @@ def get_user_language(chat_id: int) -> str:
 def set_user_language(chat_id: int, language_code: str) -> None:
     """Set user's language preference."""
     try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO user_language_settings (chat_id, language_code, updated_at)
+                VALUES (?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(chat_id) DO UPDATE SET
+                    language_code = ?,
+                    updated_at = CURRENT_TIMESTAMP
+                """,
+                (chat_id, language_code, language_code),
+            )
 
-        cursor.execute(
+        logging.info(f"Set language to '{language_code}' for chat {chat_id}")
+
+    except sqlite3.Error as e:
+        logging.error(f"Error setting user language: {e}")
+        utils.log_exception(e)
+
+
+def load_conversation_state(
+    store: str, chat_id: int, now: float
+) -> tuple[str, float] | None:
+    """
+    Get a chat's persisted conversation state.
+
+    Returns:
+        (JSON value, expires_at) or None if there is no unexpired entry
+    """
+    try:
+        cursor = get_connection().execute(
             """
-            INSERT INTO user_language_settings (chat_id, language_code, updated_at)
-            VALUES (?, ?, CURRENT_TIMESTAMP)
-            ON CONFLICT(chat_id) DO UPDATE SET
-                language_code = ?,
-                updated_at = CURRENT_TIMESTAMP
+            SELECT value, expires_at FROM conversation_state
+            WHERE store = ? AND chat_id = ? AND expires_at > ?
             """,
-            (chat_id, language_code, language_code),
+            (store, chat_id, now),
         )
+        return cursor.fetchone()
+    except sqlite3.Error as e:
+        logging.error(f"Error loading conversation state: {e}")
+        utils.log_exception(e)
 
-        conn.commit()
-        conn.close()
 
-        logging.info(f"Set language to '{language_code}' for chat {chat_id}")
+def save_conversation_state(
+    store: str, chat_id: int, value: str, expires_at: float
+) -> None:
+    try:
+        with transaction() as cursor:
+            cursor.execute(
+                """
+                INSERT INTO conversation_state (store, chat_id, value, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(store, chat_id) DO UPDATE SET
+                    value = excluded.value,
+                    expires_at = excluded.expires_at
+                """,
+                (store, chat_id, value, expires_at),
+            )
+    except sqlite3.Error as e:
+        logging.error(f"Error saving conversation state: {e}")
+        utils.log_exception(e)
+
 
+def delete_conversation_state(store: str, chat_id: int) -> None:
+    try:
+        with transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM conversation_state WHERE store = ? AND chat_id = ?",
+                (store, chat_id),
+            )
     except sqlite3.Error as e:
-        logging.error(f"Error setting user language: {e}")
+        logging.error(f"Error deleting conversation state: {e}")
+        utils.log_exception(e)
+
+
+def purge_conversation_state(store: str, now: float) -> int:
+    """Delete a store's expired conversation state and return how many entries were deleted."""
+    try:
+        with transaction() as cursor:
+            cursor.execute(
+                "DELETE FROM conversation_state WHERE store = ? AND expires_at <= ?",
+                (store, now),
+            )
+            return cursor.rowcount
+    except sqlite3.Error as e:
+        logging.error(f"Error purging conversation state: {e}")
+        utils.log_exception(e)
+
+
+def clear_conversation_state(store: str) -> None:
+    try:
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM conversation_state WHERE store = ?", (store,))
+    except sqlite3.Error as e:
+        logging.error(f"Error clearing conversation state: {e}")
         utils.log_exception(e)
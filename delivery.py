@@ -0,0 +1,463 @@
+"""
+Rate-limited outbound message delivery.
+
+Messages are queued and sent by a pool of worker threads, so one slow
+Telegram round-trip or a 429 no longer blocks the caller. Each chat is
+hashed to a single worker lane, which keeps messages to a chat in order.
+Sends are throttled by a global token bucket and a per-chat one to stay
+under Telegram's limits. A chat that has to wait for its bucket or back off
+after an error is put back on its lane with a ready time, so the worker
+carries on with the other chats of the lane meanwhile. TAsyncOutboundQueue
+does the same on an asyncio event loop, with a task per message instead of
+worker threads.
+"""
+
+import asyncio
+import collections
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable
+
+# Telegram allows roughly 30 messages per second overall
+GLOBAL_RATE = 30
+# ...and about one message per second to the same chat
+PER_CHAT_RATE = 1
+PER_CHAT_BURST = 3
+WORKERS = 4
+MAX_RETRIES = 5
+# Backoff for network and server errors, doubled on every retry
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 60.0
+# Idle per-chat buckets are dropped once there are more than this many
+MAX_CHAT_BUCKETS = 10000
+
+
+class TTokenBucket:
+    """
+    Token bucket rate limiter.
+
+    reserve() always takes a token and returns how long the caller has to wait
+    before using it, so concurrent callers queue up fairly instead of spinning.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        with self._lock:
+            now = self._refill()
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+            return max(wait, self.paused_until - now)
+
+    def acquire(self) -> float:
+        """
+        Take a token if one is available now.
+
+        Returns:
+            0 if a token was taken, otherwise the seconds until one is
+            available; nothing is taken then
+        """
+        with self._lock:
+            now = self._refill()
+            wait = max((1 - self.tokens) / self.rate, self.paused_until - now)
+            if wait > 0:
+                return wait
+            self.tokens -= 1
+            return 0.0
+
+    def pause(self, seconds: float) -> None:
+        """Block the bucket, e.g. for the retry_after of a 429 response."""
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
+
+    def is_idle(self) -> bool:
+        with self._lock:
+            now = self._refill()
+            return self.tokens >= self.capacity and self.paused_until <= now
+
+    def _refill(self) -> float:
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+
+def get_retry_after(exc: Exception) -> int | None:
+    """Extract retry_after from a 429 telebot.apihelper.ApiTelegramException."""
+    if getattr(exc, "error_code", None) != 429:
+        return None
+    result_json = getattr(exc, "result_json", None) or {}
+    return result_json.get("parameters", {}).get("retry_after", 1)
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Client errors (blocked bot, bad request) are final, everything else is retried."""
+    error_code = getattr(exc, "error_code", None)
+    return error_code is None or error_code == 429 or error_code >= 500
+
+
+def when_all(futures: list[Future], callback: Callable[[list[Future]], None]) -> None:
+    """Call `callback(futures)` once, after every future has completed."""
+    if not futures:
+        callback(futures)
+        return
+
+    remaining = len(futures)
+    lock = threading.Lock()
+
+    def on_done(_):
+        nonlocal remaining
+        with lock:
+            remaining -= 1
+            is_last = remaining == 0
+        if is_last:
+            callback(futures)
+
+    for future in futures:
+        future.add_done_callback(on_done)
+
+
+class TOutboundMessage:
+    def __init__(self, chat_id: int, text: str, kwargs: dict):
+        self.chat_id = chat_id
+        self.text = text
+        self.kwargs = kwargs
+        self.future: Future = Future()
+        self.attempts = 0
+
+
+class TDeliveryLane:
+    """
+    Messages of the chats assigned to one worker.
+
+    Each chat's messages wait in a FIFO, and the chats themselves in a heap
+    keyed by the time their first message may be attempted, so a chat that
+    is rate limited or backing off doesn't hold up the others.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._chats: dict[int, collections.deque] = {}
+        # (ready time, sequence, chat_id) for every chat in _chats
+        self._ready: list[tuple[float, int, int]] = []
+        self._counter = itertools.count()
+        self._closed = False
+
+    def put(self, message: TOutboundMessage) -> None:
+        with self._condition:
+            messages = self._chats.get(message.chat_id)
+            if messages is not None:
+                # The chat is already scheduled, its first message goes first
+                messages.append(message)
+                return
+            self._chats[message.chat_id] = collections.deque([message])
+            self._schedule_locked(message.chat_id, 0.0)
+            self._condition.notify()
+
+    def get(self) -> TOutboundMessage | None:
+        """
+        Wait for the first message of the chat that is ready first. It stays
+        queued until done() or retry_later() is called for it.
+
+        Returns:
+            The message, or None once the lane is closed and empty
+        """
+        with self._condition:
+            while True:
+                if self._ready:
+                    wait = self._ready[0][0] - time.monotonic()
+                    if wait <= 0:
+                        chat_id = heapq.heappop(self._ready)[2]
+                        return self._chats[chat_id][0]
+                elif self._closed:
+                    return None
+                else:
+                    wait = None
+                self._condition.wait(wait)
+
+    def done(self, message: TOutboundMessage) -> None:
+        """Drop a delivered or failed message and schedule the chat's next one."""
+        with self._condition:
+            messages = self._chats[message.chat_id]
+            messages.popleft()
+            if messages:
+                self._schedule_locked(message.chat_id, 0.0)
+            else:
+                del self._chats[message.chat_id]
+
+    def retry_later(self, message: TOutboundMessage, delay: float) -> None:
+        with self._condition:
+            self._schedule_locked(message.chat_id, delay)
+
+    def close(self) -> None:
+        """Let get() return None once every queued message is done."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def pending(self) -> int:
+        with self._condition:
+            return sum(len(messages) for messages in self._chats.values())
+
+    def _schedule_locked(self, chat_id: int, delay: float) -> None:
+        heapq.heappush(self._ready, (time.monotonic() + delay, next(self._counter), chat_id))
+
+
+class TOutboundQueue:
+    """
+    Queue of outbound messages drained by a pool of worker threads.
+
+    send_message() returns a concurrent.futures.Future resolved with whatever
+    `send_func` returned (the telebot Message) or with the final exception,
+    so callers can report delivery results via add_done_callback().
+    """
+
+    def __init__(
+        self,
+        send_func: Callable,
+        workers: int = WORKERS,
+        global_rate: float = GLOBAL_RATE,
+        per_chat_rate: float = PER_CHAT_RATE,
+        per_chat_burst: float = PER_CHAT_BURST,
+        max_retries: int = MAX_RETRIES,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.send_func = send_func
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.global_bucket = TTokenBucket(global_rate)
+        self.per_chat_rate = per_chat_rate
+        self.per_chat_burst = per_chat_burst
+        self._chat_buckets: dict[int, TTokenBucket] = {}
+        self._buckets_lock = threading.Lock()
+        self._lanes = [TDeliveryLane() for _ in range(workers)]
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        for lane in self._lanes:
+            thread = threading.Thread(target=self._worker, args=(lane,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Let the workers finish what is queued, then stop them."""
+        for lane in self._lanes:
+            lane.close()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> Future:
+        message = TOutboundMessage(chat_id, text, kwargs)
+        self._lanes[hash(chat_id) % len(self._lanes)].put(message)
+        return message.future
+
+    def pending(self) -> int:
+        return sum(lane.pending() for lane in self._lanes)
+
+    def _worker(self, lane: TDeliveryLane) -> None:
+        while True:
+            message = lane.get()
+            if message is None:
+                return
+            try:
+                delay = self._attempt(message)
+            except Exception as e:
+                logging.error(f"Unexpected error in outbound worker: {e}")
+                if not message.future.done():
+                    message.future.set_exception(e)
+                delay = None
+
+            if delay is None:
+                lane.done(message)
+            else:
+                lane.retry_later(message, delay)
+
+    def _attempt(self, message: TOutboundMessage) -> float | None:
+        """
+        Try to send a message once.
+
+        Returns:
+            Seconds until the message may be attempted again, or None if it
+            was delivered or given up on
+        """
+        chat_bucket = self._chat_bucket(message.chat_id)
+        wait = chat_bucket.acquire()
+        if wait > 0:
+            return wait
+        # The global limit holds back every chat alike, so waiting for it here is fair
+        wait = self.global_bucket.reserve()
+        if wait > 0:
+            self.sleep(wait)
+
+        message.attempts += 1
+        try:
+            result = self.send_func(message.chat_id, message.text, **message.kwargs)
+        except Exception as e:
+            return self._on_send_error(message, chat_bucket, e)
+
+        message.future.set_result(result)
+        return None
+
+    def _on_send_error(
+        self, message: TOutboundMessage, chat_bucket: TTokenBucket, exc: Exception
+    ) -> float | None:
+        """
+        Decide what to do about a failed send.
+
+        Returns:
+            Seconds to back off before the next attempt, or None if the
+            message was given up on and its future failed
+        """
+        if not is_retryable(exc) or message.attempts > self.max_retries:
+            logging.warning(
+                f"Giving up on message to chat {message.chat_id} after {message.attempts} attempts: {exc}"
+            )
+            message.future.set_exception(exc)
+            return None
+
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            logging.warning(
+                f"Rate limited sending to chat {message.chat_id}, retrying in {retry_after}s"
+            )
+            # Telegram doesn't say which limit was hit, so hold back every chat too
+            chat_bucket.pause(retry_after)
+            self.global_bucket.pause(retry_after)
+            return 0.0
+
+        backoff = min(
+            BASE_BACKOFF_SECONDS * 2 ** (message.attempts - 1),
+            MAX_BACKOFF_SECONDS,
+        )
+        logging.warning(
+            f"Error sending to chat {message.chat_id}, retrying in {backoff}s: {exc}"
+        )
+        return backoff
+
+    def _chat_bucket(self, chat_id: int) -> TTokenBucket:
+        with self._buckets_lock:
+            bucket = self._chat_buckets.get(chat_id)
+            if bucket is None:
+                if len(self._chat_buckets) >= MAX_CHAT_BUCKETS:
+                    self._chat_buckets = {
+                        key: value
+                        for key, value in self._chat_buckets.items()
+                        if not value.is_idle()
+                    }
+                bucket = TTokenBucket(self.per_chat_rate, self.per_chat_burst)
+                self._chat_buckets[chat_id] = bucket
+            return bucket
+
+
+class TAsyncOutboundQueue(TOutboundQueue):
+    """
+    Outbound queue for the asyncio runtime, where `send_func` is a coroutine
+    function such as AsyncTeleBot.send_message.
+
+    Every message is a task on the event loop instead of an item for a worker
+    thread, so sends to thousands of chats can be in flight at once without a
+    thread each. Messages to the same chat are still sent one at a time and
+    in order, and the same rate limits and retries apply. send_message() can
+    be called from any thread and returns a concurrent.futures.Future.
+    """
+
+    def __init__(self, send_func: Callable, **kwargs):
+        super().__init__(send_func, workers=0, **kwargs)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        # chat_id -> (lock keeping the chat's messages in order, messages in flight)
+        self._chats: dict[int, list] = {}
+        self._tasks: set[asyncio.Future] = set()
+        # Messages accepted by send_message() and not yet delivered or given up on
+        self._queued = 0
+        self._queued_lock = threading.Lock()
+
+    def start(self, loop: asyncio.AbstractEventLoop | None = None) -> None:
+        self.loop = loop or asyncio.get_running_loop()
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Wait for the queued messages from a thread other than the loop's."""
+        if self.loop is not None:
+            asyncio.run_coroutine_threadsafe(self.join(), self.loop).result(timeout)
+
+    async def join(self) -> None:
+        """Wait until every queued message is delivered or given up on."""
+        while self.pending():
+            if self._tasks:
+                await asyncio.wait(list(self._tasks))
+            else:
+                # Messages sent from other threads are about to become tasks
+                await asyncio.sleep(0)
+
+    def send_message(self, chat_id: int, text: str, **kwargs) -> Future:
+        message = TOutboundMessage(chat_id, text, kwargs)
+        with self._queued_lock:
+            self._queued += 1
+        # Tasks start in submission order, so they queue on the chat lock in order
+        self.loop.call_soon_threadsafe(self._submit, message)
+        return message.future
+
+    def pending(self) -> int:
+        with self._queued_lock:
+            return self._queued
+
+    def _submit(self, message: TOutboundMessage) -> None:
+        chat = self._chats.setdefault(message.chat_id, [asyncio.Lock(), 0])
+        chat[1] += 1
+        task = self.loop.create_task(self._deliver_async(message, chat))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver_async(self, message: TOutboundMessage, chat: list) -> None:
+        try:
+            async with chat[0]:
+                await self._send_async(message)
+        except Exception as e:
+            logging.error(f"Unexpected error sending to chat {message.chat_id}: {e}")
+            if not message.future.done():
+                message.future.set_exception(e)
+        finally:
+            chat[1] -= 1
+            if chat[1] == 0:
+                del self._chats[message.chat_id]
+            with self._queued_lock:
+                self._queued -= 1
+
+    async def _send_async(self, message: TOutboundMessage) -> None:
+        chat_bucket = self._chat_bucket(message.chat_id)
+        while True:
+            wait = max(chat_bucket.reserve(), self.global_bucket.reserve())
+            if wait > 0:
+                await asyncio.sleep(wait)
+
+            message.attempts += 1
+            try:
+                result = await self.send_func(
+                    message.chat_id, message.text, **message.kwargs
+                )
+            except Exception as e:
+                backoff = self._on_send_error(message, chat_bucket, e)
+                if backoff is None:
+                    return
+                if backoff > 0:
+                    await asyncio.sleep(backoff)
+                continue
+
+            message.future.set_result(result)
+            return
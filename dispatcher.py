@@ -0,0 +1,152 @@
+"""
+Concurrent update handling with per-chat ordering.
+
+Updates are handled by a pool of worker threads instead of the thread that
+receives them, so one slow handler (a long /backup, /stats over a big
+database) only holds up its own lane. Each chat is hashed to a single lane,
+which keeps a chat's updates in the order they arrived: a chat's
+conversation state is never read and written by two handlers at once.
+"""
+
+import logging
+import queue
+import threading
+from typing import Any, Callable
+
+WORKERS = 8
+
+# Update fields carrying the chat the update belongs to, in Bot API order
+_CHAT_FIELDS = (
+    "message",
+    "edited_message",
+    "channel_post",
+    "edited_channel_post",
+    "my_chat_member",
+    "chat_member",
+    "chat_join_request",
+)
+# Update fields with only the user who triggered them
+_USER_FIELDS = (
+    "inline_query",
+    "chosen_inline_result",
+    "shipping_query",
+    "pre_checkout_query",
+)
+
+
+def get_update_chat_id(update: Any) -> int:
+    """
+    Get the chat an update belongs to, used to keep each chat's updates in order.
+
+    Works on telebot.types.Update objects. Updates without a chat fall back
+    to the user who sent them, and to their update_id if there is neither.
+    """
+    for field in _CHAT_FIELDS:
+        payload = getattr(update, field, None)
+        if payload is not None:
+            return payload.chat.id
+
+    callback_query = getattr(update, "callback_query", None)
+    if callback_query is not None:
+        if callback_query.message is not None:
+            return callback_query.message.chat.id
+        return callback_query.from_user.id
+
+    for field in _USER_FIELDS:
+        payload = getattr(update, field, None)
+        if payload is not None:
+            return payload.from_user.id
+
+    poll_answer = getattr(update, "poll_answer", None)
+    if poll_answer is not None and getattr(poll_answer, "user", None) is not None:
+        return poll_answer.user.id
+
+    return update.update_id
+
+
+class TUpdateDispatcher:
+    """
+    Runs `handle_update` for every submitted update on a pool of worker lanes.
+
+    Updates with the same key (the chat, by default) always go to the same
+    lane and are therefore handled one at a time, in submission order.
+    Updates of different chats are handled concurrently.
+    """
+
+    def __init__(
+        self,
+        handle_update: Callable[[Any], None],
+        workers: int = WORKERS,
+        get_key: Callable[[Any], int] = get_update_chat_id,
+    ):
+        self.handle_update = handle_update
+        self.get_key = get_key
+        self._lanes = [queue.Queue() for _ in range(workers)]
+        self._threads: list[threading.Thread] = []
+
+    def start(self) -> None:
+        for index, lane in enumerate(self._lanes):
+            thread = threading.Thread(
+                target=self._worker,
+                args=(lane,),
+                name=f"dispatcher-{index}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float | None = None) -> None:
+        """Let the workers finish what is queued, then stop them."""
+        for lane in self._lanes:
+            lane.put(None)
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, update: Any) -> None:
+        self._lanes[hash(self.get_key(update)) % len(self._lanes)].put(update)
+
+    def pending(self) -> int:
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def _worker(self, lane: queue.Queue) -> None:
+        while True:
+            update = lane.get()
+            if update is None:
+                return
+            try:
+                self.handle_update(update)
+            except Exception as e:
+                logging.error(
+                    f"Error handling update {getattr(update, 'update_id', None)}: {e}"
+                )
+
+
+class TDispatchingMixin:
+    """
+    Mixin for telebot.TeleBot that hands updates to a TUpdateDispatcher
+    instead of handling them on the thread that received them, for both
+    polling and the webhook. List it before TeleBot in the bases.
+
+    Args:
+        workers: Number of dispatcher lanes, the other arguments go to TeleBot
+    """
+
+    def __init__(self, *args, workers: int = WORKERS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.dispatcher = TUpdateDispatcher(self._handle_update, workers=workers)
+
+    def _handle_update(self, update: Any) -> None:
+        # TeleBot's own process_new_updates runs the matching handlers
+        super().process_new_updates([update])
+
+    def process_new_updates(self, updates: list) -> None:
+        if updates:
+            # Polling asks for updates after last_update_id, which TeleBot only
+            # advances when it handles an update, later on a lane. Advancing it
+            # before submitting also keeps the lanes from ever moving it back.
+            self.last_update_id = max(
+                self.last_update_id, max(update.update_id for update in updates)
+            )
+        for update in updates:
+            self.dispatcher.submit(update)
@@ -0,0 +1,187 @@
+"""
+Export of a chat's birthdays as a file: the share text, CSV, JSON or iCalendar.
+
+Rows are streamed from the database cursor into a buffer that stays in
+memory up to EXPORT_BUFFER_SIZE and moves to a temporary file beyond that,
+so memory use is bounded by the buffer, not by the number of birthdays.
+The files can be imported back, see importer.py.
+"""
+
+import csv
+import enum
+import json
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import BinaryIO, Callable, Iterable, Iterator, TextIO
+
+import db
+from importer import NO_YEAR_PLACEHOLDER
+
+# Bytes of an export kept in memory before it is spilled to a temporary file
+EXPORT_BUFFER_SIZE = 1024 * 1024
+
+# iCalendar lines longer than this many bytes are folded
+ICS_LINE_LENGTH = 75
+
+
+class TExportFormat(enum.Enum):
+    Share = "share"
+    Csv = "csv"
+    Json = "json"
+    ICalendar = "ics"
+
+
+EXPORT_FILE_NAMES = {
+    TExportFormat.Share: "birthdays.txt",
+    TExportFormat.Csv: "birthdays.csv",
+    TExportFormat.Json: "birthdays.json",
+    TExportFormat.ICalendar: "birthdays.ics",
+}
+
+
+def iter_share_lines(records: Iterable[db.TBirthdayRecord]) -> Iterator[str]:
+    """Yield a name line and a DD.MM[.YYYY] line per birthday, the format /register_birthday accepts."""
+    for record in records:
+        formatted_date = f"{record.day:02d}.{record.month:02d}"
+        if record.year is not None:
+            formatted_date += f".{record.year:04d}"
+        yield record.name
+        yield formatted_date
+
+
+def format_iso_date(record: db.TBirthdayRecord) -> str:
+    """YYYY-MM-DD, or --MM-DD without a year as in vCard."""
+    if record.year is None:
+        return f"--{record.month:02d}-{record.day:02d}"
+    return f"{record.year:04d}-{record.month:02d}-{record.day:02d}"
+
+
+def write_share(records: Iterable[db.TBirthdayRecord], out: TextIO) -> int:
+    count = 0
+    for line in iter_share_lines(records):
+        out.write(line)
+        out.write("\n")
+        count += 1
+    return count // 2
+
+
+def write_csv(records: Iterable[db.TBirthdayRecord], out: TextIO) -> int:
+    writer = csv.writer(out)
+    writer.writerow(["name", "birthday"])
+    count = 0
+    for record in records:
+        writer.writerow([record.name, format_iso_date(record)])
+        count += 1
+    return count
+
+
+def write_json(records: Iterable[db.TBirthdayRecord], out: TextIO) -> int:
+    """Write a JSON array one element at a time, never holding the whole list."""
+    out.write("[")
+    count = 0
+    for record in records:
+        out.write(",\n" if count else "\n")
+        out.write(
+            json.dumps(
+                {"name": record.name, "birthday": format_iso_date(record)},
+                ensure_ascii=False,
+            )
+        )
+        count += 1
+    out.write("\n]\n")
+    return count
+
+
+def _ics_escape(value: str) -> str:
+    return (
+        value.replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\n", "\\n")
+    )
+
+
+def _ics_line(line: str) -> str:
+    """Fold a content line into lines of at most ICS_LINE_LENGTH bytes, without splitting characters."""
+    folded = []
+    length = 0
+    for char in line:
+        size = len(char.encode("utf-8"))
+        if length + size > ICS_LINE_LENGTH:
+            folded.append("\r\n ")
+            # The leading space counts towards the continuation line
+            length = 1
+        folded.append(char)
+        length += size
+    folded.append("\r\n")
+    return "".join(folded)
+
+
+def write_ics(records: Iterable[db.TBirthdayRecord], out: TextIO) -> int:
+    """
+    Write a yearly all-day event per birthday. Birthdays without a year start
+    in NO_YEAR_PLACEHOLDER, like Apple Contacts does.
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    out.write("BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//birthday_reminder_bot//EN\r\n")
+    count = 0
+    for record in records:
+        year = record.year if record.year is not None else NO_YEAR_PLACEHOLDER
+        out.write("BEGIN:VEVENT\r\n")
+        out.write(f"UID:birthday-{record.id}@birthday_reminder_bot\r\n")
+        out.write(f"DTSTAMP:{stamp}\r\n")
+        out.write(f"DTSTART;VALUE=DATE:{year:04d}{record.month:02d}{record.day:02d}\r\n")
+        out.write("RRULE:FREQ=YEARLY\r\n")
+        out.write(_ics_line(f"SUMMARY:{_ics_escape(record.name)}"))
+        out.write("END:VEVENT\r\n")
+        count += 1
+    out.write("END:VCALENDAR\r\n")
+    return count
+
+
+class TUtf8Writer:
+    """
+    The write() of a text file, encoding straight into a binary one.
+
+    io.TextIOWrapper only accepts a SpooledTemporaryFile from Python 3.11 on.
+    """
+
+    def __init__(self, buffer: BinaryIO):
+        self.buffer = buffer
+
+    def write(self, text: str) -> int:
+        self.buffer.write(text.encode("utf-8"))
+        return len(text)
+
+
+WRITERS: dict[TExportFormat, Callable[[Iterable[db.TBirthdayRecord], TextIO], int]] = {
+    TExportFormat.Share: write_share,
+    TExportFormat.Csv: write_csv,
+    TExportFormat.Json: write_json,
+    TExportFormat.ICalendar: write_ics,
+}
+
+
+@contextmanager
+def export_birthdays(
+    chat_id: int,
+    export_format: TExportFormat,
+    buffer_size: int = EXPORT_BUFFER_SIZE,
+) -> Iterator[tuple[BinaryIO, int]]:
+    """
+    Write the chat's birthdays to a file.
+
+    Args:
+        chat_id: Chat whose birthdays to export
+        export_format: Format of the file
+        buffer_size: Bytes kept in memory before spilling to a temporary file
+
+    Yields:
+        The file, positioned at its start, and the number of birthdays in it.
+        The file is deleted when the block exits.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=buffer_size) as buffer:
+        count = WRITERS[export_format](db.iter_birthdays(chat_id), TUtf8Writer(buffer))
+        buffer.seek(0)
+        yield buffer, count
@@ -5,20 +5,39 @@ Handles translations and language switching
 
 import json
 import logging
+import sqlite3
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import Any, Dict
 
 import db
 
 
+# Maximum number of chats whose language is kept in memory
+LANGUAGE_CACHE_SIZE = 10000
+
+
 class I18n:
     """Internationalization class for managing translations"""
 
-    def __init__(self, translations_file: str = "translations.json"):
+    def __init__(
+        self,
+        translations_file: str = "translations.json",
+        language_cache_size: int = LANGUAGE_CACHE_SIZE,
+    ):
         self.translations_file = translations_file
         self.translations: Dict[str, Any] = {}
         self.default_language = "en"
         self.supported_languages = ["en", "ru"]
+        self.button_index: Dict[str, str] = {}
+        self.language_cache_size = language_cache_size
+        self._language_cache: OrderedDict[int, str] = OrderedDict()
+        self._language_cache_lock = threading.Lock()
+        # Bumped by every language change, so a read that raced one isn't cached
+        self._language_generation = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.load_translations()
 
     def load_translations(self) -> None:
@@ -36,19 +55,84 @@ class I18n:
             logging.error(f"Error loading translations: {e}")
             self.translations = {}
 
+        self._build_button_index()
+
+    def _build_button_index(self) -> None:
+        """Precompute button text -> button key for every supported language"""
+        index: Dict[str, str] = {}
+        for button_key, texts in self.translations.get("buttons", {}).items():
+            for language in self.supported_languages:
+                text = texts.get(language) or texts.get(self.default_language)
+                if not text:
+                    continue
+                if index.setdefault(text, button_key) != button_key:
+                    logging.warning(
+                        f"Button text '{text}' is shared by '{index[text]}' and '{button_key}'"
+                    )
+
+        # Swap in the complete index so concurrent readers never see a partial one
+        self.button_index = index
+
     def get_user_language(self, chat_id: int) -> str:
-        """Get user's language preference"""
+        """Get user's language preference, served from the LRU cache when possible"""
+        with self._language_cache_lock:
+            lang = self._language_cache.get(chat_id)
+            if lang is not None:
+                self._language_cache.move_to_end(chat_id)
+                self.cache_hits += 1
+                return lang
+            self.cache_misses += 1
+            generation = self._language_generation
+
+        # Read outside the lock, other chats keep being served from the cache
         lang = db.get_user_language(chat_id)
-        return lang if lang in self.supported_languages else self.default_language
+        lang = lang if lang in self.supported_languages else self.default_language
+        with self._language_cache_lock:
+            if generation == self._language_generation:
+                self._cache_language_locked(chat_id, lang)
+        return lang
 
     def set_user_language(self, chat_id: int, language_code: str) -> bool:
-        """Set user's language preference"""
+        """Set user's language preference, returns False if it wasn't saved"""
         if language_code not in self.supported_languages:
             return False
 
-        db.set_user_language(chat_id, language_code)
+        try:
+            db.set_user_language(chat_id, language_code)
+        except sqlite3.Error:
+            with self._language_cache_lock:
+                # The stored language is unknown now, read it again next time
+                self._language_generation += 1
+                self._language_cache.pop(chat_id, None)
+            return False
+
+        with self._language_cache_lock:
+            self._language_generation += 1
+            self._cache_language_locked(chat_id, language_code)
         return True
 
+    def clear_language_cache(self) -> None:
+        """Forget all cached languages, e.g. after switching the database"""
+        with self._language_cache_lock:
+            self._language_cache.clear()
+            self.cache_hits = 0
+            self.cache_misses = 0
+
+    def get_cache_stats(self) -> Dict[str, int]:
+        """Get language cache size and hit/miss counters"""
+        with self._language_cache_lock:
+            return {
+                "size": len(self._language_cache),
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+            }
+
+    def _cache_language_locked(self, chat_id: int, language_code: str) -> None:
+        self._language_cache[chat_id] = language_code
+        self._language_cache.move_to_end(chat_id)
+        while len(self._language_cache) > self.language_cache_size:
+            self._language_cache.popitem(last=False)
+
     def get_text(self, key: str, chat_id: int, **kwargs) -> str:
         """
         Get translated text by key for specific user
@@ -129,6 +213,10 @@ class I18n:
         """Get translated button text"""
         return self.get_text(f"buttons.{button_key}", chat_id)
 
+    def get_button_key(self, text: str) -> str | None:
+        """Get the button key for a button text in any supported language"""
+        return self.button_index.get(text)
+
     def get_button_description(self, button_key: str, chat_id: int) -> str:
         """Get translated button description"""
         return self.get_text(f"button_descriptions.{button_key}", chat_id)
@@ -168,6 +256,11 @@ def get_button_text(button_key: str, chat_id: int) -> str:
     return i18n.get_button_text(button_key, chat_id)
 
 
+def get_button_key(text: str) -> str | None:
+    """Convenience function to look up the button key for a button text"""
+    return i18n.get_button_key(text)
+
+
 def get_button_description(button_key: str, chat_id: int) -> str:
     """Convenience function to get translated button description"""
     return i18n.get_button_description(button_key, chat_id)
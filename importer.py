@@ -0,0 +1,375 @@
+"""
+Import of birthdays from uploaded files: CSV, vCard, iCalendar and the text
+that /share exports.
+
+Files are parsed line by line from any iterable of text lines, e.g. a file
+being downloaded, so memory use does not grow with the size of the file.
+Dates are converted to the formats utils.parse_date accepts and validated
+exactly like typed input. Valid birthdays are inserted in batches, one
+transaction per batch.
+"""
+
+import csv
+import enum
+import itertools
+import logging
+import os
+import re
+import sqlite3
+from typing import Callable, Iterable, Iterator, NamedTuple
+
+import db
+import i18n
+import utils
+
+# Birthdays inserted per transaction
+IMPORT_BATCH_SIZE = 500
+# Bots can't download larger files through the Bot API
+MAX_IMPORT_FILE_SIZE = 20 * 1024 * 1024
+# Bad entries listed back to the user, the rest are only counted
+MAX_REPORTED_ERRORS = 20
+# Longer names and dates of bad entries are shortened, so the report fits one message
+MAX_REPORTED_FIELD_LENGTH = 40
+
+# Apple Contacts stores birthdays without a year in year 1604
+NO_YEAR_PLACEHOLDER = 1604
+
+_ISO_DATE = re.compile(r"^(\d{4})-?(\d{2})-?(\d{2})(?:T.*)?$")
+_ISO_DATE_WITHOUT_YEAR = re.compile(r"^--(\d{2})-?(\d{2})$")
+
+# Comma first, it wins if a line has none of them
+CSV_DELIMITERS = (",", ";", "\t")
+CSV_NAME_COLUMNS = {"name", "full name", "display name", "фио"}
+CSV_FIRST_NAME_COLUMNS = {"first name", "given name", "имя"}
+CSV_LAST_NAME_COLUMNS = {"last name", "family name", "surname", "фамилия"}
+CSV_DATE_COLUMNS = {
+    "birthday",
+    "date",
+    "birth date",
+    "date of birth",
+    "bday",
+    "день рождения",
+    "дата рождения",
+    "дата",
+}
+
+
+class TImportFormat(enum.Enum):
+    Share = "share"
+    Csv = "csv"
+    VCard = "vcard"
+    ICalendar = "ics"
+
+
+FORMAT_EXTENSIONS = {
+    ".txt": TImportFormat.Share,
+    ".csv": TImportFormat.Csv,
+    ".vcf": TImportFormat.VCard,
+    ".vcard": TImportFormat.VCard,
+    ".ics": TImportFormat.ICalendar,
+    ".ical": TImportFormat.ICalendar,
+}
+FORMAT_MIME_TYPES = {
+    "text/plain": TImportFormat.Share,
+    "text/csv": TImportFormat.Csv,
+    "text/vcard": TImportFormat.VCard,
+    "text/x-vcard": TImportFormat.VCard,
+    "text/calendar": TImportFormat.ICalendar,
+}
+
+
+class TImportEntry(NamedTuple):
+    line: int  # Line of the file the entry starts on
+    name: str
+    date: str  # In a format utils.parse_date accepts, if the file's date was understood
+
+
+class TImportReport:
+    """Counts of an import in progress, with the first few bad entries."""
+
+    def __init__(self):
+        self.imported = 0
+        self.error_count = 0
+        self.errors: list[TImportEntry] = []
+        # Set if the import stopped before the end of the file
+        self.failed = False
+
+    def add_error(self, entry: TImportEntry) -> None:
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(entry)
+
+
+def detect_format(file_name: str | None, mime_type: str | None) -> TImportFormat | None:
+    """Guess the format of an uploaded file from its extension, then its MIME type."""
+    extension = os.path.splitext(file_name or "")[1].lower()
+    if extension in FORMAT_EXTENSIONS:
+        return FORMAT_EXTENSIONS[extension]
+    return FORMAT_MIME_TYPES.get((mime_type or "").lower())
+
+
+def normalize_date(value: str) -> str:
+    """
+    Convert the date formats used by contact and calendar exports to ones
+    utils.parse_date accepts: 1990-05-15 and 19900515 become 15.05.1990,
+    --05-15 and --0515 become 15.05. Anything else is returned stripped.
+    """
+    value = value.strip()
+
+    match = _ISO_DATE.match(value)
+    if match:
+        year, month, day = match.groups()
+        if int(year) == NO_YEAR_PLACEHOLDER:
+            return f"{day}.{month}"
+        return f"{day}.{month}.{year}"
+
+    match = _ISO_DATE_WITHOUT_YEAR.match(value)
+    if match:
+        month, day = match.groups()
+        return f"{day}.{month}"
+
+    return value
+
+
+def iter_share_entries(lines: Iterable[str]) -> Iterator[TImportEntry]:
+    """Read name and date line pairs, as typed into /register_birthday; blank lines are skipped."""
+    name_line, name = 0, None
+    for line_no, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if name is None:
+            name_line, name = line_no, line
+        else:
+            yield TImportEntry(name_line, name, line)
+            name = None
+    if name is not None:
+        # A name without a date is reported as a bad entry
+        yield TImportEntry(name_line, name, "")
+
+
+def iter_csv_entries(lines: Iterable[str]) -> Iterator[TImportEntry]:
+    """
+    Read a CSV file with a name and a date column.
+
+    The delimiter (comma, semicolon or tab) is guessed from the first line.
+    With a header row, the columns are found by name, so contact exports with
+    many columns work; split first and last names are joined. Without one,
+    the first two columns are the name and the date. Rows without a date are
+    skipped.
+    """
+    lines = iter(lines)
+    first_line = next(lines, None)
+    if first_line is None:
+        return
+
+    delimiter = max(CSV_DELIMITERS, key=first_line.count)
+    reader = csv.reader(itertools.chain([first_line], lines), delimiter=delimiter)
+
+    header = next(reader, None)
+    if header is None:
+        return
+    columns = [column.strip().lower() for column in header]
+
+    def find(names: set[str]) -> int | None:
+        return next((i for i, column in enumerate(columns) if column in names), None)
+
+    date_column = find(CSV_DATE_COLUMNS)
+    if date_column is None:
+        # No header, the first row is data
+        name_columns, date_column = [0], 1
+        rows = itertools.chain([(1, header)], ((reader.line_num, row) for row in reader))
+    else:
+        name_column = find(CSV_NAME_COLUMNS)
+        if name_column is not None:
+            name_columns = [name_column]
+        else:
+            name_columns = [
+                column
+                for column in (find(CSV_FIRST_NAME_COLUMNS), find(CSV_LAST_NAME_COLUMNS))
+                if column is not None
+            ]
+        rows = ((reader.line_num, row) for row in reader)
+
+    for line, row in rows:
+        if len(row) <= date_column or not row[date_column].strip():
+            continue
+        name = " ".join(
+            row[i].strip() for i in name_columns if i < len(row) and row[i].strip()
+        )
+        yield TImportEntry(line, name, normalize_date(row[date_column]))
+
+
+def _unfold(lines: Iterable[str]) -> Iterator[tuple[int, str]]:
+    """
+    Join the folded content lines of vCard and iCalendar files, where a line
+    starting with a space or tab continues the previous one.
+    """
+    current, start = None, 0
+    for line_no, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if current is not None and line[:1] in (" ", "\t"):
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_no
+    if current is not None:
+        yield start, current
+
+
+def _split_property(content_line: str) -> tuple[str, str]:
+    """Split "GROUP.NAME;PARAM=VALUE:value" into its upper-cased name and its value."""
+    head, _, value = content_line.partition(":")
+    name = head.split(";", 1)[0].rsplit(".", 1)[-1].upper()
+    return name, value
+
+
+def _unescape(value: str) -> str:
+    return (
+        value.replace("\\n", " ")
+        .replace("\\N", " ")
+        .replace("\\,", ",")
+        .replace("\\;", ";")
+        .replace("\\\\", "\\")
+        .strip()
+    )
+
+
+def iter_vcard_entries(lines: Iterable[str]) -> Iterator[TImportEntry]:
+    """Read the FN (or N) and BDAY of every vCard; contacts without a BDAY are skipped."""
+    start, formatted_name, structured_name, birthday = 0, "", "", None
+    for line, content_line in _unfold(lines):
+        name, value = _split_property(content_line)
+        if name == "BEGIN":
+            start, formatted_name, structured_name, birthday = line, "", "", None
+        elif name == "FN":
+            formatted_name = _unescape(value)
+        elif name == "N":
+            # Family;Given;Additional;Prefixes;Suffixes
+            parts = [_unescape(part) for part in value.split(";")]
+            structured_name = " ".join(part for part in parts[1:2] + parts[:1] if part)
+        elif name == "BDAY":
+            birthday = value
+        elif name == "END" and birthday:
+            yield TImportEntry(
+                start, formatted_name or structured_name, normalize_date(birthday)
+            )
+            birthday = None
+
+
+def iter_ics_entries(lines: Iterable[str]) -> Iterator[TImportEntry]:
+    """Read the SUMMARY and DTSTART of every yearly recurring event; other events are skipped."""
+    start, summary, dtstart, yearly, in_event = 0, "", None, False, False
+    for line, content_line in _unfold(lines):
+        name, value = _split_property(content_line)
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            start, summary, dtstart, yearly, in_event = line, "", None, False, True
+        elif not in_event:
+            continue
+        elif name == "SUMMARY":
+            summary = _unescape(value)
+        elif name == "DTSTART":
+            dtstart = value
+        elif name == "RRULE":
+            yearly = "FREQ=YEARLY" in value.upper()
+        elif name == "END" and value.upper() == "VEVENT":
+            in_event = False
+            if yearly and dtstart:
+                yield TImportEntry(start, summary, normalize_date(dtstart))
+
+
+ENTRY_READERS: dict[TImportFormat, Callable[[Iterable[str]], Iterator[TImportEntry]]] = {
+    TImportFormat.Share: iter_share_entries,
+    TImportFormat.Csv: iter_csv_entries,
+    TImportFormat.VCard: iter_vcard_entries,
+    TImportFormat.ICalendar: iter_ics_entries,
+}
+
+
+def import_birthdays(
+    chat_id: int,
+    entries: Iterable[TImportEntry],
+    on_batch: Callable[[list[int], list[utils.TParsedBirthday], TImportReport], None] | None = None,
+    batch_size: int = IMPORT_BATCH_SIZE,
+    report: TImportReport | None = None,
+) -> TImportReport:
+    """
+    Validate entries and register the valid ones, a batch per transaction.
+
+    Args:
+        chat_id: Chat to register the birthdays for
+        entries: Entries read by one of the ENTRY_READERS
+        on_batch: Called after each batch is committed with the new IDs, the
+            (name, date, has_year) of the batch and the report so far
+        batch_size: Birthdays per transaction
+        report: Report to fill in, so the caller still has the counts if
+            reading the entries raises
+
+    Returns:
+        How many birthdays were imported and which entries were not. If a
+        batch couldn't be saved, the import stops there with `failed` set;
+        the batches saved before it stay imported.
+    """
+    report = report if report is not None else TImportReport()
+    batch: list[utils.TParsedBirthday] = []
+
+    def flush() -> bool:
+        try:
+            birthday_ids = db.register_birthdays(chat_id, batch)
+        except sqlite3.Error as e:
+            logging.error(f"Import for Chat ID {chat_id} stopped after {report.imported} birthdays: {e}")
+            report.failed = True
+            return False
+        report.imported += len(birthday_ids)
+        if on_batch is not None:
+            on_batch(birthday_ids, batch, report)
+        return True
+
+    for entry in entries:
+        success, parsed_date, has_year = utils.parse_date(entry.date)
+        if not entry.name or not success:
+            report.add_error(entry)
+            continue
+
+        batch.append((entry.name, parsed_date, has_year))
+        if len(batch) >= batch_size:
+            if not flush():
+                return report
+            batch = []
+
+    if batch:
+        flush()
+    return report
+
+
+def _shorten(value: str) -> str:
+    if len(value) <= MAX_REPORTED_FIELD_LENGTH:
+        return value
+    return value[: MAX_REPORTED_FIELD_LENGTH - 1] + "…"
+
+
+def format_import_report(chat_id: int, report: TImportReport) -> str:
+    """
+    The message summing up an import: the counts, the first MAX_REPORTED_ERRORS
+    bad entries and how many more there were. It always fits one message.
+    """
+    lines = [
+        i18n.get_message(
+            "import_failed_partway" if report.failed else "import_finished",
+            chat_id,
+            imported=report.imported,
+            errors=report.error_count,
+        )
+    ]
+    if report.errors:
+        lines.append("")
+        lines.append(i18n.get_message("import_errors", chat_id))
+        lines.extend(
+            f"- {entry.line}: {_shorten(entry.name)} '{_shorten(entry.date)}'"
+            for entry in report.errors
+        )
+        not_listed = report.error_count - len(report.errors)
+        if not_listed:
+            lines.append(i18n.get_message("import_more_errors", chat_id, count=not_listed))
+    return "\n".join(lines)
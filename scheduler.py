@@ -0,0 +1,424 @@
+"""
+Event-driven birthday reminder scheduler.
+
+Keeps the reminders due within the next SCHEDULE_WINDOW_DAYS in a min-heap
+keyed by fire time and sleeps until the earliest one, instead of rescanning
+the birthdays table every few minutes. Birthdays are indexed by month and day,
+so the reminders of each day entering the window are found without a scan.
+"""
+
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+from concurrent.futures import Executor
+from datetime import date, datetime, time, timedelta
+from typing import Callable, NamedTuple
+
+import db
+
+# Reminders fire at the start of the daytime window (see utils.is_daytime)
+REMINDER_HOUR = 7
+# Last hour in which a missed reminder for today may still be delivered
+LAST_REMINDER_HOUR = 20
+# Delay before retrying a reminder whose delivery failed
+RETRY_DELAY = timedelta(minutes=5)
+# Upper bound for a single sleep so wall clock jumps are noticed
+MAX_SLEEP_SECONDS = 60 * 60
+# Days of reminders kept in the heap, later ones are loaded as the window moves
+SCHEDULE_WINDOW_DAYS = 14
+
+
+class TReminderEvent(NamedTuple):
+    fire_at: datetime
+    chat_id: int
+    birthday_id: int
+    days_until: int
+    name: str
+    birthday: date
+    has_year: bool
+    occurrence: date
+
+    @property
+    def age(self) -> int:
+        """Age the person turns on this occurrence (meaningful only if has_year)."""
+        return self.occurrence.year - self.birthday.year
+
+
+class TScheduledBirthday(NamedTuple):
+    chat_id: int
+    name: str
+    birthday: date
+    has_year: bool
+
+
+def _occurrence_in_year(birthday: date, year: int) -> date:
+    """Birthday in the given year; Feb 29 falls back to Feb 28 in non-leap years."""
+    try:
+        return birthday.replace(year=year)
+    except ValueError:
+        return date(year, 2, 28)
+
+
+def compute_next_fire(
+    birthday: date, days_until: int, now: datetime, skip_current: bool = False
+) -> tuple[datetime, date] | None:
+    """
+    Compute when the reminder `days_until` days before `birthday` is next due.
+
+    Reminders fire at REMINDER_HOUR on their day. A reminder whose day is today
+    but whose hour has passed fires immediately, unless the daytime window is
+    already over, in which case the next year's occurrence is used.
+
+    Args:
+        birthday: Date of birth (only month and day are used)
+        days_until: Reminder offset in days before the birthday
+        now: Current local time
+        skip_current: Skip the nearest occurrence (it has already been reminded)
+
+    Returns:
+        Tuple of (fire time, birthday occurrence) or None if nothing is due
+    """
+    today = now.date()
+    for year in (today.year, today.year + 1, today.year + 2):
+        occurrence = _occurrence_in_year(birthday, year)
+        fire_day = occurrence - timedelta(days=days_until)
+        if fire_day < today:
+            continue
+        if fire_day == today and now.hour > LAST_REMINDER_HOUR:
+            continue
+        if skip_current:
+            skip_current = False
+            continue
+
+        fire_at = datetime.combine(fire_day, time(hour=REMINDER_HOUR))
+        return max(fire_at, now), occurrence
+    return None
+
+
+class TReminderScheduler:
+    """
+    Min-heap of the reminder events due within SCHEDULE_WINDOW_DAYS.
+
+    The heap is built once from the database by rebuild() and then maintained
+    incrementally through add_birthday(), remove_birthday() and update_chat().
+    Every day moving into the window is loaded from the in-memory birthday
+    index, so the heap holds a few weeks of events instead of a year's worth.
+    run() sleeps until the earliest event and passes every event due at that
+    moment to `on_due` as one batch, so callers can group them per chat.
+    """
+
+    def __init__(
+        self,
+        on_due: Callable[[list[TReminderEvent]], None],
+        clock: Callable[[], datetime] = datetime.now,
+    ):
+        self.on_due = on_due
+        self.clock = clock
+        self._condition = threading.Condition()
+        self._heap: list[list] = []
+        self._entries: dict[tuple[int, int], list] = {}
+        self._birthdays: dict[int, TScheduledBirthday] = {}
+        self._chat_birthdays: dict[int, set[int]] = {}
+        self._chat_days: dict[int, list[int]] = {}
+        self._month_day_birthdays: dict[tuple[int, int], set[int]] = {}
+        # Events firing before this day are in the heap
+        self._window_end = date.min
+        self._counter = itertools.count()
+        # Wakes run_async() up, called with the condition held
+        self._on_change: Callable[[], None] | None = None
+
+    def rebuild(self) -> None:
+        """Reload all birthdays and reminder settings from the database."""
+        now = self.clock()
+        chat_days = db.get_all_reminder_settings()
+        rows = db.get_all_birthdays_for_reminders() or []
+        # Nothing due from now on targets an occurrence before last year
+        sent = db.get_sent_reminders(now.year - 1) or set()
+
+        with self._condition:
+            self._heap = []
+            self._entries = {}
+            self._birthdays = {}
+            self._chat_birthdays = {}
+            self._chat_days = chat_days
+            self._month_day_birthdays = {}
+            self._window_end = now.date()
+
+            for birthday_id, chat_id, name, birthday_str, has_year in rows:
+                birthday = datetime.strptime(birthday_str, "%Y-%m-%d").date()
+                self._index_birthday_locked(
+                    birthday_id, TScheduledBirthday(chat_id, name, birthday, bool(has_year))
+                )
+            self._advance_window_locked(now, sent)
+
+            self._notify_locked()
+
+        logging.info(
+            f"Reminder schedule built: {len(self._entries)} events for {len(rows)} birthdays"
+        )
+
+    def add_birthday(
+        self, birthday_id: int, chat_id: int, name: str, birthday: datetime, has_year: bool
+    ) -> None:
+        scheduled = TScheduledBirthday(chat_id, name, birthday.date(), has_year)
+        now = self.clock()
+        with self._condition:
+            self._advance_window_locked(now)
+            self._index_birthday_locked(birthday_id, scheduled)
+            # A new birthday ID has no ledger entries
+            for days in self._chat_days.get(chat_id, []):
+                self._schedule_locked(birthday_id, days, scheduled, now)
+            self._notify_locked()
+
+    def remove_birthday(self, birthday_id: int) -> None:
+        with self._condition:
+            scheduled = self._birthdays.pop(birthday_id, None)
+            if scheduled is None:
+                return
+            self._chat_birthdays.get(scheduled.chat_id, set()).discard(birthday_id)
+            month_day = (scheduled.birthday.month, scheduled.birthday.day)
+            self._month_day_birthdays.get(month_day, set()).discard(birthday_id)
+            for days in self._chat_days.get(scheduled.chat_id, []):
+                self._cancel_locked((birthday_id, days))
+            self._notify_locked()
+
+    def update_chat(self, chat_id: int, reminder_days: list[int]) -> None:
+        """Reschedule all birthdays of a chat after its reminder settings changed."""
+        now = self.clock()
+        # An offset that is switched off and on again must not repeat today's reminder
+        sent = db.get_sent_reminders(now.year - 1, chat_id) or set()
+        with self._condition:
+            self._advance_window_locked(now)
+            old_days = self._chat_days.get(chat_id, [])
+            self._chat_days[chat_id] = list(reminder_days)
+
+            for birthday_id in self._chat_birthdays.get(chat_id, set()):
+                for days in old_days:
+                    if days not in reminder_days:
+                        self._cancel_locked((birthday_id, days))
+                for days in reminder_days:
+                    if (birthday_id, days) not in self._entries:
+                        self._schedule_locked(
+                            birthday_id, days, self._birthdays[birthday_id], now, sent
+                        )
+            self._notify_locked()
+
+    def next_fire_time(self) -> datetime | None:
+        with self._condition:
+            self._advance_window_locked(self.clock())
+            self._drop_cancelled_locked()
+            return self._heap[0][0] if self._heap else None
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._entries)
+
+    def pop_due_events(self, now: datetime) -> list[TReminderEvent]:
+        """
+        Pop every event due at `now`. The next occurrence of each pair is a year
+        away and is loaded when its day enters the window.
+        """
+        due = []
+        with self._condition:
+            self._advance_window_locked(now)
+            while True:
+                self._drop_cancelled_locked()
+                if not self._heap or self._heap[0][0] > now:
+                    break
+                entry = heapq.heappop(self._heap)
+                event = entry[-1]
+                key = (event.birthday_id, event.days_until)
+                del self._entries[key]
+
+                if event.fire_at.date() < now.date():
+                    # Overslept past the reminder's day, the offset no longer matches
+                    logging.warning(
+                        f"Skipping stale {event.days_until}-day reminder for birthday ID {event.birthday_id}"
+                    )
+                else:
+                    due.append(event)
+        return due
+
+    def retry_later(self, event: TReminderEvent) -> None:
+        """Reschedule a failed event, unless that pushes it past today's window."""
+        retry_at = self.clock() + RETRY_DELAY
+        if retry_at.date() != event.fire_at.date() or retry_at.hour > LAST_REMINDER_HOUR:
+            logging.warning(
+                f"Giving up on {event.days_until}-day reminder for birthday ID {event.birthday_id}"
+            )
+            return
+
+        with self._condition:
+            key = (event.birthday_id, event.days_until)
+            self._cancel_locked(key)
+            self._push_locked(key, event, retry_at, event.occurrence)
+            self._notify_locked()
+
+    def seconds_until_next_fire(self) -> float:
+        """Time to sleep before the next event, capped at MAX_SLEEP_SECONDS."""
+        next_fire = self.next_fire_time()
+        if next_fire is None:
+            return MAX_SLEEP_SECONDS
+        return min((next_fire - self.clock()).total_seconds(), MAX_SLEEP_SECONDS)
+
+    def deliver_due(self) -> None:
+        """Pass the events due now to on_due, retrying them later if that fails."""
+        events = self.pop_due_events(self.clock())
+        if not events:
+            return
+        try:
+            self.on_due(events)
+        except Exception as e:
+            logging.error(f"Error delivering {len(events)} reminders: {e}")
+            for event in events:
+                self.retry_later(event)
+
+    def run(self) -> None:
+        """Sleep until the next event is due, deliver it, repeat. Never returns."""
+        while True:
+            with self._condition:
+                timeout = self.seconds_until_next_fire()
+                if timeout > 0:
+                    self._condition.wait(timeout)
+                    continue
+
+            self.deliver_due()
+
+    async def run_async(self, executor: Executor | None = None) -> None:
+        """
+        Like run(), as an asyncio task. Changes made from other threads wake it
+        up early, and on_due runs on `executor` so the event loop never blocks
+        on the database.
+        """
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+        self._on_change = lambda: loop.call_soon_threadsafe(wakeup.set)
+        try:
+            while True:
+                wakeup.clear()
+                timeout = self.seconds_until_next_fire()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                await loop.run_in_executor(executor, self.deliver_due)
+        finally:
+            self._on_change = None
+
+    def _notify_locked(self) -> None:
+        self._condition.notify()
+        if self._on_change is not None:
+            self._on_change()
+
+    def _index_birthday_locked(self, birthday_id: int, scheduled: TScheduledBirthday) -> None:
+        self._birthdays[birthday_id] = scheduled
+        self._chat_birthdays.setdefault(scheduled.chat_id, set()).add(birthday_id)
+        month_day = (scheduled.birthday.month, scheduled.birthday.day)
+        self._month_day_birthdays.setdefault(month_day, set()).add(birthday_id)
+
+    def _advance_window_locked(
+        self, now: datetime, sent: set[tuple[int, int, int]] | None = None
+    ) -> None:
+        """Load the events of every day that entered the window since the last call."""
+        window_end = now.date() + timedelta(days=SCHEDULE_WINDOW_DAYS)
+        if self._window_end >= window_end:
+            return
+        # After a long sleep the days already gone are not worth loading
+        day = max(self._window_end, now.date())
+        offsets = {days for chat_days in self._chat_days.values() for days in chat_days}
+        self._window_end = window_end
+        while day < window_end:
+            self._load_day_locked(day, offsets, now, sent)
+            day += timedelta(days=1)
+
+    def _load_day_locked(
+        self,
+        day: date,
+        offsets: set[int],
+        now: datetime,
+        sent: set[tuple[int, int, int]] | None,
+    ) -> None:
+        start = max(now, datetime.combine(day, time()))
+        for days in offsets:
+            occurrence = day + timedelta(days=days)
+            candidates = self._month_day_birthdays.get((occurrence.month, occurrence.day), set())
+            if (occurrence.month, occurrence.day) == (2, 28):
+                # Feb 29 birthdays are reminded on Feb 28 in non-leap years
+                candidates = candidates | self._month_day_birthdays.get((2, 29), set())
+            for birthday_id in candidates:
+                scheduled = self._birthdays[birthday_id]
+                if days not in self._chat_days.get(scheduled.chat_id, []):
+                    continue
+                next_fire = compute_next_fire(scheduled.birthday, days, start)
+                # Skips Feb 29 in leap years and today's reminder after the daytime window
+                if next_fire is None or next_fire[0].date() != day:
+                    continue
+                if sent and (birthday_id, days, next_fire[1].year) in sent:
+                    continue
+                self._push_locked(
+                    (birthday_id, days), self._make_event(birthday_id, days, scheduled), *next_fire
+                )
+
+    def _schedule_locked(
+        self,
+        birthday_id: int,
+        days: int,
+        scheduled: TScheduledBirthday,
+        now: datetime,
+        sent: set[tuple[int, int, int]] | None = None,
+    ) -> None:
+        next_fire = compute_next_fire(scheduled.birthday, days, now)
+        if next_fire is None:
+            return
+        fire_at, occurrence = next_fire
+
+        # A ledger entry means this occurrence was already reminded before a restart
+        if sent and (birthday_id, days, occurrence.year) in sent:
+            next_fire = compute_next_fire(scheduled.birthday, days, now, skip_current=True)
+            if next_fire is None:
+                return
+            fire_at, occurrence = next_fire
+
+        if fire_at.date() >= self._window_end:
+            # Loaded by _advance_window_locked() when its day comes closer
+            return
+        self._push_locked(
+            (birthday_id, days), self._make_event(birthday_id, days, scheduled), fire_at, occurrence
+        )
+
+    @staticmethod
+    def _make_event(birthday_id: int, days: int, scheduled: TScheduledBirthday) -> TReminderEvent:
+        # fire_at and occurrence are filled in by _push_locked()
+        return TReminderEvent(
+            None,
+            scheduled.chat_id,
+            birthday_id,
+            days,
+            scheduled.name,
+            scheduled.birthday,
+            scheduled.has_year,
+            None,
+        )
+
+    def _push_locked(
+        self, key: tuple[int, int], event: TReminderEvent, fire_at: datetime, occurrence: date
+    ) -> None:
+        event = event._replace(fire_at=fire_at, occurrence=occurrence)
+        entry = [fire_at, next(self._counter), event]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+
+    def _cancel_locked(self, key: tuple[int, int]) -> None:
+        # Lazy deletion: the entry stays in the heap but is skipped when it surfaces
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry[-1] = None
+
+    def _drop_cancelled_locked(self) -> None:
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
@@ -0,0 +1,172 @@
+"""
+Per-chat conversation state: what the bot is waiting for from each chat and
+which messages to clean up once a flow finishes.
+
+Entries expire after a TTL and the least recently used ones are dropped once
+the store is full, so memory stays bounded however many chats come and go.
+With persistence enabled every write also goes to the conversation_state
+table, and entries missing from memory are loaded from it, so flows that
+were in progress survive a restart. Chats without a row are remembered too,
+so most updates never reach the database, and reads run outside the store's
+lock so one chat's disk I/O doesn't hold up the others.
+"""
+
+import json
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable
+
+import db
+
+# Flows nobody finished within a day are abandoned
+STATE_TTL_SECONDS = 24 * 60 * 60
+STATE_MAX_SIZE = 10_000
+
+# Cached in place of a value for chats that have no row in the database
+_MISSING = object()
+
+
+class TStateStore:
+    """
+    Thread-safe mapping of chat_id -> value with TTL expiry and an LRU bound.
+
+    Args:
+        name: Name of the store, separates stores sharing the conversation_state table
+        ttl_seconds: Time after the last write at which an entry expires
+        max_size: Maximum number of entries kept in memory
+        persistent: Write entries through to the database and load missing ones from it
+        encode: Converts a value to something json.dumps accepts, for persistence
+        decode: Inverse of encode
+        clock: Returns the current Unix time
+    """
+
+    def __init__(
+        self,
+        name: str,
+        ttl_seconds: float = STATE_TTL_SECONDS,
+        max_size: int = STATE_MAX_SIZE,
+        persistent: bool = False,
+        encode: Callable[[Any], Any] = lambda value: value,
+        decode: Callable[[Any], Any] = lambda value: value,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.name = name
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.persistent = persistent
+        self.encode = encode
+        self.decode = decode
+        self.clock = clock
+        # chat_id -> (expires_at, value), least recently used first
+        self._entries: OrderedDict[int, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.RLock()
+        # Bumped by every write, so a load that raced one isn't cached
+        self._version = 0
+
+    def get(self, chat_id: int, default: Any = None) -> Any:
+        now = self.clock()
+        while True:
+            with self._lock:
+                entry = self._entries.get(chat_id)
+                if entry is not None or not self.persistent:
+                    return self._value(chat_id, entry, now, default)
+                version = self._version
+
+            entry = self._load(chat_id, now)
+            with self._lock:
+                if self._version != version:
+                    # Written meanwhile, look again
+                    continue
+                self._cache(chat_id, entry or (math.inf, _MISSING))
+                return self._value(chat_id, entry, now, default)
+
+    def set(self, chat_id: int, value: Any) -> None:
+        expires_at = self.clock() + self.ttl_seconds
+        with self._lock:
+            if self.persistent:
+                db.save_conversation_state(
+                    self.name, chat_id, json.dumps(self.encode(value)), expires_at
+                )
+            self._version += 1
+            self._cache(chat_id, (expires_at, value))
+
+    def pop(self, chat_id: int, default: Any = None) -> Any:
+        # Load outside the lock first, so the get() below is served from memory
+        self.get(chat_id)
+        with self._lock:
+            value = self.get(chat_id, default)
+            self._remove(chat_id)
+            return value
+
+    def append(self, chat_id: int, item: Any) -> None:
+        """Append an item to the list stored for a chat, starting a new list if there is none."""
+        self.get(chat_id)
+        with self._lock:
+            self.set(chat_id, self.get(chat_id, []) + [item])
+
+    def __setitem__(self, chat_id: int, value: Any) -> None:
+        self.set(chat_id, value)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return self.get(chat_id) is not None
+
+    def __len__(self) -> int:
+        """Number of entries held in memory, including chats known to have none."""
+        with self._lock:
+            return len(self._entries)
+
+    def purge_expired(self) -> int:
+        """Drop expired entries from memory and the database; returns how many were in memory."""
+        now = self.clock()
+        with self._lock:
+            expired = [
+                chat_id
+                for chat_id, (expires_at, _) in self._entries.items()
+                if expires_at <= now
+            ]
+            for chat_id in expired:
+                del self._entries[chat_id]
+            if self.persistent:
+                db.purge_conversation_state(self.name, now)
+        return len(expired)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            if self.persistent:
+                db.clear_conversation_state(self.name)
+
+    def _load(self, chat_id: int, now: float) -> tuple[float, Any] | None:
+        row = db.load_conversation_state(self.name, chat_id, now)
+        if row is None:
+            return None
+        value, expires_at = row
+        return (expires_at, self.decode(json.loads(value)))
+
+    def _value(self, chat_id: int, entry: tuple[float, Any] | None, now: float, default: Any) -> Any:
+        if entry is None or entry[1] is _MISSING:
+            return default
+        expires_at, value = entry
+        if expires_at <= now:
+            self._remove(chat_id)
+            return default
+        self._entries.move_to_end(chat_id)
+        return value
+
+    def _cache(self, chat_id: int, entry: tuple[float, Any]) -> None:
+        self._entries[chat_id] = entry
+        self._entries.move_to_end(chat_id)
+        # Evicted entries stay in the database when persistent
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _remove(self, chat_id: int) -> None:
+        self._version += 1
+        if self.persistent:
+            db.delete_conversation_state(self.name, chat_id)
+            self._cache(chat_id, (math.inf, _MISSING))
+        else:
+            self._entries.pop(chat_id, None)
@@ -0,0 +1,201 @@
+"""
+Birthday statistics for /stats.
+
+Local aggregates are derived from two GROUP BY queries (birthdays per date
+and per birth year), so the work done here is bounded by the number of
+distinct dates and birth years rather than by the number of birthdays.
+Global aggregates are read from the materialized birthday_stats table, which
+triggers keep up to date, and cached until it changes.
+
+Usage: python stats.py check|rebuild
+"""
+
+import calendar
+import threading
+from datetime import datetime
+from typing import NamedTuple
+
+import db
+
+
+class TAgeStats(NamedTuple):
+    average: float
+    median: float
+    minimum: int
+    maximum: int
+
+
+class TBirthdayStats(NamedTuple):
+    total: int
+    this_month: int
+    # Month number -> number of birthdays
+    month_counts: dict[int, int]
+    # 'MM-DD' -> number of birthdays
+    date_counts: dict[str, int]
+    # Current age -> number of birthdays with a known year
+    age_counts: dict[int, int]
+
+    @property
+    def most_popular_month(self) -> tuple[str, int] | None:
+        """Most popular month as (month name, count), earliest month wins ties."""
+        if not self.month_counts:
+            return None
+        month, count = max(self.month_counts.items(), key=lambda x: (x[1], -x[0]))
+        return calendar.month_name[month], count
+
+    @property
+    def most_popular_date(self) -> tuple[str, int] | None:
+        """Most popular date as ("D Month", count), earliest date wins ties."""
+        if not self.date_counts:
+            return None
+        month_day, count = min(self.date_counts.items(), key=lambda x: (-x[1], x[0]))
+        month, day = month_day.split("-")
+        return f"{int(day)} {calendar.month_name[int(month)]}", count
+
+    @property
+    def age_stats(self) -> TAgeStats | None:
+        return compute_age_stats(self.age_counts)
+
+
+def compute_age_stats(age_counts: dict[int, int]) -> TAgeStats | None:
+    """
+    Compute average, median, minimum and maximum age from an age histogram.
+
+    Args:
+        age_counts: Age -> number of people of that age
+
+    Returns:
+        TAgeStats or None if the histogram is empty
+    """
+    total = sum(age_counts.values())
+    if total == 0:
+        return None
+
+    ages = sorted(age_counts)
+    average = sum(age * count for age, count in age_counts.items()) / total
+
+    # Median: the age at position total // 2 (and the one before it for even totals)
+    lower_index, upper_index = (total - 1) // 2, total // 2
+    lower = upper = None
+    seen = 0
+    for age in ages:
+        seen += age_counts[age]
+        if lower is None and seen > lower_index:
+            lower = age
+        if seen > upper_index:
+            upper = age
+            break
+
+    return TAgeStats(average, (lower + upper) / 2.0, ages[0], ages[-1])
+
+
+def _today_month_day(now: datetime) -> str:
+    today = now.strftime("%m-%d")
+    # Feb 29 birthdays are celebrated on Feb 28 in non-leap years
+    if today == "02-28" and not calendar.isleap(now.year):
+        return "02-29"
+    return today
+
+
+def _build_stats(
+    date_counts: dict[str, int],
+    year_counts: list[tuple[int, bool, int]],
+    now: datetime,
+) -> TBirthdayStats:
+    month_counts = {}
+    for month_day, count in date_counts.items():
+        month = int(month_day[:2])
+        month_counts[month] = month_counts.get(month, 0) + count
+
+    age_counts = {}
+    for birth_year, had_birthday, count in year_counts:
+        age = now.year - birth_year - (0 if had_birthday else 1)
+        age_counts[age] = age_counts.get(age, 0) + count
+
+    return TBirthdayStats(
+        total=sum(date_counts.values()),
+        this_month=month_counts.get(now.month, 0),
+        month_counts=month_counts,
+        date_counts=date_counts,
+        age_counts=age_counts,
+    )
+
+
+def compute_birthday_stats(
+    chat_id: int | None = None, now: datetime | None = None
+) -> TBirthdayStats:
+    """
+    Compute birthday statistics for one chat, or for all chats if chat_id is None.
+
+    Args:
+        chat_id: Chat to compute statistics for, None for global statistics
+        now: Reference time for ages and the current month, defaults to now
+    """
+    now = now or datetime.now()
+    date_counts = db.get_month_day_counts(chat_id) or {}
+    year_counts = db.get_birth_year_counts(_today_month_day(now), chat_id) or []
+    return _build_stats(date_counts, year_counts, now)
+
+
+# (DB_FILE, stats version, date) -> global statistics computed for them
+_global_stats_cache: tuple[tuple, TBirthdayStats] | None = None
+_global_stats_lock = threading.Lock()
+
+
+def get_global_stats(now: datetime | None = None) -> TBirthdayStats:
+    """
+    Get statistics over all chats from the materialized birthday_stats table.
+
+    The result only changes when a birthday is written or the date changes,
+    so it is cached and most calls cost a single lookup of the stats version.
+    """
+    global _global_stats_cache
+
+    now = now or datetime.now()
+    key = (db.DB_FILE, db.get_stats_version(), now.date())
+    with _global_stats_lock:
+        if _global_stats_cache is not None and _global_stats_cache[0] == key:
+            return _global_stats_cache[1]
+
+    today = _today_month_day(now)
+    date_counts = {}
+    year_counts = []
+    for month_day, birth_year, count in db.get_birthday_stats() or []:
+        date_counts[month_day] = date_counts.get(month_day, 0) + count
+        if birth_year:
+            year_counts.append((birth_year, month_day <= today, count))
+
+    global_stats = _build_stats(date_counts, year_counts, now)
+    with _global_stats_lock:
+        _global_stats_cache = (key, global_stats)
+    return global_stats
+
+
+def clear_global_stats_cache() -> None:
+    """Forget cached global statistics, e.g. after DB_FILE was replaced."""
+    global _global_stats_cache
+
+    with _global_stats_lock:
+        _global_stats_cache = None
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else None
+    if command not in ("check", "rebuild"):
+        print("Usage: python stats.py check|rebuild")
+        sys.exit(1)
+
+    db.init_db()
+    mismatches = db.check_stats()
+    for mismatch in mismatches:
+        print(f"Mismatch: {mismatch}")
+    if not mismatches:
+        print("✅ Materialized statistics are consistent")
+
+    if command == "rebuild":
+        db.rebuild_stats()
+        print("✅ Materialized statistics rebuilt")
+    elif mismatches:
+        sys.exit(1)
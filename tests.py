@@ -1,13 +1,44 @@
+import asyncio
+import gzip
+import http.client
+import io
+import json
 import os
 import sqlite3
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from datetime import datetime, timedelta
-
+import urllib.error
+import urllib.request
+from concurrent.futures import Future
+from datetime import date, datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import ModuleType, SimpleNamespace
+from unittest import mock
+
+import backup_db
 import db
+import delivery
+import dispatcher
+import exporter
 import i18n
+import importer
+import scheduler
+import state_store
+import stats
 import utils
-from utils import (get_time, is_timestamp_valid, parse_date,
-                   validate_birthday_input)
+import webhook
+from utils import (get_time, is_timestamp_valid, parse_birthday_input,
+                   parse_date)
+
+
+def import_bot():
+    """Import bot.py with a dummy token; nothing is sent unless a test calls the Bot API."""
+    with mock.patch.dict(os.environ, {"TELEGRAM_BOT_TOKEN": "123456:TEST", "PRESTABLE_MODE": "false"}):
+        import bot
+    return bot
 
 
 class TestTimestampParser(unittest.TestCase):
@@ -141,35 +172,57 @@ class TestValidateBirthdayInput(unittest.TestCase):
         self.original_db_file = db.DB_FILE
         db.DB_FILE = "test_validate_input.db"
         db.init_db()
+        i18n.i18n.clear_language_cache()
         self.test_chat_id = 123456789
 
     def tearDown(self):
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
         db.DB_FILE = self.original_db_file
 
     def test_incomplete_input(self):
         message = "John Doe\n15.05.1990\nJane Smith"
-        success, error_message = validate_birthday_input(message, self.test_chat_id)
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message = errors[0][2]
         self.assertIn("incomplete", error_message.lower())
 
     def test_empty_name(self):
         message = "\n15.05.1990"
-        success, error_message = validate_birthday_input(message, self.test_chat_id)
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
 
     def test_invalid_date_format(self):
         message = "John Doe\n32.13.2000"
-        success, error_message = validate_birthday_input(message, self.test_chat_id)
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message = errors[0][2]
         self.assertIn("parse", error_message.lower())
 
     def test_valid_input(self):
         message = "John Doe\n15.05.1990\nJane Smith\n20.06.1985"
-        success, error_message = validate_birthday_input(message, self.test_chat_id)
-        self.assertTrue(success)
-        self.assertEqual(error_message, "")
+        birthdays, errors = parse_birthday_input(message, self.test_chat_id)
+        self.assertEqual(errors, [])
+        self.assertEqual(len(birthdays), 2)
+
+    def test_parse_birthday_input_reports_every_error(self):
+        message = "John Doe\n15.05.1990\nBad One\n32.13.2000\nJane Smith\n20.06\nBad Two\nsoon"
+        birthdays, errors = utils.parse_birthday_input(message, self.test_chat_id)
+        self.assertEqual(
+            birthdays,
+            [
+                ("John Doe", datetime(1990, 5, 15), True),
+                ("Jane Smith", datetime(datetime.now().year, 6, 20), False),
+            ],
+        )
+        self.assertEqual([(line, date) for line, date, _ in errors], [(4, "32.13.2000"), (8, "soon")])
+
+        # A single error keeps its own message, several are listed by line
+        self.assertEqual(utils.format_birthday_input_errors(errors[:1], self.test_chat_id), errors[0][2])
+        combined = utils.format_birthday_input_errors(errors, self.test_chat_id)
+        self.assertIn("- 4: '32.13.2000'", combined)
+        self.assertIn("- 8: 'soon'", combined)
 
 
 class TestDatabase(unittest.TestCase):
@@ -182,6 +235,7 @@ class TestDatabase(unittest.TestCase):
 
     def tearDown(self):
         # Clean up test database
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
         db.DB_FILE = self.original_db_file
@@ -206,33 +260,1505 @@ class TestDatabase(unittest.TestCase):
         db.register_birthday(self.test_chat_id, name, birthday, has_year)
 
         # Test retrieving birthdays
-        birthdays = db.get_all_birthdays(self.test_chat_id)
-        self.assertEqual(len(birthdays), 1)
-        self.assertIn(name, birthdays[0])
-        self.assertIn("15 May 1990", birthdays[0])
+        records = db.list_birthdays(self.test_chat_id)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0].name, name)
+        self.assertEqual((records[0].day, records[0].month, records[0].year), (15, 5, 1990))
 
         # Test deleting birthday
         birthday_id = 1  # First entry should have ID 1
         rows_deleted = db.delete_birthday(self.test_chat_id, birthday_id)
         self.assertEqual(rows_deleted, 1)
 
-        birthdays = db.get_all_birthdays(self.test_chat_id)
-        self.assertEqual(len(birthdays), 0)
+        self.assertEqual(db.list_birthdays(self.test_chat_id), [])
 
     def test_backup_ping_operations(self):
         # Test registering backup ping
         update_interval = 60  # 60 minutes
         db.register_backup_ping(self.test_chat_id, update_interval)
 
-        # Test retrieving backup settings
-        settings = db.select_from_backup_ping(self.test_chat_id)
-        self.assertTrue(settings.is_active)
-        self.assertEqual(settings.update_timedelta, update_interval)
+        # Test retrieving backup settings
+        settings = db.select_from_backup_ping(self.test_chat_id)
+        self.assertTrue(settings.is_active)
+        self.assertEqual(settings.update_timedelta, update_interval)
+
+        # Test unregistering backup ping
+        db.unregister_backup_ping(self.test_chat_id)
+        settings = db.select_from_backup_ping(self.test_chat_id)
+        self.assertFalse(settings.is_active)
+
+
+class TestConnectionManager(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_connection_manager.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_connection_is_reused_within_thread(self):
+        connects_before = db.connection_manager.connects
+
+        db.set_user_language(self.test_chat_id, "ru")
+        for _ in range(10):
+            db.get_user_language(self.test_chat_id)
+        db.get_reminder_settings(self.test_chat_id)
+
+        self.assertIs(db.get_connection(), db.get_connection())
+        self.assertEqual(db.connection_manager.connects, connects_before)
+
+    def test_each_thread_gets_own_connection(self):
+        connections = []
+
+        def worker():
+            connections.append(db.get_connection())
+            db.register_birthday(self.test_chat_id, "Thread", datetime(1990, 1, 1), True)
+
+        threads = [threading.Thread(target=worker) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(map(id, connections))), 3)
+        self.assertNotIn(db.get_connection(), connections)
+        self.assertEqual(len(db.list_birthdays(self.test_chat_id)), 3)
+
+    def test_transaction_rolls_back_on_error(self):
+        with self.assertRaises(RuntimeError):
+            with db.transaction() as cursor:
+                cursor.execute(
+                    "INSERT INTO birthdays (chat_id, name, birthday, has_year) VALUES (?, ?, ?, ?)",
+                    (self.test_chat_id, "Rolled Back", "1990-01-01", True),
+                )
+                raise RuntimeError("abort")
+
+        self.assertEqual(db.list_birthdays(self.test_chat_id), [])
+
+    def test_nested_transaction_commits_once(self):
+        with db.transaction():
+            db.register_birthday(self.test_chat_id, "Outer", datetime(1990, 1, 1), True)
+            db.register_birthday(self.test_chat_id, "Inner", datetime(1991, 1, 1), True)
+            self.assertTrue(db.get_connection().in_transaction)
+
+        self.assertFalse(db.get_connection().in_transaction)
+        self.assertEqual(len(db.list_birthdays(self.test_chat_id)), 2)
+
+
+class TestMonthDayIndex(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_month_day.db"
+        self.test_chat_id = 123456789
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_migration_backfills_existing_rows(self):
+        # Simulate a data.db created before the month_day column existed
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute(
+            """
+            CREATE TABLE birthdays (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                birthday DATE NOT NULL,
+                has_year BOOLEAN DEFAULT FALSE,
+                was_reminded_0_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_1_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_3_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_7_days_ago BOOLEAN DEFAULT FALSE
+            )
+            """
+        )
+        conn.execute(
+            "INSERT INTO birthdays (chat_id, name, birthday, has_year) VALUES (?, ?, ?, ?)",
+            (self.test_chat_id, "Legacy Person", "1990-05-15", True),
+        )
+        conn.commit()
+        conn.close()
+
+        db.init_db()
+
+        month_day = (
+            db.get_connection()
+            .execute("SELECT month_day FROM birthdays WHERE name = 'Legacy Person'")
+            .fetchone()[0]
+        )
+        self.assertEqual(month_day, "05-15")
+
+    def test_queries_use_month_day_indexes(self):
+        db.init_db()
+        conn = db.get_connection()
+
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM birthdays WHERE month_day = ?",
+            ("05-15",),
+        ).fetchall()
+        self.assertIn("idx_birthdays_month_day", str(plan))
+
+        plan = conn.execute(
+            "EXPLAIN QUERY PLAN SELECT id FROM birthdays "
+            "WHERE chat_id = ? AND month_day >= ? ORDER BY month_day",
+            (self.test_chat_id, "05-15"),
+        ).fetchall()
+        self.assertIn("idx_birthdays_chat_id_month_day", str(plan))
+        self.assertNotIn("TEMP B-TREE", str(plan))
+
+    def test_listing_starts_from_next_birthday(self):
+        db.init_db()
+        today = datetime.now()
+        yesterday = today - timedelta(days=1)
+        tomorrow = today + timedelta(days=1)
+
+        db.register_birthday(self.test_chat_id, "Yesterday", yesterday.replace(year=2000), True)
+        db.register_birthday(self.test_chat_id, "Tomorrow", tomorrow.replace(year=2000), True)
+        db.register_birthday(self.test_chat_id, "Today", today.replace(year=2000), True)
+
+        names = [record.name for record in db.list_birthdays(self.test_chat_id)]
+        self.assertEqual(names, ["Today", "Tomorrow", "Yesterday"])
+
+
+class TestBackupPingSchedule(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_backup_schedule.db"
+        self.test_chat_id = 123456789
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_claim_due_backup_pings(self):
+        db.init_db()
+        now = int(time.time())
+        db.register_backup_ping(self.test_chat_id, 60)
+        db.register_backup_ping(42, 10)
+        db.register_backup_ping(43, 10)
+        db.unregister_backup_ping(43)
+
+        self.assertEqual(db.claim_due_backup_pings(now), [])
+        self.assertEqual(db.claim_due_backup_pings(now + 11 * 60), [42])
+        # Claimed chats are rescheduled one interval later
+        self.assertEqual(db.claim_due_backup_pings(now + 11 * 60), [])
+        self.assertEqual(
+            db.claim_due_backup_pings(now + 61 * 60), [42, self.test_chat_id]
+        )
+
+        plan = db.get_connection().execute(
+            "EXPLAIN QUERY PLAN SELECT chat_id FROM backup_ping_settings WHERE next_due <= ?",
+            (now,),
+        ).fetchall()
+        self.assertIn("idx_backup_ping_settings_next_due", str(plan))
+
+    def test_migration_backfills_next_due(self):
+        # Simulate a data.db created before the next_due column existed
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute(
+            """
+            CREATE TABLE backup_ping_settings (
+                chat_id INTEGER PRIMARY KEY NOT NULL,
+                last_updated_timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                update_timedelta INT NOT NULL,
+                is_active BOOLEAN DEFAULT FALSE
+            )
+            """
+        )
+        conn.executemany(
+            "INSERT INTO backup_ping_settings VALUES (?, ?, ?, ?)",
+            [
+                (self.test_chat_id, "2025-01-01 10:00:00", 60, True),
+                (42, "2025-01-01 10:00:00", 60, False),
+            ],
+        )
+        conn.commit()
+        conn.close()
+
+        db.init_db()
+
+        rows = dict(
+            db.get_connection()
+            .execute("SELECT chat_id, next_due FROM backup_ping_settings")
+            .fetchall()
+        )
+        due = int(datetime(2025, 1, 1, 11, tzinfo=timezone.utc).timestamp())
+        self.assertEqual(rows, {self.test_chat_id: due, 42: None})
+        self.assertTrue(db.select_from_backup_ping(self.test_chat_id).is_active)
+
+
+class TestBirthdayRecords(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_records.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_list_birthdays(self):
+        db.register_birthday(self.test_chat_id, "Doe, John", datetime(1990, 5, 15), True)
+        db.register_birthday(self.test_chat_id, "No Year", datetime(2024, 2, 29), False)
+        db.register_birthday(42, "Other Chat", datetime(1990, 5, 15), True)
+
+        records = sorted(db.list_birthdays(self.test_chat_id))
+        self.assertEqual(
+            records,
+            [
+                db.TBirthdayRecord(1, self.test_chat_id, "Doe, John", 5, 15, 1990, True),
+                db.TBirthdayRecord(2, self.test_chat_id, "No Year", 2, 29, None, False),
+            ],
+        )
+        self.assertEqual(len(db.list_birthdays()), 3)
+
+        # Formatting a record gives the same line as formatting its row
+        rows = db.get_connection().execute(
+            "SELECT id, chat_id, name, birthday, has_year FROM birthdays WHERE chat_id = ? ORDER BY id",
+            (self.test_chat_id,),
+        )
+        self.assertEqual(
+            [str(db.TBirthday.from_record(r, need_id=True)) for r in records],
+            [str(db.TBirthday(row, need_id=True)) for row in rows],
+        )
+
+    def test_keyset_pagination(self):
+        start = datetime(2000, 1, 1)
+        for i in range(25):
+            # Two birthdays per date, so pages also have to split ties on id
+            birthday = start + timedelta(days=(i // 2) * 29)
+            db.register_birthday(self.test_chat_id, f"Person {i}", birthday, True)
+        expected = db.list_birthdays(self.test_chat_id)
+
+        pages = [db.list_birthdays_page(self.test_chat_id, limit=7)]
+        while pages[-1].has_next:
+            pages.append(
+                db.list_birthdays_page(
+                    self.test_chat_id, after=pages[-1].records[-1].key, limit=7
+                )
+            )
+        self.assertEqual([len(page.records) for page in pages], [7, 7, 7, 4])
+        self.assertEqual([r for page in pages for r in page.records], expected)
+        self.assertEqual([page.has_prev for page in pages], [False, True, True, True])
+
+        # Paging back from the last page yields the same pages
+        page = pages[-1]
+        for previous in reversed(pages[:-1]):
+            page = db.list_birthdays_page(
+                self.test_chat_id, before=page.records[0].key, limit=7
+            )
+            self.assertEqual(page.records, previous.records)
+        self.assertFalse(page.has_prev)
+
+    def test_pages_keep_their_anchor_across_midnight(self):
+        for i in range(10):
+            db.register_birthday(self.test_chat_id, f"Person {i}", datetime(1990, 6, 1 + i), True)
+        # Same-date birthdays are ordered by id in the list and in the pages
+        db.register_birthday(self.test_chat_id, "Person 3b", datetime(1991, 6, 4), True)
+
+        class MockDateTime(datetime):
+            today = datetime(2025, 6, 3, 23, 59)
+
+            @classmethod
+            def now(cls, tz=None):
+                return cls.today
+
+        with mock.patch.object(db, "datetime", MockDateTime):
+            expected = db.list_birthdays(self.test_chat_id)
+            pages = [db.list_birthdays_page(self.test_chat_id, limit=4)]
+            MockDateTime.today = datetime(2025, 6, 4, 0, 1)
+            while pages[-1].has_next:
+                pages.append(
+                    db.list_birthdays_page(
+                        self.test_chat_id,
+                        after=pages[-1].records[-1].key,
+                        limit=4,
+                        anchor=pages[-1].anchor,
+                    )
+                )
+
+        self.assertEqual([page.anchor for page in pages], ["06-03"] * 3)
+        self.assertEqual([r for page in pages for r in page.records], expected)
+        self.assertEqual([r.name for r in expected[:3]], ["Person 2", "Person 3", "Person 3b"])
+
+    def test_age_on(self):
+        record = db.TBirthdayRecord(1, self.test_chat_id, "Leap", 2, 29, 2000, True)
+        self.assertEqual(record.age_on(datetime(2025, 2, 27).date()), 24)
+        self.assertEqual(record.age_on(datetime(2025, 2, 28).date()), 25)
+        self.assertEqual(record.age_on(datetime(2024, 2, 28).date()), 23)
+        self.assertEqual(record.age_on(datetime(2024, 2, 29).date()), 24)
+        self.assertIsNone(record._replace(year=None).age_on(datetime(2025, 3, 1).date()))
+
+    def test_chat_version(self):
+        version = db.get_chat_version(self.test_chat_id)
+        other_version = db.get_chat_version(42)
+
+        birthday_id = db.register_birthday(
+            self.test_chat_id, "Doe, John", datetime(1990, 5, 15), True
+        )
+        self.assertNotEqual(db.get_chat_version(self.test_chat_id), version)
+
+        # Deleting nothing, or from another chat, leaves the version alone
+        version = db.get_chat_version(self.test_chat_id)
+        db.delete_birthday(42, birthday_id)
+        db.delete_birthday(self.test_chat_id, birthday_id + 1)
+        self.assertEqual(db.get_chat_version(self.test_chat_id), version)
+        self.assertEqual(db.get_chat_version(42), other_version)
+
+        db.delete_birthday(self.test_chat_id, birthday_id)
+        self.assertNotEqual(db.get_chat_version(self.test_chat_id), version)
+
+    def test_register_birthdays(self):
+        version = db.get_chat_version(self.test_chat_id)
+        birthdays = [
+            (f"Person {i}", datetime(1990, 1, 1) + timedelta(days=i), i % 2 == 0)
+            for i in range(50)
+        ]
+        db.register_birthday(42, "Other chat", datetime(1980, 3, 3), True)
+
+        birthday_ids = db.register_birthdays(self.test_chat_id, birthdays)
+        self.assertEqual(db.get_chat_version(self.test_chat_id), version + 1)
+        self.assertEqual(db.register_birthdays(self.test_chat_id, []), [])
+
+        rows = db.get_connection().execute(
+            "SELECT id, name, birthday, has_year FROM birthdays WHERE chat_id = ? ORDER BY id",
+            (self.test_chat_id,),
+        ).fetchall()
+        self.assertEqual(
+            rows,
+            [
+                (birthday_id, name, birthday.strftime("%Y-%m-%d"), has_year)
+                for birthday_id, (name, birthday, has_year) in zip(birthday_ids, birthdays)
+            ],
+        )
+
+        # A failing row rolls the whole batch back and raises
+        with self.assertRaises(sqlite3.IntegrityError):
+            db.register_birthdays(
+                self.test_chat_id,
+                [("Rolled Back", datetime(1990, 1, 1), True), (None, datetime(1990, 1, 2), True)],
+            )
+        self.assertEqual(len(db.list_birthdays(self.test_chat_id)), len(birthdays))
+
+    def test_iter_birthdays(self):
+        start = datetime(2000, 1, 1)
+        for i in range(30):
+            birthday = start + timedelta(days=i * 23)
+            db.register_birthday(self.test_chat_id, f"Person {i}", birthday, True)
+
+        self.assertEqual(
+            list(db.iter_birthdays(self.test_chat_id)), db.list_birthdays(self.test_chat_id)
+        )
+
+
+class TestReminderScheduler(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_scheduler.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+        self.now = datetime(2025, 6, 10, 12, 0)
+        self.delivered = []
+        self.scheduler = scheduler.TReminderScheduler(
+            on_due=self.delivered.append, clock=lambda: self.now
+        )
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_compute_next_fire_crosses_year_end(self):
+        birthday = datetime(1990, 1, 2).date()
+
+        fire_at, occurrence = scheduler.compute_next_fire(
+            birthday, 7, datetime(2025, 12, 20, 12, 0)
+        )
+        self.assertEqual(fire_at, datetime(2025, 12, 26, 7, 0))
+        self.assertEqual(occurrence, datetime(2026, 1, 2).date())
+
+        fire_at, occurrence = scheduler.compute_next_fire(
+            birthday, 7, datetime(2025, 12, 28, 12, 0)
+        )
+        self.assertEqual(fire_at, datetime(2026, 12, 26, 7, 0))
+        self.assertEqual(occurrence, datetime(2027, 1, 2).date())
+
+    def test_compute_next_fire_today(self):
+        birthday = datetime(1990, 6, 10).date()
+
+        # Within the daytime window a reminder due today fires immediately
+        fire_at, _ = scheduler.compute_next_fire(birthday, 0, datetime(2025, 6, 10, 15, 0))
+        self.assertEqual(fire_at, datetime(2025, 6, 10, 15, 0))
+
+        # After the window it moves to next year
+        fire_at, _ = scheduler.compute_next_fire(birthday, 0, datetime(2025, 6, 10, 22, 0))
+        self.assertEqual(fire_at, datetime(2026, 6, 10, 7, 0))
+
+    def test_rebuild_and_pop_due_events(self):
+        db.update_reminder_settings(self.test_chat_id, [0, 1])
+        db.register_birthday(self.test_chat_id, "Tomorrow", datetime(1990, 6, 11), True)
+        db.register_birthday(self.test_chat_id, "Later", datetime(1990, 9, 1), False)
+
+        self.scheduler.rebuild()
+        # "Later" is outside the schedule window
+        self.assertEqual(len(self.scheduler), 2)
+        # The 1-day reminder for "Tomorrow" is due right now
+        self.assertEqual(self.scheduler.next_fire_time(), self.now)
+
+        events = self.scheduler.pop_due_events(self.now)
+        self.assertEqual([(e.name, e.days_until, e.age) for e in events], [("Tomorrow", 1, 35)])
+
+        # Next year's occurrence is loaded when it enters the window
+        self.assertEqual(len(self.scheduler), 1)
+        self.assertEqual(self.scheduler.next_fire_time(), datetime(2025, 6, 11, 7, 0))
+
+        events = self.scheduler.pop_due_events(datetime(2025, 6, 11, 7, 0))
+        self.assertEqual([(e.name, e.days_until) for e in events], [("Tomorrow", 0)])
+
+    def test_rebuild_skips_already_reminded(self):
+        db.update_reminder_settings(self.test_chat_id, [1])
+        birthday_id = db.register_birthday(
+            self.test_chat_id, "Tomorrow", datetime(1990, 6, 11), True
+        )
+        db.mark_birthday_reminders_sent([(birthday_id, 1, 2025)])
+
+        self.scheduler.rebuild()
+        self.assertIsNone(self.scheduler.next_fire_time())
+
+    def test_reenabled_offset_skips_already_reminded(self):
+        db.update_reminder_settings(self.test_chat_id, [0, 1])
+        birthday_id = db.register_birthday(
+            self.test_chat_id, "Tomorrow", datetime(1990, 6, 11), True
+        )
+        self.scheduler.rebuild()
+        events = self.scheduler.pop_due_events(self.now)
+        self.assertEqual([e.days_until for e in events], [1])
+        db.mark_birthday_reminders_sent([(birthday_id, 1, 2025)])
+
+        self.scheduler.update_chat(self.test_chat_id, [0])
+        self.scheduler.update_chat(self.test_chat_id, [0, 1])
+        self.assertEqual(self.scheduler.next_fire_time(), datetime(2025, 6, 11, 7, 0))
+        self.assertEqual(self.scheduler.pop_due_events(self.now), [])
+
+    def test_window_loads_days_as_time_passes(self):
+        db.update_reminder_settings(self.test_chat_id, [0, 3])
+        db.register_birthday(self.test_chat_id, "Later", datetime(1990, 9, 1), True)
+        db.register_birthday(self.test_chat_id, "Leap", datetime(1992, 2, 29), True)
+        self.scheduler.rebuild()
+        self.assertEqual(len(self.scheduler), 0)
+
+        self.now = datetime(2025, 8, 25, 12, 0)
+        self.assertEqual(self.scheduler.next_fire_time(), datetime(2025, 8, 29, 7, 0))
+        self.assertEqual(len(self.scheduler), 2)
+
+        # Feb 29 birthdays fall back to Feb 28 in non-leap years
+        self.now = datetime(2026, 2, 20, 12, 0)
+        events = self.scheduler.pop_due_events(datetime(2026, 2, 28, 7, 0))
+        self.assertEqual(
+            sorted((e.name, e.days_until, e.occurrence) for e in events),
+            [("Leap", 0, date(2026, 2, 28))],
+        )
+
+    def test_incremental_updates(self):
+        self.scheduler.rebuild()
+        self.assertIsNone(self.scheduler.next_fire_time())
+
+        self.scheduler.update_chat(self.test_chat_id, [0])
+        self.scheduler.add_birthday(1, self.test_chat_id, "Soon", datetime(1990, 6, 20), True)
+        self.assertEqual(self.scheduler.next_fire_time(), datetime(2025, 6, 20, 7, 0))
+
+        self.scheduler.update_chat(self.test_chat_id, [0, 7])
+        self.assertEqual(len(self.scheduler), 2)
+        self.assertEqual(self.scheduler.next_fire_time(), datetime(2025, 6, 13, 7, 0))
+
+        self.scheduler.update_chat(self.test_chat_id, [7])
+        self.assertEqual(len(self.scheduler), 1)
+
+        self.scheduler.remove_birthday(1)
+        self.assertEqual(len(self.scheduler), 0)
+        self.assertIsNone(self.scheduler.next_fire_time())
+
+    def test_due_events_are_batched_across_chats_and_offsets(self):
+        db.update_reminder_settings(self.test_chat_id, [0, 1, 3])
+        db.update_reminder_settings(42, [3])
+        db.register_birthday(self.test_chat_id, "Tomorrow", datetime(1990, 6, 11), True)
+        db.register_birthday(self.test_chat_id, "Soon", datetime(1990, 6, 13), True)
+        db.register_birthday(42, "Other Chat", datetime(1990, 6, 13), True)
+        self.scheduler.rebuild()
+
+        batch = self.scheduler.pop_due_events(self.now)
+        self.assertEqual(
+            sorted((e.chat_id, e.name, e.days_until) for e in batch),
+            [
+                (42, "Other Chat", 3),
+                (self.test_chat_id, "Soon", 3),
+                (self.test_chat_id, "Tomorrow", 1),
+            ],
+        )
+
+    def test_run_wakes_up_for_new_birthday(self):
+        delivered = threading.Event()
+        self.scheduler.on_due = lambda events: delivered.set()
+        self.scheduler.update_chat(self.test_chat_id, [0])
+
+        thread = threading.Thread(target=self.scheduler.run, daemon=True)
+        thread.start()
+
+        self.scheduler.add_birthday(1, self.test_chat_id, "Today", datetime(1990, 6, 10), True)
+        self.assertTrue(delivered.wait(timeout=5))
+
+    def test_run_async_wakes_up_for_new_birthday(self):
+        delivered = threading.Event()
+        self.scheduler.on_due = lambda events: delivered.set()
+        self.scheduler.update_chat(self.test_chat_id, [0])
+
+        async def main():
+            task = asyncio.create_task(self.scheduler.run_async())
+            await asyncio.sleep(0.05)
+            # Changes normally come from handler threads
+            await asyncio.to_thread(
+                self.scheduler.add_birthday,
+                1, self.test_chat_id, "Today", datetime(1990, 6, 10), True,
+            )
+            delivered_in_time = await asyncio.to_thread(delivered.wait, 5)
+            task.cancel()
+            return delivered_in_time
+
+        self.assertTrue(asyncio.run(main()))
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    """Minimal stand-in for the Bot API sendMessage endpoint."""
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.calls.append(payload)
+            chat_id = payload["chat_id"]
+            if chat_id == 403:
+                status, body = 403, {
+                    "ok": False,
+                    "error_code": 403,
+                    "description": "Forbidden: bot was blocked by the user",
+                }
+            elif chat_id in server.rate_limited:
+                server.rate_limited.discard(chat_id)
+                status, body = 429, {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                }
+            else:
+                server.delivered.append((chat_id, payload["text"]))
+                status, body = 200, {
+                    "ok": True,
+                    "result": {"message_id": len(server.delivered)},
+                }
+
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeApiTelegramException(Exception):
+    """Mirrors the attributes of telebot.apihelper.ApiTelegramException."""
+
+    def __init__(self, result_json):
+        super().__init__(result_json["description"])
+        self.result_json = result_json
+        self.error_code = result_json["error_code"]
+
+
+class TestOutboundQueue(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), FakeTelegramHandler)
+        self.server.lock = threading.Lock()
+        self.server.calls = []
+        self.server.delivered = []
+        self.server.rate_limited = {1}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}/botTOKEN/sendMessage"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def send_message(self, chat_id, text, **kwargs):
+        request = urllib.request.Request(
+            self.url,
+            data=json.dumps({"chat_id": chat_id, "text": text, **kwargs}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())["result"]
+        except urllib.error.HTTPError as e:
+            raise FakeApiTelegramException(json.loads(e.read()))
+
+    def test_token_bucket(self):
+        now = [0.0]
+        bucket = delivery.TTokenBucket(rate=1, capacity=2, clock=lambda: now[0])
+
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertEqual(bucket.reserve(), 1.0)
+        self.assertEqual(bucket.reserve(), 2.0)
+
+        now[0] = 10.0
+        self.assertTrue(bucket.is_idle())
+        bucket.pause(5)
+        self.assertEqual(bucket.reserve(), 5.0)
+
+    def test_delivery_against_fake_endpoint(self):
+        outbound = delivery.TOutboundQueue(self.send_message, workers=2, per_chat_rate=100)
+        outbound.start()
+
+        chat_1 = [outbound.send_message(1, f"message {i}") for i in range(3)]
+        chat_2 = outbound.send_message(2, "hello")
+        blocked = outbound.send_message(403, "hello")
+
+        for future in chat_1 + [chat_2]:
+            self.assertIn("message_id", future.result(timeout=10))
+        with self.assertRaises(FakeApiTelegramException) as error:
+            blocked.result(timeout=10)
+        self.assertEqual(error.exception.error_code, 403)
+
+        outbound.stop(timeout=5)
+
+        # 429 was retried after retry_after and did not reorder the chat's messages
+        self.assertEqual(
+            [text for chat_id, text in self.server.delivered if chat_id == 1],
+            ["message 0", "message 1", "message 2"],
+        )
+        self.assertEqual(sum(1 for call in self.server.calls if call["chat_id"] == 1), 4)
+        # Client errors are not retried
+        self.assertEqual(sum(1 for call in self.server.calls if call["chat_id"] == 403), 1)
+
+    def test_when_all(self):
+        results = []
+        futures = [Future(), Future()]
+        delivery.when_all(futures, results.append)
+
+        futures[0].set_result(1)
+        self.assertEqual(results, [])
+        futures[1].set_exception(RuntimeError("failed"))
+        self.assertEqual(results, [futures])
+
+        delivery.when_all([], results.append)
+        self.assertEqual(results, [futures, []])
+
+    def test_global_rate_limit(self):
+        waits = []
+        outbound = delivery.TOutboundQueue(
+            lambda chat_id, text: chat_id, workers=1, global_rate=2, sleep=waits.append
+        )
+        outbound.start()
+
+        futures = [outbound.send_message(chat_id, "hi") for chat_id in range(4)]
+        self.assertEqual([future.result(timeout=5) for future in futures], [0, 1, 2, 3])
+        outbound.stop(timeout=5)
+
+        self.assertEqual(len(waits), 2)
+        self.assertAlmostEqual(waits[0], 0.5, delta=0.1)
+        self.assertAlmostEqual(waits[1], 1.0, delta=0.1)
+
+    def test_waiting_chat_does_not_stall_its_lane(self):
+        sent = []
+
+        def send_message(chat_id, text):
+            if chat_id == 2 and not any(c == 2 for c, _ in sent):
+                sent.append((chat_id, "429"))
+                raise FakeApiTelegramException(
+                    {
+                        "error_code": 429,
+                        "description": "Too Many Requests: retry after 1",
+                        "parameters": {"retry_after": 1},
+                    }
+                )
+            sent.append((chat_id, text))
+            return text
+
+        outbound = delivery.TOutboundQueue(
+            send_message, workers=1, per_chat_rate=1, per_chat_burst=1
+        )
+        outbound.start()
+        first = [outbound.send_message(1, f"message {i}") for i in range(2)]
+        other = outbound.send_message(3, "hello")
+        self.assertEqual(other.result(timeout=5), "hello")
+        # Chat 1's second message waits for its bucket behind chat 3's message
+        self.assertEqual(sent, [(1, "message 0"), (3, "hello")])
+        self.assertFalse(first[1].done())
+
+        limited = outbound.send_message(2, "hi")
+        self.assertEqual([future.result(timeout=5) for future in first], ["message 0", "message 1"])
+        self.assertEqual(limited.result(timeout=5), "hi")
+        outbound.stop(timeout=5)
+        # A 429 holds back the global bucket as well
+        self.assertGreater(outbound.global_bucket.paused_until, 0)
+        self.assertEqual(outbound.pending(), 0)
+
+    def test_async_queue_keeps_chat_order_without_threads(self):
+        sent = []
+        in_flight = [0, 0]
+
+        async def send_message(chat_id, text):
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            await asyncio.sleep(0.01)
+            in_flight[0] -= 1
+            if chat_id == 403:
+                raise FakeApiTelegramException(
+                    {"error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+                )
+            sent.append((chat_id, text))
+            return text
+
+        async def main():
+            outbound = delivery.TAsyncOutboundQueue(
+                send_message, global_rate=10000, per_chat_rate=1000, per_chat_burst=1000
+            )
+            outbound.start()
+            threads = threading.active_count()
+            futures = [
+                outbound.send_message(chat_id, str(i))
+                for i in range(3)
+                for chat_id in range(100)
+            ]
+            blocked = outbound.send_message(403, "hi")
+            await outbound.join()
+            self.assertEqual(threading.active_count(), threads)
+            return futures, blocked
+
+        futures, blocked = asyncio.run(main())
+        self.assertEqual([future.result() for future in futures[:2]], ["0", "0"])
+        self.assertIsInstance(blocked.exception(), FakeApiTelegramException)
+        for chat_id in range(100):
+            self.assertEqual(
+                [text for sent_chat_id, text in sent if sent_chat_id == chat_id],
+                ["0", "1", "2"],
+            )
+        # Different chats are sent to concurrently
+        self.assertGreater(in_flight[1], 50)
+
+
+class TestUpdateDispatcher(unittest.TestCase):
+    def make_update(self, update_id, chat_id, text=""):
+        chat = SimpleNamespace(id=chat_id)
+        return SimpleNamespace(update_id=update_id, message=SimpleNamespace(chat=chat, text=text))
+
+    def test_get_update_chat_id(self):
+        self.assertEqual(dispatcher.get_update_chat_id(self.make_update(1, 42)), 42)
+
+        user = SimpleNamespace(id=7)
+        callback = SimpleNamespace(
+            message=SimpleNamespace(chat=SimpleNamespace(id=42)), from_user=user
+        )
+        self.assertEqual(
+            dispatcher.get_update_chat_id(SimpleNamespace(update_id=2, callback_query=callback)),
+            42,
+        )
+        checkout = SimpleNamespace(update_id=3, pre_checkout_query=SimpleNamespace(from_user=user))
+        self.assertEqual(dispatcher.get_update_chat_id(checkout), 7)
+        self.assertEqual(dispatcher.get_update_chat_id(SimpleNamespace(update_id=4)), 4)
+
+    def test_per_chat_order_and_concurrency(self):
+        handled = []
+        lock = threading.Lock()
+        slow_chat_started = threading.Event()
+        release_slow_chat = threading.Event()
+
+        def handle_update(update):
+            if update.message.text == "slow":
+                slow_chat_started.set()
+                release_slow_chat.wait(5)
+            if update.message.text == "fail":
+                raise ValueError("handler error")
+            with lock:
+                handled.append((update.message.chat.id, update.update_id))
+
+        # Chats 0 and 1 always land on different lanes
+        updates_dispatcher = dispatcher.TUpdateDispatcher(handle_update, workers=2)
+        updates_dispatcher.start()
+
+        updates_dispatcher.submit(self.make_update(0, 0, "slow"))
+        self.assertTrue(slow_chat_started.wait(5))
+        for update_id in range(1, 21):
+            text = "fail" if update_id == 5 else ""
+            updates_dispatcher.submit(self.make_update(update_id, update_id % 2, text))
+
+        # The other chat is handled while chat 0 is stuck in its slow handler
+        deadline = time.monotonic() + 5
+        while len(handled) < 9 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        with lock:
+            self.assertEqual(handled, [(1, i) for i in range(1, 21, 2) if i != 5])
+
+        release_slow_chat.set()
+        updates_dispatcher.stop(timeout=5)
+        self.assertEqual(
+            [update_id for chat_id, update_id in handled if chat_id == 0],
+            list(range(0, 21, 2)),
+        )
+
+    def test_polling_offset_advances_while_handlers_run(self):
+        handler_started = threading.Event()
+        release_handler = threading.Event()
+        server_updates = [self.make_update(1, 0, "slow"), self.make_update(2, 1)]
+
+        class PollingBot:
+            """The parts of telebot.TeleBot that polling relies on."""
+
+            def __init__(self, token):
+                self.last_update_id = 0
+                self.offsets = []
+                self.handled = []
+
+            def get_updates(self, offset):
+                self.offsets.append(offset)
+                return [update for update in server_updates if update.update_id >= offset]
+
+            def poll(self):
+                self.process_new_updates(self.get_updates(offset=self.last_update_id + 1))
+
+            def process_new_updates(self, updates):
+                for update in updates:
+                    if update.message.text == "slow":
+                        handler_started.set()
+                        release_handler.wait(5)
+                    if update.update_id > self.last_update_id:
+                        self.last_update_id = update.update_id
+                    self.handled.append(update.update_id)
+
+        class DispatchingBot(dispatcher.TDispatchingMixin, PollingBot):
+            pass
+
+        polling_bot = DispatchingBot("TOKEN", workers=2)
+        polling_bot.dispatcher.start()
+        polling_bot.poll()
+        self.assertTrue(handler_started.wait(5))
+        polling_bot.poll()
+        release_handler.set()
+        polling_bot.dispatcher.stop(timeout=5)
+
+        self.assertEqual(polling_bot.offsets, [1, 3])
+        self.assertEqual(sorted(polling_bot.handled), [1, 2])
+
+
+class FakeAsyncTeleBot:
+    """Records handler registrations and sent messages like telebot's AsyncTeleBot."""
+
+    def __init__(self, token):
+        self.token = token
+        self.handlers = []
+        self.sent = []
+
+    def register_message_handler(self, callback, **filters):
+        self.handlers.append((callback, filters))
+
+    register_edited_message_handler = register_message_handler
+    register_callback_query_handler = register_message_handler
+    register_pre_checkout_query_handler = register_message_handler
+
+    async def send_message(self, chat_id, text, **kwargs):
+        await asyncio.sleep(0)
+        self.sent.append((chat_id, text))
+        return SimpleNamespace(message_id=len(self.sent), chat=SimpleNamespace(id=chat_id))
+
+
+class TestAsyncRuntime(unittest.TestCase):
+    def import_async_bot(self):
+        """Import async_bot against FakeAsyncTeleBot, without bot.py's handlers."""
+        async_telebot = ModuleType("telebot.async_telebot")
+        async_telebot.AsyncTeleBot = FakeAsyncTeleBot
+        telebot = ModuleType("telebot")
+        telebot.async_telebot = async_telebot
+        modules = {"telebot": telebot, "telebot.async_telebot": async_telebot, "bot": ModuleType("bot")}
+        with mock.patch.dict(sys.modules, modules):
+            sys.modules.pop("async_bot", None)
+            import async_bot
+        return async_bot
+
+    def make_message(self, chat_id, text):
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id), text=text)
+
+    def test_get_chat_id(self):
+        async_bot = self.import_async_bot()
+        user = SimpleNamespace(id=7)
+        self.assertEqual(async_bot.get_chat_id(self.make_message(42, "")), 42)
+        callback = SimpleNamespace(message=self.make_message(42, ""), from_user=user)
+        self.assertEqual(async_bot.get_chat_id(callback), 42)
+        self.assertEqual(async_bot.get_chat_id(SimpleNamespace(from_user=user)), 7)
+
+    def test_handlers_run_per_chat_in_order_through_the_bridge(self):
+        async_bot = self.import_async_bot()
+        runtime = async_bot.TAsyncRuntime("TOKEN", workers=4)
+        events = []
+        bridge = []
+
+        def handle_text(message):
+            events.append(("start", message.chat.id, message.text))
+            if message.text == "slow":
+                time.sleep(0.2)
+            # A Bot API call made by a handler thread, run on the event loop
+            sent = bridge[0].send_message(message.chat.id, f"echo {message.text}")
+            events.append(("end", sent.chat.id, message.text))
+
+        sync_bot = SimpleNamespace(
+            message_handlers=[{"function": handle_text, "filters": {"content_types": ["text"]}}]
+        )
+        runtime.register_handlers(sync_bot)
+        self.assertEqual(len(runtime.async_bot.handlers), 1)
+        handle, filters = runtime.async_bot.handlers[0]
+        self.assertEqual(filters, {"content_types": ["text"]})
+
+        async def main():
+            bridge.append(async_bot.TSyncBotBridge(runtime.async_bot, asyncio.get_running_loop()))
+            await asyncio.gather(
+                handle(self.make_message(1, "slow")),
+                handle(self.make_message(1, "next")),
+                handle(self.make_message(2, "other")),
+            )
+
+        asyncio.run(main())
+        runtime.executor.shutdown()
+
+        # A chat's updates are handled one at a time, in order
+        self.assertEqual(
+            [event for event in events if event[1] == 1],
+            [("start", 1, "slow"), ("end", 1, "slow"), ("start", 1, "next"), ("end", 1, "next")],
+        )
+        # ...while other chats don't wait for them
+        self.assertLess(events.index(("end", 2, "other")), events.index(("end", 1, "slow")))
+        self.assertCountEqual(
+            runtime.async_bot.sent, [(1, "echo slow"), (1, "echo next"), (2, "echo other")]
+        )
+        self.assertEqual(runtime._chats, {})
+
+
+class TestWebhookServer(unittest.TestCase):
+    UPDATE = {
+        "update_id": 10000,
+        "message": {
+            "message_id": 1365,
+            "date": 1441645532,
+            "chat": {"id": 123456789, "type": "private", "first_name": "Test"},
+            "from": {"id": 123456789, "is_bot": False, "first_name": "Test"},
+            "text": "/start",
+        },
+    }
+
+    def setUp(self):
+        self.updates = []
+        self.received = threading.Event()
+
+        def handle_update(update):
+            self.updates.append(update)
+            self.received.set()
+
+        self.server = webhook.TWebhookServer(
+            handle_update, secret_token="s3cret", host="127.0.0.1", port=0
+        )
+        self.server.start()
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}{webhook.WEBHOOK_PATH}"
+
+    def tearDown(self):
+        self.server.stop()
+
+    def post(self, body: bytes, secret_token: str | None = "s3cret", url: str | None = None) -> int:
+        request = urllib.request.Request(url or self.url, data=body, method="POST")
+        request.add_header("Content-Type", "application/json")
+        if secret_token is not None:
+            request.add_header(webhook.SECRET_TOKEN_HEADER, secret_token)
+        try:
+            with urllib.request.urlopen(request, timeout=5) as response:
+                return response.status
+        except urllib.error.HTTPError as e:
+            return e.code
+
+    def test_update_is_handed_to_worker(self):
+        self.assertEqual(self.post(json.dumps(self.UPDATE).encode()), 200)
+        self.assertTrue(self.received.wait(timeout=5))
+        self.assertEqual(self.updates, [self.UPDATE])
+
+    def test_rejects_invalid_requests(self):
+        body = json.dumps(self.UPDATE).encode()
+        self.assertEqual(self.post(body, secret_token=None), 403)
+        self.assertEqual(self.post(body, secret_token="wrong"), 403)
+        self.assertEqual(self.post(b"not json"), 400)
+        self.assertEqual(self.post(body, url=self.url + "/other"), 404)
+
+        # Stopping drains the worker pool, so nothing can still be in flight
+        self.server.stop()
+        self.assertEqual(self.updates, [])
+
+    def post_with_length(self, content_length: str) -> int:
+        connection = http.client.HTTPConnection(*self.server.server_address[:2], timeout=5)
+        try:
+            connection.putrequest("POST", webhook.WEBHOOK_PATH)
+            connection.putheader("Content-Length", content_length)
+            connection.putheader(webhook.SECRET_TOKEN_HEADER, "s3cret")
+            connection.endheaders()
+            return connection.getresponse().status
+        finally:
+            connection.close()
+
+    def test_rejects_invalid_content_length(self):
+        self.assertEqual(self.post_with_length("abc"), 400)
+        self.assertEqual(self.post_with_length("-1"), 400)
+        self.assertEqual(self.post_with_length(str(webhook.MAX_BODY_BYTES + 1)), 413)
+        self.assertEqual(self.updates, [])
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_state_store.db"
+        db.init_db()
+        self.now = 1_000_000.0
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def make_store(self, **kwargs):
+        return state_store.TStateStore(
+            "test", ttl_seconds=60, clock=lambda: self.now, **kwargs
+        )
+
+    def test_ttl_and_lru_bound(self):
+        store = self.make_store(max_size=2)
+        store[1] = "a"
+        store[2] = "b"
+        self.assertEqual(store.get(1), "a")
+        # 2 is now the least recently used entry
+        store[3] = "c"
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get(2))
+        self.assertIn(1, store)
+
+        self.now += 61
+        self.assertEqual(store.get(1, "expired"), "expired")
+        self.assertEqual(store.purge_expired(), 1)
+        self.assertEqual(len(store), 0)
+
+    def test_append_and_pop(self):
+        store = self.make_store()
+        store.append(1, 10)
+        store.append(1, 11)
+        self.assertEqual(store.pop(1, []), [10, 11])
+        self.assertEqual(store.pop(1, []), [])
+
+        threads = [
+            threading.Thread(target=lambda: [store.append(2, i) for i in range(100)])
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(store.get(2)), 400)
+
+    def test_persistent_misses_are_cached_and_read_outside_the_lock(self):
+        store = self.make_store(persistent=True)
+        load_conversation_state = db.load_conversation_state
+        lock_taken = []
+
+        def take_lock():
+            lock_taken.append(store._lock.acquire(timeout=1))
+            if lock_taken[-1]:
+                store._lock.release()
+
+        def load(*args):
+            # Another chat can use the store while this one reads the disk
+            thread = threading.Thread(target=take_lock)
+            thread.start()
+            thread.join()
+            return load_conversation_state(*args)
+
+        with mock.patch.object(db, "load_conversation_state", side_effect=load) as loads:
+            for _ in range(3):
+                self.assertIsNone(store.get(1))
+            store[1] = "a"
+            self.assertEqual(store.pop(1), "a")
+            self.assertIsNone(store.get(1))
+        self.assertEqual(loads.call_count, 1)
+        self.assertEqual(lock_taken, [True])
+
+    def test_persistence_survives_restart(self):
+        store = self.make_store(
+            persistent=True, encode=lambda day: day.isoformat(), decode=date.fromisoformat
+        )
+        store[1] = date(2025, 5, 15)
+        store[2] = date(2025, 5, 16)
+        store.pop(2)
+
+        restarted = self.make_store(
+            persistent=True, max_size=1, decode=date.fromisoformat
+        )
+        self.assertEqual(restarted.get(1), date(2025, 5, 15))
+        self.assertIsNone(restarted.get(2))
+
+        self.now += 61
+        restarted.purge_expired()
+        self.assertIsNone(self.make_store(persistent=True).get(1))
+        count = db.get_connection().execute(
+            "SELECT COUNT(*) FROM conversation_state"
+        ).fetchone()[0]
+        self.assertEqual(count, 0)
+
+
+class TestImporter(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_importer.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def test_detect_format(self):
+        self.assertEqual(importer.detect_format("contacts.VCF", None), importer.TImportFormat.VCard)
+        self.assertEqual(importer.detect_format("export", "text/csv"), importer.TImportFormat.Csv)
+        self.assertEqual(importer.detect_format("cal.ics", "text/plain"), importer.TImportFormat.ICalendar)
+        self.assertIsNone(importer.detect_format("photo.jpg", "image/jpeg"))
+
+    def test_normalize_date(self):
+        self.assertEqual(importer.normalize_date("1990-05-15"), "15.05.1990")
+        self.assertEqual(importer.normalize_date("19900515T090000Z"), "15.05.1990")
+        self.assertEqual(importer.normalize_date("--05-15"), "15.05")
+        self.assertEqual(importer.normalize_date("--0515"), "15.05")
+        self.assertEqual(importer.normalize_date("1604-05-15"), "15.05")
+        self.assertEqual(importer.normalize_date(" 15.05 34 "), "15.05 34")
+
+    def test_csv_entries(self):
+        lines = io.StringIO(
+            "First Name,Last Name,E-mail,Birthday\n"
+            "John,Doe,john@example.com,1990-05-15\n"
+            "No,Birthday,nb@example.com,\n"
+            '"Smith, Jane",,,20.06\n'
+        )
+        self.assertEqual(
+            list(importer.iter_csv_entries(lines)),
+            [
+                importer.TImportEntry(2, "John Doe", "15.05.1990"),
+                importer.TImportEntry(4, "Smith, Jane", "20.06"),
+            ],
+        )
+
+        # Without a header the first two columns are the name and the date
+        lines = io.StringIO("John Doe;15.05.1990\nJane;20.06 30\n")
+        self.assertEqual(
+            list(importer.iter_csv_entries(lines)),
+            [
+                importer.TImportEntry(1, "John Doe", "15.05.1990"),
+                importer.TImportEntry(2, "Jane", "20.06 30"),
+            ],
+        )
+
+    def test_vcard_entries(self):
+        lines = io.StringIO(
+            "BEGIN:VCARD\r\nVERSION:3.0\r\nN:Doe;John;;;\r\nFN:John\r\n  Doe\r\n"
+            "item1.BDAY;VALUE=date:1990-05-15\r\nEND:VCARD\r\n"
+            "BEGIN:VCARD\r\nN:Smith;Jane;;;\r\nBDAY:--0620\r\nEND:VCARD\r\n"
+            "BEGIN:VCARD\r\nFN:No Birthday\r\nEND:VCARD\r\n",
+            newline="",
+        )
+        self.assertEqual(
+            list(importer.iter_vcard_entries(lines)),
+            [
+                importer.TImportEntry(1, "John Doe", "15.05.1990"),
+                importer.TImportEntry(8, "Jane Smith", "20.06"),
+            ],
+        )
+
+    def test_ics_entries(self):
+        lines = io.StringIO(
+            "BEGIN:VCALENDAR\nBEGIN:VEVENT\nSUMMARY:Doe\\, John\n"
+            "DTSTART;VALUE=DATE:19900515\nRRULE:FREQ=YEARLY\nEND:VEVENT\n"
+            "BEGIN:VEVENT\nSUMMARY:Meeting\nDTSTART:20240101T100000Z\nEND:VEVENT\n"
+            "END:VCALENDAR\n"
+        )
+        self.assertEqual(
+            list(importer.iter_ics_entries(lines)),
+            [importer.TImportEntry(2, "Doe, John", "15.05.1990")],
+        )
+
+    def test_import_birthdays_in_batches(self):
+        entries = [
+            importer.TImportEntry(i + 1, f"Person {i}", f"{i % 28 + 1}.05.1990")
+            for i in range(5)
+        ]
+        entries.insert(2, importer.TImportEntry(3, "Bad", "32.13.2000"))
+        entries.append(importer.TImportEntry(8, "", "15.05.1990"))
+
+        batches = []
+        report = importer.import_birthdays(
+            self.test_chat_id,
+            iter(entries),
+            lambda ids, batch, report: batches.append((ids, [name for name, _, _ in batch])),
+            batch_size=2,
+        )
+
+        self.assertEqual(report.imported, 5)
+        self.assertEqual(report.error_count, 2)
+        self.assertEqual([entry.line for entry in report.errors], [3, 8])
+        self.assertEqual([len(ids) for ids, _ in batches], [2, 2, 1])
+        names = dict(
+            db.get_connection().execute(
+                "SELECT id, name FROM birthdays WHERE chat_id = ?", (self.test_chat_id,)
+            )
+        )
+        for ids, batch_names in batches:
+            self.assertEqual([names[birthday_id] for birthday_id in ids], batch_names)
+
+    def test_import_stops_at_a_batch_that_cant_be_saved(self):
+        entries = [
+            importer.TImportEntry(i + 1, f"Person {i}", f"{i % 28 + 1}.05.1990")
+            for i in range(6)
+        ]
+        register_birthdays = db.register_birthdays
+        calls = []
+
+        def fail_second_batch(chat_id, birthdays):
+            calls.append(len(birthdays))
+            if len(calls) == 2:
+                raise sqlite3.OperationalError("database is locked")
+            return register_birthdays(chat_id, birthdays)
+
+        with mock.patch.object(db, "register_birthdays", side_effect=fail_second_batch):
+            report = importer.import_birthdays(self.test_chat_id, iter(entries), batch_size=2)
+
+        self.assertTrue(report.failed)
+        self.assertEqual(report.imported, 2)
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(len(db.list_birthdays(self.test_chat_id)), 2)
+
+    def test_report_keeps_counts_when_reading_breaks_off(self):
+        def entries():
+            for i in range(3):
+                yield importer.TImportEntry(i + 1, f"Person {i}", "15.05.1990")
+            raise OSError("connection reset")
+
+        report = importer.TImportReport()
+        with self.assertRaises(OSError):
+            importer.import_birthdays(self.test_chat_id, entries(), batch_size=2, report=report)
+        self.assertEqual(report.imported, 2)
+
+    def test_format_import_report(self):
+        report = importer.TImportReport()
+        report.imported = 7
+        for i in range(importer.MAX_REPORTED_ERRORS + 5):
+            report.add_error(importer.TImportEntry(i + 1, "Long Name " * 50, "x" * 500))
+
+        text = importer.format_import_report(self.test_chat_id, report)
+        lines = text.split("\n")
+        self.assertIn("7 birthdays imported", lines[0])
+        self.assertEqual(lines[-1], "...and 5 more.")
+        self.assertEqual(sum(line.startswith("- ") for line in lines), importer.MAX_REPORTED_ERRORS)
+        self.assertLess(len(text), utils.MAX_MESSAGE_LENGTH)
+
+        report.failed = True
+        self.assertIn("stopped part way", importer.format_import_report(self.test_chat_id, report))
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_exporter.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+        self.birthdays = [
+            ("Doe, John", datetime(1990, 5, 15), True),
+            ('Jane "JJ" Smith', datetime(datetime.now().year, 6, 20), False),
+            ("Иван Петров " * 10, datetime(1985, 2, 28), True),
+        ]
+        db.register_birthdays(self.test_chat_id, self.birthdays)
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def export(self, export_format: exporter.TExportFormat) -> str:
+        # A tiny buffer makes the export spill to a temporary file
+        with exporter.export_birthdays(self.test_chat_id, export_format, buffer_size=16) as (
+            document,
+            count,
+        ):
+            self.assertEqual(count, len(self.birthdays))
+            return document.read().decode("utf-8")
+
+    def test_exports_import_back(self):
+        readers = {
+            exporter.TExportFormat.Share: importer.iter_share_entries,
+            exporter.TExportFormat.Csv: importer.iter_csv_entries,
+            exporter.TExportFormat.ICalendar: importer.iter_ics_entries,
+        }
+        expected = sorted(
+            (name.strip(), parsed_date, has_year) for name, parsed_date, has_year in self.birthdays
+        )
+        for export_format, read_entries in readers.items():
+            with self.subTest(export_format=export_format):
+                text = self.export(export_format)
+                imported = []
+                for entry in read_entries(io.StringIO(text, newline="")):
+                    success, parsed_date, has_year = parse_date(entry.date)
+                    self.assertTrue(success, entry)
+                    imported.append((entry.name, parsed_date, has_year))
+                self.assertEqual(sorted(imported), expected)
+
+    def test_json_export(self):
+        exported = json.loads(self.export(exporter.TExportFormat.Json))
+        self.assertIn({"name": "Doe, John", "birthday": "1990-05-15"}, exported)
+        self.assertIn({"name": 'Jane "JJ" Smith', "birthday": "--06-20"}, exported)
+
+    def test_ics_lines_are_folded(self):
+        text = self.export(exporter.TExportFormat.ICalendar)
+        for line in text.split("\r\n"):
+            self.assertLessEqual(len(line.encode("utf-8")), exporter.ICS_LINE_LENGTH)
+
+    def test_empty_export(self):
+        with exporter.export_birthdays(42, exporter.TExportFormat.Json) as (document, count):
+            self.assertEqual(count, 0)
+            self.assertEqual(json.loads(document.read()), [])
+
+
+class TestBackupEngine(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.backup_dir = os.path.join(self.tmp_dir.name, "backups")
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = os.path.join(self.tmp_dir.name, "data.db")
+        db.init_db()
+        self.test_chat_id = 123456789
+        db.register_birthdays(
+            self.test_chat_id,
+            [(f"Person {i}", datetime(1990, 1, 1) + timedelta(days=i), True) for i in range(2000)],
+        )
+
+    def tearDown(self):
+        db.close_connections()
+        db.DB_FILE = self.original_db_file
+        self.tmp_dir.cleanup()
+
+    def backup(self, **kwargs) -> dict:
+        return backup_db.take_backup(db.DB_FILE, self.backup_dir, compression="gzip", **kwargs)
+
+    def restored_names(self, manifest: dict) -> list[str]:
+        restored = os.path.join(self.tmp_dir.name, "restored.db")
+        backup_db.reconstruct(manifest, restored, self.backup_dir)
+        backup_db.check_integrity(restored)
+        conn = sqlite3.connect(restored)
+        try:
+            return [name for (name,) in conn.execute("SELECT name FROM birthdays ORDER BY id")]
+        finally:
+            conn.close()
+            os.remove(restored)
+
+    def test_incremental_backups_restore_each_state(self):
+        full = self.backup()
+        self.assertEqual(full["kind"], "full")
+
+        # Left in the WAL, which the online backup reads too
+        db.register_birthday(self.test_chat_id, "Late addition", datetime(2000, 1, 1), True)
+        incremental = self.backup()
+        self.assertEqual(incremental["kind"], "incremental")
+        self.assertEqual(incremental["parent"], full["name"])
+        self.assertLess(incremental["changed_pages"], incremental["page_count"] // 4)
+        self.assertLess(
+            os.path.getsize(os.path.join(self.backup_dir, incremental["artifact"])),
+            os.path.getsize(os.path.join(self.backup_dir, full["artifact"])),
+        )
+
+        self.assertEqual(len(self.restored_names(full)), 2000)
+        self.assertEqual(self.restored_names(incremental)[-1], "Late addition")
+
+    def test_full_backup_is_due_after_incrementals(self):
+        kinds = [self.backup()["kind"] for _ in range(backup_db.INCREMENTALS_PER_FULL + 2)]
+        self.assertEqual(kinds, ["full"] + ["incremental"] * backup_db.INCREMENTALS_PER_FULL + ["full"])
+        self.assertEqual(self.backup(full=True)["kind"], "full")
+
+    def test_corrupted_backup_is_rejected(self):
+        self.backup()
+        incremental = self.backup()
+        artifact = os.path.join(self.backup_dir, incremental["artifact"])
+        with open(artifact, "r+b") as f:
+            f.seek(20)
+            byte = f.read(1)
+            f.seek(20)
+            f.write(bytes([byte[0] ^ 0xFF]))
+
+        with self.assertRaises(backup_db.BackupError):
+            self.restored_names(incremental)
+
+    def test_rotation_removes_whole_chains(self):
+        names = []
+        for _ in range(3):
+            names.append([self.backup(full=True)["name"], self.backup()["name"]])
+
+        dumps = [f"data_dump_2024010{day}_000000.sql.gz" for day in range(1, 4)]
+        for dump in dumps:
+            open(os.path.join(self.backup_dir, dump), "wb").close()
+
+        removed = backup_db.rotate_backups(self.backup_dir, keep_full=2, keep_dumps=1)
+        self.assertEqual(removed, names[0] + dumps[:2])
+        kept = backup_db.list_backups(self.backup_dir)
+        self.assertEqual([m["name"] for m in kept], names[1] + names[2])
+        self.assertTrue(all("page_hashes" not in m for m in kept))
+        # Each kept backup has its manifest and its file, only the latest one
+        # has page hashes and only the latest dump is left
+        self.assertEqual(
+            sorted(os.listdir(self.backup_dir)),
+            sorted(
+                [f"{m['name']}.json" for m in kept]
+                + [m["artifact"] for m in kept]
+                + [f"{names[2][-1]}.hashes", dumps[-1]]
+            ),
+        )
 
-        # Test unregistering backup ping
-        db.unregister_backup_ping(self.test_chat_id)
-        settings = db.select_from_backup_ping(self.test_chat_id)
-        self.assertFalse(settings.is_active)
+    def test_backup_without_page_hashes_is_full(self):
+        full = self.backup()
+        os.remove(os.path.join(self.backup_dir, f"{full['name']}.hashes"))
+        self.assertEqual(self.backup()["kind"], "full")
+
+    def test_dump_restores_into_empty_database(self):
+        path = backup_db.dump_database(db.DB_FILE, self.backup_dir, compression="gzip")
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            script = f.read()
+        conn = sqlite3.connect(":memory:")
+        conn.executescript(script)
+        (count,) = conn.execute("SELECT COUNT(*) FROM birthdays").fetchone()
+        conn.close()
+        self.assertEqual(count, 2000)
 
 
 class TestUtils(unittest.TestCase):
@@ -267,6 +1793,23 @@ class TestUtils(unittest.TestCase):
         # Check file was deleted
         self.assertFalse(os.path.exists(test_log))
 
+    def test_split_message(self):
+        self.assertEqual(utils.split_message("a\nbb\nccc", 4), ["a\nbb", "ccc"])
+        self.assertEqual(utils.split_message("short"), ["short"])
+
+        # Overlong lines are hard-wrapped instead of producing oversized chunks
+        self.assertEqual(utils.split_message("abcdefgh\nx", 4), ["abcd", "efgh", "x"])
+        self.assertEqual(utils.split_message("a\nbcdefghij", 4), ["a", "bcde", "fghi", "j"])
+
+    def test_split_lines_streams(self):
+        lines = (f"line {i}" for i in range(1000))
+        chunks = list(utils.split_lines(lines, 100))
+
+        self.assertTrue(all(len(chunk) <= 100 for chunk in chunks))
+        self.assertEqual(
+            "\n".join(chunks), "\n".join(f"line {i}" for i in range(1000))
+        )
+
 
 class TestBackupPingSettings(unittest.TestCase):
     def test_backup_settings_creation(self):
@@ -419,6 +1962,23 @@ class TestBirthdayAgeCalculation(unittest.TestCase):
         # Should calculate age correctly (using Feb 28 for comparison)
         self.assertIn("years", birthday_str)
 
+    def test_age_uses_today_snapshot(self):
+        """Test that a today snapshot passed once per batch is used for the age"""
+        select_result = (7, 123456, "Snapshot", "2000-06-15", 1)
+
+        before = db.TBirthday(select_result, today=datetime(2025, 6, 14).date())
+        on_day = db.TBirthday(select_result, today=datetime(2025, 6, 15).date())
+        self.assertIn("24 years", str(before))
+        self.assertIn("25 years", str(on_day))
+
+    def test_compact_record(self):
+        """Test that TBirthday is slotted and builds its datetime lazily"""
+        birthday = db.TBirthday((7, 123456, "Compact", "2000-06-15", 0))
+        self.assertFalse(hasattr(birthday, "__dict__"))
+        self.assertEqual((birthday.year, birthday.month, birthday.day), (2000, 6, 15))
+        self.assertEqual(birthday.birthday, datetime(2000, 6, 15))
+        self.assertEqual(str(birthday), "15 June, Compact")
+
 
 class TestMultipleBirthdayRegistration(unittest.TestCase):
     def setUp(self):
@@ -427,27 +1987,26 @@ class TestMultipleBirthdayRegistration(unittest.TestCase):
         db.init_db()
 
     def tearDown(self):
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
 
     def test_multiple_birthday_registration(self):
         message = "John Doe\n15.05.1990\nJane Smith\n20.06.1985"
-        success, parsed_birthdays = utils.parse_dates(message)
-        self.assertTrue(success)
+        parsed_birthdays, errors = utils.parse_birthday_input(message)
+        self.assertEqual(errors, [])
         self.assertEqual(len(parsed_birthdays), 2)
 
-        for name, date, has_year in parsed_birthdays:
-            db.register_birthday(self.test_chat_id, name, date, has_year)
+        for name, birthday, has_year in parsed_birthdays:
+            db.register_birthday(self.test_chat_id, name, birthday, has_year)
 
-        birthdays = db.get_all_birthdays(self.test_chat_id)
-        self.assertEqual(len(birthdays), 2)
-        self.assertIn("John Doe", birthdays[0])
-        self.assertIn("Jane Smith", birthdays[1])
+        names = [record.name for record in db.list_birthdays(self.test_chat_id)]
+        self.assertCountEqual(names, ["John Doe", "Jane Smith"])
 
     def test_invalid_multiple_birthday_registration(self):
         message = "John Doe\n15.05.1990\nInvalid Date\n32.13.2000"
-        success, _ = utils.parse_dates(message)
-        self.assertFalse(success)
+        _, errors = utils.parse_birthday_input(message)
+        self.assertEqual([line for line, _, _ in errors], [4])
 
 
 class TestMultipleBirthdayDeletion(unittest.TestCase):
@@ -466,6 +2025,7 @@ class TestMultipleBirthdayDeletion(unittest.TestCase):
         )
 
     def tearDown(self):
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
 
@@ -490,9 +2050,8 @@ class TestMultipleBirthdayDeletion(unittest.TestCase):
         self.assertEqual(not_found_ids, [])
 
         # Check remaining birthdays
-        remaining_birthdays = db.get_all_birthdays(chat_id)
-        self.assertEqual(len(remaining_birthdays), 1)
-        self.assertIn("Alice Johnson", remaining_birthdays[0])
+        remaining_birthdays = db.list_birthdays(chat_id)
+        self.assertEqual([record.name for record in remaining_birthdays], ["Alice Johnson"])
 
     def test_delete_nonexistent_birthdays(self):
         # Attempt to delete a non-existent birthday
@@ -522,36 +2081,42 @@ class TestBirthdayReminderLogic(unittest.TestCase):
         self.test_chat_id = 123456789
 
     def tearDown(self):
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
         db.DB_FILE = self.original_db_file
 
-    def test_mark_birthday_reminder_sent(self):
+    def due_reminders_today(self) -> list:
+        """0-day reminders the scheduler delivers at noon today."""
+        db.update_reminder_settings(self.test_chat_id, [0])
+        now = datetime.now().replace(hour=12, minute=0, second=0, microsecond=0)
+        reminder_scheduler = scheduler.TReminderScheduler(on_due=list, clock=lambda: now)
+        reminder_scheduler.rebuild()
+        return reminder_scheduler.pop_due_events(now)
+
+    def test_mark_reminder_sent_for_occurrence(self):
         """Test that birthday reminder flags are set correctly"""
         # Register a test birthday
         test_birthday = datetime(1990, 5, 15)
         db.register_birthday(self.test_chat_id, "Test Person", test_birthday, True)
 
         # Get the birthday ID
-        birthdays = db.get_all_birthdays(self.test_chat_id)
-        self.assertEqual(len(birthdays), 1)
+        records = db.list_birthdays(self.test_chat_id)
+        self.assertEqual(len(records), 1)
 
         # Mark reminders as sent for different days
-        birthday_id = 1  # First entry should have ID 1
+        birthday_id = records[0].id
 
         # Test marking 7-day reminder
-        db.mark_birthday_reminder_sent(birthday_id, 7)
+        target_year = (datetime.now() + timedelta(days=7)).year
+        db.mark_birthday_reminders_sent([(birthday_id, 7, target_year)])
 
-        # Verify the flag was set
-        conn = sqlite3.connect(db.DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT was_reminded_7_days_ago FROM birthdays WHERE id = ?", (birthday_id,)
+        # Verify the ledger entry for the upcoming occurrence was written
+        self.assertEqual(
+            db.get_sent_reminders(target_year, self.test_chat_id),
+            {(birthday_id, 7, target_year)},
+            "7-day reminder should be recorded",
         )
-        result = cursor.fetchone()
-        conn.close()
-
-        self.assertTrue(result[0], "7-day reminder flag should be True")
 
     def test_birthday_reminder_flags_prevent_duplicate_reminders(self):
         """Test that reminder flags prevent sending duplicate reminders"""
@@ -561,15 +2126,12 @@ class TestBirthdayReminderLogic(unittest.TestCase):
         db.register_birthday(self.test_chat_id, "Test Person", test_birthday, True)
 
         # Mark the 0-day reminder as sent
-        db.mark_birthday_reminder_sent(1, 0)
-
-        # Try to get upcoming birthdays for today (0 days ahead)
-        upcoming = db.get_upcoming_birthdays(0)
+        db.mark_birthday_reminders_sent([(1, 0, today.year)])
 
         # Should be empty because reminder was already sent
         self.assertEqual(
-            len(upcoming),
-            0,
+            self.due_reminders_today(),
+            [],
             "Should not return birthdays that already have reminders sent",
         )
 
@@ -584,22 +2146,123 @@ class TestBirthdayReminderLogic(unittest.TestCase):
 
         # Mark all reminders as sent (simulating what happened last year)
         birthday_id = 1
-        for days in [0, 1, 3, 7]:
-            db.mark_birthday_reminder_sent(birthday_id, days)
+        db.mark_birthday_reminders_sent(
+            [(birthday_id, days, (today + timedelta(days=days)).year) for days in [0, 1, 3, 7]]
+        )
+
+        # The ledger is keyed by the occurrence's year, so nothing has to be reset
+        self.assertEqual(self.due_reminders_today(), [])
+        self.assertEqual(db.get_sent_reminders(today.year + 2), set())
+
+    def test_mark_birthday_reminders_sent_in_bulk(self):
+        """Test that the bulk API records every reminder in the ledger at once"""
+        for name in ["Person 1", "Person 2", "Person 3"]:
+            db.register_birthday(self.test_chat_id, name, datetime(1990, 5, 15), True)
+
+        year = datetime.now().year
+        db.mark_birthday_reminders_sent(
+            [(1, 0, year), (2, 0, year), (3, 7, year), (1, 14, year), (1, -1, year)]
+        )
+        # Marking again is a no-op
+        db.mark_birthday_reminders_sent([(1, 0, year)])
+
+        # Any offset can be recorded, negative ones are skipped
+        self.assertEqual(
+            db.get_sent_reminders(year),
+            {(1, 0, year), (2, 0, year), (3, 7, year), (1, 14, year)},
+        )
+
+    def test_reminder_ledger_pruning(self):
+        """Test that old and orphaned ledger entries are removed"""
+        db.register_birthday(self.test_chat_id, "Person 1", datetime(1990, 5, 15), True)
+        db.register_birthday(self.test_chat_id, "Person 2", datetime(1990, 5, 15), True)
+        year = datetime.now().year
+
+        db.mark_birthday_reminders_sent([(1, 0, year - 2), (2, 0, year - 1)])
+        db.mark_birthday_reminders_sent([(1, 0, year), (2, 0, year + 1)])
+        self.assertEqual(
+            db.get_sent_reminders(0), {(2, 0, year - 1), (1, 0, year), (2, 0, year + 1)}
+        )
+
+        db.delete_birthday(self.test_chat_id, 2)
+        self.assertEqual(db.get_sent_reminders(0), {(1, 0, year)})
+
+    def create_legacy_database(self) -> datetime:
+        """Replace the test database with one using was_reminded_N_days_ago flags."""
+        db.close_connections()
+        os.remove(db.DB_FILE)
+
+        today = datetime.now()
+        recent = today - timedelta(days=2)
+        distant = today - timedelta(days=100)
+        conn = sqlite3.connect(db.DB_FILE)
+        conn.execute(
+            """
+            CREATE TABLE birthdays (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER NOT NULL,
+                name TEXT NOT NULL,
+                birthday DATE NOT NULL,
+                has_year BOOLEAN DEFAULT FALSE,
+                was_reminded_0_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_1_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_3_days_ago BOOLEAN DEFAULT FALSE,
+                was_reminded_7_days_ago BOOLEAN DEFAULT FALSE
+            )
+            """
+        )
+        conn.executemany(
+            """
+            INSERT INTO birthdays (chat_id, name, birthday, has_year,
+                was_reminded_0_days_ago, was_reminded_1_days_ago)
+            VALUES (?, ?, ?, TRUE, TRUE, TRUE)
+            """,
+            [
+                (self.test_chat_id, "Recent", recent.replace(year=1990).strftime("%Y-%m-%d")),
+                # A flag this far from the birthday was stale and is dropped
+                (self.test_chat_id, "Distant", distant.replace(year=1990).strftime("%Y-%m-%d")),
+            ],
+        )
+        conn.commit()
+        conn.close()
+        return recent
 
-        # Now check if we can get upcoming birthdays for this year
-        upcoming = db.get_upcoming_birthdays(0)
+    def test_legacy_reminder_flags_migration(self):
+        """Test that was_reminded_N_days_ago flags of an old data.db move to the ledger"""
+        recent = self.create_legacy_database()
+
+        db.init_db()
 
-        # This should NOT be empty - we should get reminders again this year
-        # But currently it WILL be empty due to the bug
         self.assertEqual(
-            len(upcoming),
-            0,
-            "This test shows the BUG - reminder flags are never reset, so no reminders are sent in subsequent years",
+            db.get_sent_reminders(0), {(1, 0, recent.year), (1, 1, recent.year)}
         )
+        columns = [
+            row[1] for row in db.get_connection().execute("PRAGMA table_info(birthdays)")
+        ]
+        self.assertNotIn("was_reminded_0_days_ago", columns)
+        self.assertEqual(len(db.list_birthdays(self.test_chat_id)), 2)
+
+    def test_legacy_reminder_flags_migration_without_drop_column(self):
+        """Test that flags which can't be dropped are cleared, so they migrate only once"""
+        recent = self.create_legacy_database()
+
+        with mock.patch.object(sqlite3, "sqlite_version_info", (3, 34, 1)):
+            db.init_db()
+            expected = {(1, 0, recent.year), (1, 1, recent.year)}
+            self.assertEqual(db.get_sent_reminders(0), expected)
+
+            # A year later the old flags would target the next occurrence
+            with db.transaction() as cursor:
+                db._migrate_reminder_flags(cursor, recent + timedelta(days=365))
+            self.assertEqual(db.get_sent_reminders(0), expected)
 
-    def test_get_upcoming_birthdays_respects_reminder_flags(self):
-        """Test that get_upcoming_birthdays properly filters based on reminder flags"""
+        flagged = db.get_connection().execute(
+            "SELECT COUNT(*) FROM birthdays WHERE was_reminded_0_days_ago = TRUE"
+        )
+        self.assertEqual(flagged.fetchone()[0], 0)
+
+    def test_due_reminders_respect_reminder_flags(self):
+        """Test that the scheduler skips birthdays whose reminder was already sent"""
         today = datetime.now()
 
         # Create two identical birthdays
@@ -608,19 +2271,15 @@ class TestBirthdayReminderLogic(unittest.TestCase):
         db.register_birthday(self.test_chat_id, "Person 2", test_birthday, True)
 
         # Mark reminder as sent for only the first person
-        db.mark_birthday_reminder_sent(1, 0)
-
-        # Get upcoming birthdays
-        upcoming = db.get_upcoming_birthdays(0)
+        db.mark_birthday_reminders_sent([(1, 0, today.year)])
 
         # Should only return the second person
-        self.assertEqual(len(upcoming), 1)
-        self.assertEqual(upcoming[0][2], "Person 2")  # Name is at index 2
+        self.assertEqual([event.name for event in self.due_reminders_today()], ["Person 2"])
 
     def test_reminder_field_naming_consistency(self):
         """Test that the reminder field naming is consistent between functions"""
-        # This test ensures that the field names used in mark_birthday_reminder_sent
-        # match those used in get_upcoming_birthdays
+        # This test ensures that the offsets written by mark_birthday_reminders_sent
+        # match those read back by get_sent_reminders, which the scheduler uses
 
         test_birthday = datetime(1990, 5, 15)
         db.register_birthday(self.test_chat_id, "Test Person", test_birthday, True)
@@ -630,22 +2289,329 @@ class TestBirthdayReminderLogic(unittest.TestCase):
         # Test each reminder day
         for days in [0, 1, 3, 7]:
             # Mark reminder as sent
-            db.mark_birthday_reminder_sent(birthday_id, days)
+            target_year = (datetime.now() + timedelta(days=days)).year
+            db.mark_birthday_reminders_sent([(birthday_id, days, target_year)])
+
+            # Verify the ledger entry was written for the matching occurrence
+            self.assertIn(
+                (birthday_id, days, target_year),
+                db.get_sent_reminders(target_year, self.test_chat_id),
+                f"{days}-day reminder should be recorded after marking it as sent",
+            )
 
-            # Verify the field was set correctly by checking the database directly
-            conn = sqlite3.connect(db.DB_FILE)
-            cursor = conn.cursor()
-            field_name = f"was_reminded_{days}_days_ago"
-            cursor.execute(
-                f"SELECT {field_name} FROM birthdays WHERE id = ?", (birthday_id,)
+
+class TestRenderCache(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_render_cache.db"
+        db.init_db()
+        i18n.i18n.clear_language_cache()
+        self.bot = import_bot()
+        self.bot.clear_render_cache()
+        self.test_chat_id = 123456789
+        db.register_birthday(self.test_chat_id, "Alice", datetime(1990, 5, 15), True)
+
+    def tearDown(self):
+        self.bot.clear_render_cache()
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def render_twice(self) -> int:
+        """Render the chat's list twice and return how often the birthdays were read."""
+        with mock.patch.object(db, "list_birthdays", wraps=db.list_birthdays) as list_birthdays:
+            first = self.bot.get_birthday_list_chunks(self.test_chat_id)
+            self.assertEqual(self.bot.get_birthday_list_chunks(self.test_chat_id), first)
+        return list_birthdays.call_count
+
+    def test_hit_skips_the_database(self):
+        self.assertEqual(self.render_twice(), 1)
+        self.assertEqual(self.render_twice(), 0)
+
+        with mock.patch.object(
+            db, "list_birthdays_page", wraps=db.list_birthdays_page
+        ) as list_birthdays_page:
+            kind = self.bot.TBirthdayListKind.Backup
+            first = self.bot.render_birthdays_page(self.test_chat_id, kind)
+            self.assertIs(self.bot.render_birthdays_page(self.test_chat_id, kind), first)
+        self.assertEqual(list_birthdays_page.call_count, 1)
+
+    def test_writes_invalidate(self):
+        self.render_twice()
+
+        birthday_id = db.register_birthday(self.test_chat_id, "Bob", datetime(1991, 7, 1), True)
+        self.assertEqual(self.render_twice(), 1)
+        self.assertIn("Bob", "".join(self.bot.get_birthday_list_chunks(self.test_chat_id)))
+
+        db.register_birthdays(self.test_chat_id, [("Carol", datetime(1992, 8, 1), True)])
+        self.assertEqual(self.render_twice(), 1)
+
+        db.delete_birthday(self.test_chat_id, birthday_id)
+        self.assertEqual(self.render_twice(), 1)
+        self.assertNotIn("Bob", "".join(self.bot.get_birthday_list_chunks(self.test_chat_id)))
+
+        # Other chats' writes don't
+        db.register_birthday(42, "Other Chat", datetime(1990, 1, 1), True)
+        self.assertEqual(self.render_twice(), 0)
+
+    def test_keyed_on_language_and_date(self):
+        english = self.bot.get_birthday_list_chunks(self.test_chat_id)
+
+        i18n.set_user_language(self.test_chat_id, "ru")
+        self.assertEqual(self.render_twice(), 1)
+        self.assertNotEqual(self.bot.get_birthday_list_chunks(self.test_chat_id), english)
+
+        class MockDate(date):
+            @classmethod
+            def today(cls):
+                return date.today() + timedelta(days=1)
+
+        with mock.patch.object(self.bot, "date", MockDate):
+            self.assertEqual(self.render_twice(), 1)
+
+    def test_bounded_by_rendered_size(self):
+        chunk_size = self.bot.get_render_size(self.bot.get_birthday_list_chunks(self.test_chat_id))
+        self.bot.clear_render_cache()
+        chat_ids = range(self.test_chat_id, self.test_chat_id + 5)
+        for chat_id in chat_ids[1:]:
+            db.register_birthday(chat_id, "Alice", datetime(1990, 5, 15), True)
+
+        with mock.patch.object(self.bot, "RENDER_CACHE_MAX_SIZE", 3 * chunk_size):
+            for chat_id in chat_ids:
+                self.bot.get_birthday_list_chunks(chat_id)
+            self.assertLessEqual(self.bot._render_cache_size, 3 * chunk_size)
+            self.assertEqual(
+                [key[1] for key in self.bot._render_cache], list(chat_ids[-3:])
             )
-            result = cursor.fetchone()
-            conn.close()
 
-            self.assertTrue(
-                result[0],
-                f"Field {field_name} should be True after marking reminder as sent",
+
+class FakeOutbound:
+    """Records messages like delivery.TOutboundQueue, each delivered at once."""
+
+    def __init__(self):
+        self.sent = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+        future = Future()
+        future.set_result(None)
+        return future
+
+
+class TestReminderDelivery(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_reminder_delivery.db"
+        db.init_db()
+        i18n.i18n.clear_language_cache()
+        self.bot = import_bot()
+        self.outbound = FakeOutbound()
+        patcher = mock.patch.object(self.bot, "outbound", self.outbound)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def make_event(self, chat_id, birthday_id, days_until, name="Alice"):
+        occurrence = date.today() + timedelta(days=days_until)
+        return scheduler.TReminderEvent(
+            fire_at=datetime.now(),
+            chat_id=chat_id,
+            birthday_id=birthday_id,
+            days_until=days_until,
+            name=name,
+            birthday=occurrence.replace(year=1990),
+            has_year=True,
+            occurrence=occurrence,
+        )
+
+    def test_offsets_of_a_chat_become_one_digest(self):
+        events = [self.make_event(1, 10, 7), self.make_event(1, 11, 0), self.make_event(2, 12, 3)]
+        with mock.patch.object(self.bot, "on_birthday_reminders_delivered") as delivered:
+            self.bot.send_birthday_reminders(events)
+
+        today, in_a_week, other_chat = events[1], events[0], events[2]
+        self.assertEqual(
+            self.outbound.sent,
+            [
+                (
+                    1,
+                    "\n".join([
+                        i18n.get_message("reminder_digest_title", 1),
+                        self.bot.format_birthday_reminder(today),
+                        self.bot.format_birthday_reminder(in_a_week),
+                    ]),
+                ),
+                # A single reminder has no title, and no separate "🎂" message
+                (2, self.bot.format_birthday_reminder(other_chat)),
+            ],
+        )
+        # Called once for the whole tick
+        delivered.assert_called_once()
+        events_by_chat, futures_by_chat = delivered.call_args.args
+        self.assertEqual(set(events_by_chat), {1, 2})
+        self.assertEqual([len(futures) for futures in futures_by_chat.values()], [1, 1])
+
+    def test_long_digest_is_split(self):
+        events = [self.make_event(1, i, 1, name=f"Person {i} " + "x" * 80) for i in range(100)]
+        with mock.patch.object(self.bot, "on_birthday_reminders_delivered"):
+            self.bot.send_birthday_reminders(events)
+
+        events.sort(key=lambda event: event.name)
+        digest = "\n".join(
+            [i18n.get_message("reminder_digest_title", 1)]
+            + [self.bot.format_birthday_reminder(event) for event in events]
+        )
+        chunks = [text for _, text in self.outbound.sent]
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(chunks, utils.split_message(digest))
+
+    def test_delivered_reminders_are_marked_once_and_failures_retried(self):
+        birthday_ids = [
+            db.register_birthday(chat_id, f"Person {chat_id}", datetime(1990, 6, 1), True)
+            for chat_id in (1, 2, 3)
+        ]
+        events_by_chat = {
+            chat_id: [self.make_event(chat_id, birthday_id, 0)]
+            for chat_id, birthday_id in zip((1, 2, 3), birthday_ids)
+        }
+        futures_by_chat = {chat_id: [Future()] for chat_id in events_by_chat}
+        futures_by_chat[1][0].set_result(None)
+        futures_by_chat[2][0].set_exception(
+            FakeApiTelegramException({"error_code": 403, "description": "Forbidden"})
+        )
+        futures_by_chat[3][0].set_exception(ConnectionError("Connection reset"))
+
+        with mock.patch.object(
+            db, "mark_birthday_reminders_sent", wraps=db.mark_birthday_reminders_sent
+        ) as mark_sent, mock.patch.object(
+            self.bot.reminder_scheduler, "retry_later"
+        ) as retry_later:
+            self.bot.on_birthday_reminders_delivered(events_by_chat, futures_by_chat)
+
+        # One transaction for the tick, also covering the chat that blocked the bot
+        mark_sent.assert_called_once()
+        year = date.today().year
+        self.assertEqual(
+            db.get_sent_reminders(year),
+            {(birthday_ids[0], 0, year), (birthday_ids[1], 0, year)},
+        )
+        retry_later.assert_called_once_with(events_by_chat[3][0])
+
+
+class FakeDownload:
+    """A streamed requests.Response of a file sent to the bot."""
+
+    def __init__(self, content: bytes):
+        self.raw = io.BytesIO(content)
+
+    def raise_for_status(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class TestDocumentImport(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_document_import.db"
+        db.init_db()
+        i18n.i18n.clear_language_cache()
+        self.bot = import_bot()
+        self.test_chat_id = 123456789
+        self.telegram = mock.patch.multiple(
+            self.bot.bot,
+            send_message=mock.DEFAULT,
+            edit_message_text=mock.DEFAULT,
+            delete_message=mock.DEFAULT,
+            get_file=mock.DEFAULT,
+        ).start()
+        self.addCleanup(mock.patch.stopall)
+        self.telegram["send_message"].return_value = SimpleNamespace(message_id=100)
+        self.telegram["get_file"].return_value = SimpleNamespace(file_path="documents/file_1.csv")
+        self.add_birthday = mock.patch.object(self.bot.reminder_scheduler, "add_birthday").start()
+
+    def tearDown(self):
+        self.bot.user_states.pop(self.test_chat_id, None)
+        self.bot.birthday_registration_messages.pop(self.test_chat_id, None)
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
+
+    def send_document(self, content: bytes, chat_type: str = "private"):
+        message = SimpleNamespace(
+            chat=SimpleNamespace(id=self.test_chat_id, type=chat_type),
+            document=SimpleNamespace(
+                file_id="file_1", file_name="birthdays.csv", mime_type="text/csv", file_size=len(content)
+            ),
+        )
+        with mock.patch.object(
+            self.bot.requests, "get", return_value=FakeDownload(content)
+        ) as download:
+            self.bot.handle_document(message)
+        return download
+
+    def test_import_edits_one_status_message(self):
+        rows = [f"Person {i},{1950 + i % 50}-{i % 12 + 1:02d}-{i % 28 + 1:02d}" for i in range(1200)]
+        rows.insert(700, "Bad Entry,someday")
+        content = "\n".join(["name,birthday", *rows]).encode("utf-8")
+        self.bot.user_states[self.test_chat_id] = self.bot.TUserState.AwaitingBirthday
+        self.bot.birthday_registration_messages[self.test_chat_id] = [99]
+
+        edit = self.telegram["edit_message_text"]
+        # A failed progress update doesn't stop the import
+        edit.side_effect = [
+            self.bot.telebot.apihelper.ApiTelegramException(
+                "editMessageText", None, {"error_code": 429, "description": "Too Many Requests"}
             )
+        ] + [None] * 10
+        with mock.patch.object(self.bot, "IMPORT_PROGRESS_INTERVAL_SECONDS", 0):
+            download = self.send_document(content)
+
+        self.assertIn("documents/file_1.csv", download.call_args.args[0])
+        self.telegram["send_message"].assert_called_once()
+        # A progress update per batch of IMPORT_BATCH_SIZE, then the report
+        self.assertEqual(edit.call_count, 4)
+        self.assertTrue(all(call.kwargs["message_id"] == 100 for call in edit.call_args_list))
+        report = edit.call_args.args[0]
+        self.assertTrue(report.startswith(
+            i18n.get_message("import_finished", self.test_chat_id, imported=1200, errors=1)
+        ))
+        self.assertIn("Bad Entry", report)
+
+        records = db.list_birthdays(self.test_chat_id)
+        self.assertEqual(len(records), 1200)
+        self.assertCountEqual(
+            [call.args[0] for call in self.add_birthday.call_args_list],
+            [record.id for record in records],
+        )
+        self.assertEqual(self.bot.user_states.get(self.test_chat_id), self.bot.TUserState.Default)
+        self.telegram["delete_message"].assert_called_once_with(self.test_chat_id, 99)
+
+    def test_files_are_only_imported_when_asked_for(self):
+        content = b"name,birthday\nAlice,1990-05-15\n"
+        download = self.send_document(content)
+        self.telegram["send_message"].assert_called_once_with(
+            self.test_chat_id, i18n.get_message("import_not_requested", self.test_chat_id)
+        )
+
+        self.telegram["send_message"].reset_mock()
+        self.send_document(content, chat_type="group")
+        self.telegram["send_message"].assert_not_called()
+
+        download.assert_not_called()
+        self.telegram["get_file"].assert_not_called()
+        self.assertEqual(db.list_birthdays(self.test_chat_id), [])
 
 
 class TestInternationalization(unittest.TestCase):
@@ -653,9 +2619,11 @@ class TestInternationalization(unittest.TestCase):
         self.original_db_file = db.DB_FILE
         db.DB_FILE = "test_i18n.db"
         db.init_db()
+        i18n.i18n.clear_language_cache()
         self.test_chat_id = 123456789
 
     def tearDown(self):
+        db.close_connections()
         if os.path.exists(db.DB_FILE):
             os.remove(db.DB_FILE)
         db.DB_FILE = self.original_db_file
@@ -801,27 +2769,19 @@ class TestInternationalization(unittest.TestCase):
         self.assertIn("Welcome", welcome)
 
     def test_bot_functions_integration(self):
-        pass
         """Test that bot functions work with i18n"""
-        # This test ensures all functions used in bot.py exist
-        try:
-            # Test functions that caused the error
-            from bot import (get_button_to_command_mapping,
-                             get_command_descriptions)
-
-            # These should not raise AttributeError
-            descriptions = get_command_descriptions(self.test_chat_id)
-            self.assertIsInstance(descriptions, dict)
-            self.assertGreater(len(descriptions), 0)
-
-            mappings = get_button_to_command_mapping(self.test_chat_id)
-            self.assertIsInstance(mappings, dict)
-            self.assertGreater(len(mappings), 0)
-
-        except ImportError:
-            # Bot module might not be importable in test environment
-            # Just test the i18n functions directly
-            pass
+        bot = import_bot()
+
+        descriptions = bot.get_command_descriptions(self.test_chat_id)
+        self.assertIsInstance(descriptions, dict)
+        self.assertGreater(len(descriptions), 0)
+
+        # Every button, in every language, is routed to its command
+        for button_key, command in bot.BUTTON_COMMAND_MAPPINGS.items():
+            for language in i18n.i18n.supported_languages:
+                text = i18n.i18n.translations["buttons"][button_key][language]
+                self.assertEqual(bot.get_button_command(text), command)
+        self.assertIsNone(bot.get_button_command("John Doe"))
 
     def test_newline_formatting(self):
         """Test that newlines in translations are properly formatted"""
@@ -949,328 +2909,272 @@ class TestInternationalization(unittest.TestCase):
         # Test incomplete input in English (default)
         i18n.set_user_language(self.test_chat_id, "en")
         message_incomplete = "John Doe"
-        success, error_message = validate_birthday_input(
-            message_incomplete, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message = errors[0][2]
         self.assertIn("incomplete", error_message.lower())
 
         # Test Russian translation
         i18n.set_user_language(self.test_chat_id, "ru")
-        success, error_message_ru = validate_birthday_input(
-            message_incomplete, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("неполный", error_message_ru.lower())
 
         # Test future date error in Russian
         future_message = "John Doe\n1.1.2050"
-        success, error_message_ru = validate_birthday_input(
-            future_message, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(future_message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("будущем", error_message_ru.lower())
 
         # Test date parse error in Russian
         invalid_message = "John Doe\n32.13.2000"
-        success, error_message_ru = validate_birthday_input(
-            invalid_message, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(invalid_message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("разобрать", error_message_ru.lower())
 
         # Test backward compatibility (no chat_id)
         i18n.set_user_language(self.test_chat_id, "en")
-        success, error_message_en = validate_birthday_input(message_incomplete)
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete)
+        self.assertEqual(len(errors), 1)
+        error_message_en = errors[0][2]
         self.assertIn("incomplete", error_message_en.lower())
 
     def test_utils_translations(self):
         """Test that utils functions use correct translations"""
-        from utils import validate_birthday_input
-
         # Test incomplete input in English (default)
         message_incomplete = "John Doe"
-        success, error_message = validate_birthday_input(
-            message_incomplete, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message = errors[0][2]
         self.assertIn("incomplete", error_message.lower())
 
         # Test Russian translation
         i18n.set_user_language(self.test_chat_id, "ru")
-        success, error_message_ru = validate_birthday_input(
-            message_incomplete, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("неполный", error_message_ru.lower())
 
         # Test future date error in Russian
         future_message = "John Doe\n1.1.2050"
-        success, error_message_ru = validate_birthday_input(
-            future_message, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(future_message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("будущем", error_message_ru.lower())
 
         # Test date parse error in Russian
         invalid_message = "John Doe\n32.13.2000"
-        success, error_message_ru = validate_birthday_input(
-            invalid_message, self.test_chat_id
-        )
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(invalid_message, self.test_chat_id)
+        self.assertEqual(len(errors), 1)
+        error_message_ru = errors[0][2]
         self.assertIn("разобрать", error_message_ru.lower())
 
         # Test backward compatibility (no chat_id)
-        success, error_message_en = validate_birthday_input(message_incomplete)
-        self.assertFalse(success)
+        _, errors = parse_birthday_input(message_incomplete)
+        self.assertEqual(len(errors), 1)
+        error_message_en = errors[0][2]
         self.assertIn("incomplete", error_message_en.lower())
 
 
-class TestComputeAgeMetrics(unittest.TestCase):
-    def test_compute_age_with_past_birthday(self):
-        """Test age computation for birthdays that already happened this year"""
-        today = datetime.now()
-        current_year = today.year
-
-        # Birthday already passed this year (should be current_year - birth_year)
-        past_date = today - timedelta(days=30)
-        past_birthday = (
-            f"{past_date.day} {past_date.strftime('%B')} {current_year - 25}"
-        )
-
-        birthdays = [f"{past_birthday}, Test Person"]
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
-
-        self.assertIsNotNone(avg)
-        self.assertIsNotNone(min_val)
-        self.assertIsNotNone(max_val)
-        self.assertIsNotNone(median)
-        self.assertEqual(avg, 25)
-        self.assertEqual(min_val, 25)
-        self.assertEqual(max_val, 25)
-        self.assertEqual(median, 25.0)
-
-    def test_compute_age_with_future_birthday(self):
-        """Test age computation for birthdays that haven't happened yet this year"""
-        today = datetime.now()
-        current_year = today.year
-
-        # Birthday hasn't happened yet this year (should be current_year - birth_year - 1)
-        future_date = today + timedelta(days=30)
-        future_birthday = (
-            f"{future_date.day} {future_date.strftime('%B')} {current_year - 30}"
-        )
+class TestLanguageCache(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_language_cache.db"
+        db.init_db()
+        self.test_chat_id = 123456789
+        self.i18n = i18n.I18n(language_cache_size=2)
 
-        birthdays = [f"{future_birthday}, Test Person"]
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
 
-        self.assertIsNotNone(avg)
-        self.assertIsNotNone(min_val)
-        self.assertIsNotNone(max_val)
-        self.assertIsNotNone(median)
-        # They haven't had their birthday yet, so they're still 29
-        self.assertEqual(avg, 29)
-        self.assertEqual(min_val, 29)
-        self.assertEqual(max_val, 29)
-        self.assertEqual(median, 29.0)
+    def test_start_reads_language_once(self):
+        with mock.patch.object(
+            db, "get_user_language", wraps=db.get_user_language
+        ) as get_user_language:
+            for button in ["start", "backup", "register_birthday", "stats"]:
+                self.i18n.get_button_text(button, self.test_chat_id)
+                self.i18n.get_button_description(button, self.test_chat_id)
+            self.i18n.get_message("welcome_title", self.test_chat_id)
+
+        self.assertEqual(get_user_language.call_count, 1)
+        self.assertEqual(self.i18n.get_cache_stats(), {"size": 1, "hits": 8, "misses": 1})
+
+    def test_set_user_language_writes_through(self):
+        self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "en")
+
+        self.i18n.set_user_language(self.test_chat_id, "ru")
+        with mock.patch.object(db, "get_user_language") as get_user_language:
+            self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "ru")
+        get_user_language.assert_not_called()
+        self.assertEqual(db.get_user_language(self.test_chat_id), "ru")
+
+    def test_read_racing_a_change_is_not_cached(self):
+        read_language = db.get_user_language
+
+        def get_user_language(chat_id):
+            # The user switches language while the old one is being read
+            language = read_language(chat_id)
+            self.i18n.set_user_language(chat_id, "ru")
+            return language
+
+        with mock.patch.object(db, "get_user_language", side_effect=get_user_language):
+            self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "en")
+        self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "ru")
+
+    def test_failed_change_is_not_cached(self):
+        self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "en")
+
+        with mock.patch.object(
+            db, "set_user_language", side_effect=sqlite3.OperationalError("disk I/O error")
+        ):
+            self.assertFalse(self.i18n.set_user_language(self.test_chat_id, "ru"))
+        self.assertEqual(self.i18n.get_user_language(self.test_chat_id), "en")
+
+    def test_lru_eviction(self):
+        self.i18n.get_user_language(1)
+        self.i18n.get_user_language(2)
+        self.i18n.get_user_language(1)  # 2 is now least recently used
+        self.i18n.get_user_language(3)
+
+        self.assertEqual(self.i18n.get_cache_stats()["size"], 2)
+        with mock.patch.object(
+            db, "get_user_language", wraps=db.get_user_language
+        ) as get_user_language:
+            self.i18n.get_user_language(1)
+            self.i18n.get_user_language(2)
+        self.assertEqual(get_user_language.call_count, 1)
+
+
+class TestButtonIndex(unittest.TestCase):
+    def test_index_covers_all_languages(self):
+        with mock.patch.object(db, "get_user_language") as get_user_language:
+            self.assertEqual(i18n.get_button_key("🚀 Start"), "start")
+            self.assertEqual(i18n.get_button_key("🚀 Начать"), "start")
+            self.assertEqual(i18n.get_button_key("📊 Статистика"), "stats")
+            self.assertIsNone(i18n.get_button_key("John Doe"))
+        get_user_language.assert_not_called()
+
+    def test_index_rebuilt_on_reload(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            translations_file = os.path.join(tmp_dir, "translations.json")
+            translations = {"buttons": {"start": {"en": "Go", "ru": "Вперёд"}}}
+            with open(translations_file, "w", encoding="utf-8") as f:
+                json.dump(translations, f)
+
+            instance = i18n.I18n(translations_file)
+            self.assertEqual(instance.get_button_key("Go"), "start")
+
+            translations["buttons"]["start"]["en"] = "Begin"
+            with open(translations_file, "w", encoding="utf-8") as f:
+                json.dump(translations, f)
+            instance.load_translations()
+
+            self.assertIsNone(instance.get_button_key("Go"))
+            self.assertEqual(instance.get_button_key("Begin"), "start")
+            self.assertEqual(instance.get_button_key("Вперёд"), "start")
+
+
+class TestBirthdayStats(unittest.TestCase):
+    def setUp(self):
+        self.original_db_file = db.DB_FILE
+        db.DB_FILE = "test_stats.db"
+        db.init_db()
+        stats.clear_global_stats_cache()
+        self.test_chat_id = 123456789
+        self.other_chat_id = 987654321
 
-    def test_compute_age_with_mixed_birthdays(self):
-        """Test age computation with multiple birthdays"""
         today = datetime.now()
-        current_year = today.year
-
-        past_date = today - timedelta(days=30)
-        past_birthday = (
-            f"{past_date.day} {past_date.strftime('%B')} {current_year - 25}"
-        )
-
-        future_date = today + timedelta(days=30)
-        future_birthday = (
-            f"{future_date.day} {future_date.strftime('%B')} {current_year - 30}"
-        )
-
         birthdays = [
-            f"{past_birthday}, Person 1",
-            f"{future_birthday}, Person 2",
+            (self.test_chat_id, "Today", datetime(1990, today.month, today.day), True),
+            (self.test_chat_id, "January", datetime(1985, 1, 15), True),
+            (self.test_chat_id, "January Again", datetime(2000, 1, 15), True),
+            (self.test_chat_id, "No Year", datetime(2000, 1, 20), False),
+            (self.other_chat_id, "Leap", datetime(1992, 2, 29), True),
+            (self.other_chat_id, "December", datetime(1970, 12, 31), True),
         ]
+        for chat_id, name, birthday, has_year in birthdays:
+            db.register_birthday(chat_id, name, birthday, has_year)
 
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
-
-        self.assertIsNotNone(avg)
-        self.assertIsNotNone(min_val)
-        self.assertIsNotNone(max_val)
-        self.assertIsNotNone(median)
-        self.assertEqual(min_val, 25)  # Youngest person (birthday already happened)
-        self.assertEqual(max_val, 29)  # Oldest person (birthday not yet happened)
-        self.assertEqual(avg, (25 + 29) / 2)
-        self.assertEqual(median, (25 + 29) / 2.0)  # Median of [25, 29] is 27
-
-    def test_compute_age_with_invalid_formats(self):
-        """Test that invalid birthday formats are handled gracefully"""
-        invalid_birthday = "Not a date"
-        missing_year = "15 January"
-
-        birthdays = [invalid_birthday, missing_year]
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
-
-        self.assertIsNone(avg)
-        self.assertIsNone(min_val)
-        self.assertIsNone(max_val)
-        self.assertIsNone(median)
-
-    def test_compute_age_with_empty_list(self):
-        """Test that empty list returns None values"""
-        avg, min_val, max_val, median = utils.compute_age_metrics([])
-
-        self.assertIsNone(avg)
-        self.assertIsNone(min_val)
-        self.assertIsNone(max_val)
-        self.assertIsNone(median)
-
-    def test_compute_age_with_mixed_valid_invalid(self):
-        """Test that valid birthdays are processed even with invalid ones present"""
-        today = datetime.now()
-        current_year = today.year
+    def tearDown(self):
+        db.close_connections()
+        if os.path.exists(db.DB_FILE):
+            os.remove(db.DB_FILE)
+        db.DB_FILE = self.original_db_file
 
-        past_date = today - timedelta(days=30)
-        past_birthday = (
-            f"{past_date.day} {past_date.strftime('%B')} {current_year - 25}"
+    def test_local_stats(self):
+        birthday_stats = stats.compute_birthday_stats(self.test_chat_id)
+        self.assertEqual(birthday_stats.total, 4)
+        self.assertGreaterEqual(birthday_stats.this_month, 1)
+        self.assertEqual(birthday_stats.most_popular_month[0], "January")
+        self.assertEqual(birthday_stats.most_popular_date[0], "15 January")
+
+    def test_age_stats(self):
+        now = datetime(2025, 6, 10, 12, 0)
+        birthday_stats = stats.compute_birthday_stats(self.other_chat_id, now)
+        # "Leap" is 33 and "December" 54
+        self.assertEqual(tuple(birthday_stats.age_stats), (43.5, 43.5, 33, 54))
+
+    def test_leap_day_age(self):
+        birthday_stats = stats.compute_birthday_stats(
+            self.other_chat_id, now=datetime(2025, 2, 28, 12, 0)
         )
+        self.assertEqual(birthday_stats.age_counts, {33: 1, 54: 1})
 
-        birthdays = [
-            f"{past_birthday}, Person 1",
-            "Not a date",
-            "15 January",  # No year
-        ]
-
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
-
-        # Should compute metrics for the one valid birthday
-        self.assertIsNotNone(avg)
-        self.assertEqual(avg, 25)
-        self.assertEqual(min_val, 25)
-        self.assertEqual(max_val, 25)
-        self.assertEqual(median, 25.0)
-
-
-class TestFindMostPopularDate(unittest.TestCase):
-    def test_find_most_popular_date_with_single_date(self):
-        """Test finding most popular date with single occurrence"""
-        today = datetime.now()
-        current_year = today.year
-
-        birthday = f"15 January {current_year - 25}, Test Person"
-        birthdays = [birthday]
-
-        date, count = utils.find_most_popular_date(birthdays)
-
-        self.assertIsNotNone(date)
-        self.assertEqual(date, "15 January")
-        self.assertEqual(count, 1)
-
-    def test_find_most_popular_date_with_multiple_same_date(self):
-        """Test finding most popular date when multiple people share the same date"""
-        today = datetime.now()
-        current_year = today.year
-
-        birthdays = [
-            f"1 January {current_year - 25}, Person 1",
-            f"1 January {current_year - 30}, Person 2",
-            f"1 January {current_year - 20}, Person 3",
-            f"15 March {current_year - 25}, Person 4",
-        ]
-
-        date, count = utils.find_most_popular_date(birthdays)
-
-        self.assertIsNotNone(date)
-        self.assertEqual(date, "1 January")
-        self.assertEqual(count, 3)
-
-    def test_find_most_popular_date_without_year(self):
-        """Test finding most popular date with birthdays that don't have year"""
-        birthdays = [
-            "1 January, Person 1",
-            "1 January, Person 2",
-            "15 March, Person 3",
-        ]
-
-        date, count = utils.find_most_popular_date(birthdays)
-
-        self.assertIsNotNone(date)
-        self.assertEqual(date, "1 January")
-        self.assertEqual(count, 2)
-
-    def test_find_most_popular_date_with_tie(self):
-        """Test finding most popular date when there's a tie (should return one of them)"""
-        today = datetime.now()
-        current_year = today.year
-
-        birthdays = [
-            f"1 January {current_year - 25}, Person 1",
-            f"1 January {current_year - 30}, Person 2",
-            f"15 March {current_year - 25}, Person 3",
-            f"15 March {current_year - 20}, Person 4",
-        ]
-
-        date, count = utils.find_most_popular_date(birthdays)
-
-        # Should return one of the tied dates
-        self.assertIsNotNone(date)
-        self.assertIn(date, ["1 January", "15 March"])
-        self.assertEqual(count, 2)
-
-    def test_find_most_popular_date_with_empty_list(self):
-        """Test finding most popular date with empty list"""
-        date, count = utils.find_most_popular_date([])
-
-        self.assertIsNone(date)
-        self.assertEqual(count, 0)
-
-    def test_find_most_popular_date_with_invalid_formats(self):
-        """Test finding most popular date with invalid formats"""
-        birthdays = [
-            "Not a date, Person 1",
-            "Invalid format",
-        ]
-
-        date, count = utils.find_most_popular_date(birthdays)
-
-        self.assertIsNone(date)
-        self.assertEqual(count, 0)
-
-    def test_find_most_popular_date_mixed_valid_invalid(self):
-        """Test that valid dates are processed even with invalid ones"""
-        today = datetime.now()
-        current_year = today.year
-
-        birthdays = [
-            f"1 January {current_year - 25}, Person 1",
-            f"1 January {current_year - 30}, Person 2",
-            "Not a date, Person 3",
-            "Invalid format",
-        ]
-
-        date, count = utils.find_most_popular_date(birthdays)
+    def test_materialized_global_stats(self):
+        now = datetime(2025, 6, 10, 12, 0)
+        self.assertEqual(stats.get_global_stats(now), stats.compute_birthday_stats(None, now))
 
-        self.assertIsNotNone(date)
-        self.assertEqual(date, "1 January")
-        self.assertEqual(count, 2)
-
-    def test_compute_age_metrics_with_leap_year_birthday(self):
-        """Test that compute_age_metrics handles Feb 29 birthdays correctly"""
-        # Use a leap year for the birthday
-        birthday = "29 February 2020, Leap Year Person"
-        birthdays = [birthday]
+        # Triggers follow inserts, updates and deletes
+        db.register_birthday(self.other_chat_id, "New", datetime(1970, 12, 31), True)
+        db.delete_birthday(self.test_chat_id, 2)
+        with db.transaction() as cursor:
+            cursor.execute(
+                "UPDATE birthdays SET birthday = '1991-03-03', month_day = '03-03', "
+                "has_year = TRUE WHERE id = 4"
+            )
+        self.assertEqual(stats.get_global_stats(now), stats.compute_birthday_stats(None, now))
+        self.assertEqual(db.check_stats(), [])
+
+    def test_users_counter(self):
+        self.assertEqual(db.count_users(), 0)
+        db.update_reminder_settings(self.test_chat_id, [0])
+        db.update_reminder_settings(self.test_chat_id, [0, 1])
+        db.update_reminder_settings(self.other_chat_id, [7])
+        self.assertEqual(db.count_users(), 2)
+
+    def test_check_and_rebuild_stats(self):
+        with db.transaction() as cursor:
+            cursor.execute("UPDATE birthday_stats SET count = 99 WHERE month_day = '01-15'")
+            cursor.execute("UPDATE stats_counters SET value = 5 WHERE name = 'users'")
+        self.assertEqual(len(db.check_stats()), 3)
+
+        version = db.get_stats_version()
+        db.rebuild_stats()
+        self.assertEqual(db.check_stats(), [])
+        self.assertNotEqual(db.get_stats_version(), version)
+
+    def test_stats_built_for_existing_database(self):
+        with db.transaction() as cursor:
+            cursor.execute("DELETE FROM birthday_stats")
+            cursor.execute("DELETE FROM stats_counters")
 
-        # This should not raise ValueError even if current year is not a leap year
-        avg, min_val, max_val, median = utils.compute_age_metrics(birthdays)
+        db.init_db()
+        self.assertEqual(db.check_stats(), [])
+        self.assertEqual(stats.get_global_stats().total, 6)
 
-        # Should compute metrics successfully
-        self.assertIsNotNone(avg)
-        self.assertIsNotNone(min_val)
-        self.assertIsNotNone(max_val)
-        self.assertIsNotNone(median)
+    def test_compute_age_stats(self):
+        self.assertIsNone(stats.compute_age_stats({}))
+        self.assertEqual(stats.compute_age_stats({30: 1}), (30.0, 30.0, 30, 30))
+        self.assertEqual(
+            stats.compute_age_stats({20: 1, 30: 2, 40: 1}), (30.0, 30.0, 20, 40)
+        )
+        self.assertEqual(stats.compute_age_stats({20: 1, 40: 1}), (30.0, 30.0, 20, 40))
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ import logging
 import os
 import re
 from datetime import datetime, timedelta
-from typing import List, Union
+from typing import Iterable, Iterator, List, Union
 
 
 # Delayed import to avoid circular dependencies
@@ -85,7 +85,29 @@ def get_time(timestamp_str: str) -> Union[TDuration, None]:
     return None
 
 
-def validate_birthday_input(message: str, chat_id: int = None) -> tuple[bool, str]:
+# (name, date, has_year) of a birthday parsed from user input, ready to register
+TParsedBirthday = tuple[str, datetime, bool]
+# (line number, date as typed, localized message) for a date that can't be used
+TBirthdayInputError = tuple[int, str, str]
+
+
+def parse_birthday_input(
+    message: str, chat_id: int = None
+) -> tuple[list[TParsedBirthday], list[TBirthdayInputError]]:
+    """
+    Parse pairs of a name line followed by a date line, parsing each date once.
+
+    Every bad date is reported, not just the first one, so a long list can be
+    fixed in one go.
+
+    Args:
+        message: Text of the message, alternating name and date lines
+        chat_id: Chat to localize the error messages for, English if None
+
+    Returns:
+        The (name, date, has_year) of each pair and the errors found. Input with
+        an odd number of lines gives a single error with line number 0.
+    """
     lines = message.strip().split("\n")
     if len(lines) % 2 != 0:
         if chat_id is not None:
@@ -96,49 +118,77 @@ def validate_birthday_input(message: str, chat_id: int = None) -> tuple[bool, st
                 "It seems like your input is incomplete. "
                 "Please ensure each name is followed by a date on a new line."
             )
-        return False, error_msg
+        return [], [(0, "", error_msg)]
 
+    birthdays = []
+    errors = []
     for i in range(0, len(lines), 2):
-        _ = lines[i].strip()  # name
+        name = lines[i].strip()
         date_str = lines[i + 1].strip()
 
         success, parsed_date, has_year = parse_date(date_str)
-        if not success:
-            parts = date_str.split(".")
-            if len(parts) == 3:
-                try:
-                    day, month, year = map(int, parts)
-                    if year > datetime.now().year:
-                        if chat_id is not None:
-                            i18n = get_i18n()
-                            error_msg = i18n.get_message(
-                                "birthday_in_future", chat_id, date=date_str
-                            )
-                        else:
-                            error_msg = (
-                                f"Birthday '{date_str}' cannot be in the future. "
-                                "Please provide a valid past date."
-                            )
-                        return False, error_msg
-                except Exception:
-                    pass
-            if chat_id is not None:
-                i18n = get_i18n()
-                error_msg = i18n.get_message(
-                    "date_parse_error", chat_id, date=date_str, line=i + 2
-                )
-            else:
-                error_msg = (
-                    f"I couldn't parse the date '{date_str}' on line {i + 2}. "
-                    "Please use one of the following formats:\n"
-                    "- day.month.year (e.g., 5.06.2001)\n"
-                    "- day.month (e.g., 5.06)\n"
-                    "- day.month age (e.g., 5.06 19)\n"
-                    "Ensure the date is valid and within the last 200 years."
+        if success:
+            birthdays.append((name, parsed_date, has_year))
+        else:
+            errors.append((i + 2, date_str, _date_error_message(date_str, i + 2, chat_id)))
+
+    return birthdays, errors
+
+
+def _date_error_message(date_str: str, line: int, chat_id: int = None) -> str:
+    parts = date_str.split(".")
+    if len(parts) == 3:
+        try:
+            day, month, year = map(int, parts)
+            if year > datetime.now().year:
+                if chat_id is not None:
+                    i18n = get_i18n()
+                    return i18n.get_message("birthday_in_future", chat_id, date=date_str)
+                return (
+                    f"Birthday '{date_str}' cannot be in the future. "
+                    "Please provide a valid past date."
                 )
-            return False, error_msg
+        except Exception:
+            pass
+    if chat_id is not None:
+        i18n = get_i18n()
+        return i18n.get_message("date_parse_error", chat_id, date=date_str, line=line)
+    return (
+        f"I couldn't parse the date '{date_str}' on line {line}. "
+        "Please use one of the following formats:\n"
+        "- day.month.year (e.g., 5.06.2001)\n"
+        "- day.month (e.g., 5.06)\n"
+        "- day.month age (e.g., 5.06 19)\n"
+        "Ensure the date is valid and within the last 200 years."
+    )
+
+
+def format_birthday_input_errors(
+    errors: list[TBirthdayInputError], chat_id: int = None
+) -> str:
+    """
+    Describe all errors of parse_birthday_input in one message.
 
-    return True, ""
+    A single error keeps its full message; several are listed by line, with
+    the accepted formats explained once.
+    """
+    if len(errors) == 1:
+        return errors[0][2]
+
+    lines = "\n".join(f"- {line}: '{date_str}'" for line, date_str, _ in errors)
+    if chat_id is not None:
+        i18n = get_i18n()
+        return i18n.get_message(
+            "date_parse_errors", chat_id, count=len(errors), lines=lines
+        )
+    return (
+        f"I couldn't parse {len(errors)} dates (line: date):\n{lines}\n"
+        "Please use one of the following formats:\n"
+        "- day.month.year (e.g., 5.06.2001)\n"
+        "- day.month (e.g., 5.06)\n"
+        "- day.month age (e.g., 5.06 19)\n"
+        "Ensure the date is valid, not in the future and within the last 200 years."
+    )
 
 
 def parse_date(date_str: str) -> tuple[bool, datetime | None, bool]:
@@ -199,23 +249,6 @@ def parse_date(date_str: str) -> tuple[bool, datetime | None, bool]:
         return False, None, False
 
 
-def parse_dates(message: str) -> tuple[bool, list[tuple[str, datetime, bool]]]:
-    lines = message.strip().split("\n")
-    if len(lines) % 2 != 0:
-        return False, []
-
-    parsed_birthdays = []
-    for i in range(0, len(lines), 2):
-        name = lines[i].strip()
-        date_str = lines[i + 1].strip()
-        success, parsed_date, has_year = parse_date(date_str)
-        if not success:
-            return False, []
-        parsed_birthdays.append((name, parsed_date, has_year))
-
-    return True, parsed_birthdays
-
-
 def log_exception(exc: Exception):
     """
     Helper function to log exception details with full traceback.
@@ -243,136 +276,44 @@ def cleanup_old_logs(log_dir=".", max_days=30):
                     logging.error(f"Failed to delete old log file {filename}: {e}")
 
 
-def compute_age_metrics(
-    birthday_strings: list[str],
-) -> tuple[float | None, int | None, int | None, float | None]:
-    """
-    Compute age statistics from birthday strings.
-
-    Args:
-        birthday_strings: List of birthday strings in format "DD Month YYYY, Name"
-
-    Returns:
-        Tuple of (average_age, min_age, max_age, median_age) or (None, None, None, None) if no valid birthdays
-    """
-    ages = []
-    now = datetime.now()
-    current_year = now.year
-
-    for birthday in birthday_strings:
-        if not birthday or not isinstance(birthday, str):
-            continue
-        try:
-            # Extract the date part safely
-            parts = birthday.split(",", 1)
-            if not parts:
-                continue
-            date_str = parts[0].strip()
-
-            # Will work only if the date contains a full year
-            date_dt = datetime.strptime(date_str, "%d %B %Y")
-
-            # Compute age and adjust if birthday hasn't taken place yet this year
-            # Handle leap year edge case (Feb 29 -> non-leap year)
-            try:
-                birthday_this_year = date_dt.replace(year=current_year)
-            except ValueError:
-                # This happens when date is Feb 29 and current_year is not a leap year
-                # Use Feb 28 of current year instead
-                if date_dt.month == 2 and date_dt.day == 29:
-                    birthday_this_year = datetime(current_year, 2, 28)
-                else:
-                    raise
-
-            age = current_year - date_dt.year
-            if now < birthday_this_year:
-                age -= 1
-            ages.append(age)
-        except (ValueError, IndexError):
-            continue  # Skip birthdays with errors
-
-    if ages:
-        sorted_ages = sorted(ages)
-        avg_age = sum(ages) / len(ages)
-        min_age = min(ages)
-        max_age = max(ages)
-
-        # Calculate median
-        n = len(sorted_ages)
-        if n % 2 == 0:
-            # If even number of ages, median is average of two middle values
-            median_age = (sorted_ages[n // 2 - 1] + sorted_ages[n // 2]) / 2.0
-        else:
-            # If odd number of ages, median is the middle value
-            median_age = float(sorted_ages[n // 2])
-
-        return avg_age, min_age, max_age, median_age
-    return None, None, None, None
+# Telegram's limit for the text of one message
+MAX_MESSAGE_LENGTH = 4096
 
 
-def find_most_popular_date(birthday_strings: list[str]) -> tuple[str | None, int]:
+def split_lines(
+    lines: Iterable[str], max_length: int = MAX_MESSAGE_LENGTH
+) -> Iterator[str]:
     """
-    Find the most popular date (day + month) from birthday strings.
-
-    Args:
-        birthday_strings: List of birthday strings in format "DD Month YYYY, Name" or "DD Month, Name"
+    Group lines into chunks of at most max_length characters, lazily.
 
-    Returns:
-        Tuple of (most_popular_date_str, count) or (None, 0) if no valid birthdays
-        Date format: "DD Month" (e.g., "1 January")
+    Lines are joined with newlines and never split, except lines longer than
+    max_length, which are hard-wrapped into pieces of max_length. Works on any
+    iterable, so lines can be streamed straight from a database cursor.
     """
-    date_counts = {}
+    chunk = []
+    # Length of "\n".join(chunk), kept up to date instead of recomputed
+    length = 0
 
-    for birthday in birthday_strings:
-        if not birthday or not isinstance(birthday, str):
-            continue
-        try:
-            # Extract the date part safely
-            parts = birthday.split(",", 1)
-            if not parts:
-                continue
-            date_str = parts[0].strip()
-
-            # Try parsing with year first
-            try:
-                date_dt = datetime.strptime(date_str, "%d %B %Y")
-            except ValueError:
-                # Try without year
-                try:
-                    date_dt = datetime.strptime(date_str, "%d %B")
-                except ValueError:
-                    continue
+    for line in lines:
+        if len(line) > max_length:
+            if chunk:
+                yield "\n".join(chunk)
+                chunk, length = [], 0
+            while len(line) > max_length:
+                yield line[:max_length]
+                line = line[max_length:]
 
-            # Format as "D Month" or "DD Month" (e.g., "1 January" or "15 January")
-            # Remove leading zero from day
-            day = date_dt.day
-            month = date_dt.strftime("%B")
-            date_key = f"{day} {month}"
+        if chunk and length + 1 + len(line) > max_length:
+            yield "\n".join(chunk)
+            chunk, length = [], 0
 
-            date_counts[date_key] = date_counts.get(date_key, 0) + 1
-        except (ValueError, IndexError):
-            continue  # Skip birthdays with errors
+        length += len(line) + (1 if chunk else 0)
+        chunk.append(line)
 
-    if date_counts:
-        most_popular_date, count = max(date_counts.items(), key=lambda x: x[1])
-        return most_popular_date, count
-    return None, 0
+    if chunk:
+        yield "\n".join(chunk)
 
 
-def split_message(message: str, max_length: int = 4096) -> list[str]:
+def split_message(message: str, max_length: int = MAX_MESSAGE_LENGTH) -> list[str]:
     """Splits a message into chunks of full lines, each within the specified maximum length."""
-    lines = message.split("\n")
-    chunks = []
-    current_chunk = []
-
-    for line in lines:
-        if sum(len(chunk) + 1 for chunk in current_chunk) + len(line) + 1 > max_length:
-            chunks.append("\n".join(current_chunk))
-            current_chunk = []
-
-        current_chunk.append(line)
-
-    if current_chunk:
-        chunks.append("\n".join(current_chunk))
-
-    return chunks
+    return list(split_lines(message.split("\n"), max_length))
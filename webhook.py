@@ -0,0 +1,127 @@
+"""
+Webhook ingestion: a small HTTP server that receives updates pushed by Telegram.
+
+Requests are answered as soon as the update is parsed and its secret token
+checked, and the update itself is handled by a pool of worker threads, so a
+slow handler never holds up Telegram's delivery of the next update.
+"""
+
+import hmac
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable
+
+WEBHOOK_HOST = "0.0.0.0"
+# The port the Dockerfile exposes
+WEBHOOK_PORT = 8000
+WEBHOOK_PATH = "/webhook"
+WORKERS = 4
+# Telegram updates are a few KB, anything much larger is not an update
+MAX_BODY_BYTES = 1024 * 1024
+SECRET_TOKEN_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class TWebhookRequestHandler(BaseHTTPRequestHandler):
+    server: "TWebhookServer"
+
+    def do_POST(self):
+        if self.path != self.server.path:
+            self._reply(404)
+            return
+
+        secret_token = self.server.secret_token
+        received_token = self.headers.get(SECRET_TOKEN_HEADER, "")
+        if secret_token and not hmac.compare_digest(
+            received_token.encode(), secret_token.encode()
+        ):
+            logging.warning(
+                f"Rejected webhook request with a wrong secret token from {self.client_address[0]}"
+            )
+            self._reply(403)
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+        except ValueError:
+            self._reply(400)
+            return
+        if length < 0:
+            # rfile.read() would block until the client disconnects
+            self._reply(400)
+            return
+        if length > MAX_BODY_BYTES:
+            self._reply(413)
+            return
+
+        try:
+            update = json.loads(self.rfile.read(length))
+        except ValueError:
+            self._reply(400)
+            return
+        if not isinstance(update, dict):
+            self._reply(400)
+            return
+
+        self.server.submit(update)
+        self._reply(200)
+
+    def _reply(self, status: int) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logging.debug(f"Webhook request: {format % args}")
+
+
+class TWebhookServer(ThreadingHTTPServer):
+    """
+    HTTP server passing every update POSTed to `path` to `handle_update`.
+
+    Updates are dicts in the Bot API JSON format. Requests without the
+    matching X-Telegram-Bot-Api-Secret-Token header are rejected when a
+    secret token is configured.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        handle_update: Callable[[dict], None],
+        secret_token: str | None = None,
+        host: str = WEBHOOK_HOST,
+        port: int = WEBHOOK_PORT,
+        path: str = WEBHOOK_PATH,
+        workers: int = WORKERS,
+    ):
+        super().__init__((host, port), TWebhookRequestHandler)
+        self.handle_update = handle_update
+        self.secret_token = secret_token
+        self.path = path
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="webhook"
+        )
+
+    def submit(self, update: dict) -> None:
+        self._executor.submit(self._process, update)
+
+    def start(self) -> threading.Thread:
+        """Serve requests in a background thread."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        """Stop accepting requests and finish handling the queued updates."""
+        self.shutdown()
+        self.server_close()
+        self._executor.shutdown(wait=True)
+
+    def _process(self, update: dict) -> None:
+        try:
+            self.handle_update(update)
+        except Exception as e:
+            logging.error(f"Error processing update {update.get('update_id')}: {e}")